@@ -40,6 +40,16 @@ STEP #7. Archiving all files from mountpoint.
 STEP #8. Cleanup. All temporary created during backup images, snapshots,
 mounted devices will be removed.
 
+Drives are processed by `--workers` parallel workers, every drive is mounted
+to its own directory under KD_CEPH_BACKUP_MOUNTPOINT.
+
+With `--incremental` steps 3-8 are replaced with raw export of changed
+extents: a `kd-backup-*` snapshot is created and `rbd export-diff` is run
+from the previous backup snapshot of the drive (the first backup exports the
+whole image). Only the latest backup snapshot is kept. Every run writes a
+manifest which lists snapshot and base snapshot of every diff, so a drive is
+restored by `rbd import-diff` of the chain of diffs into an empty image.
+
 
 NOTE#1 All images from specified pool will be proceed. There is no
 options to to apply any filters for now.
@@ -52,6 +62,7 @@ NOTE#5 Ceph user should have 'class-read object_prefix rbd_children` right
 
 import argparse
 import datetime
+import json
 import logging
 import os
 import random
@@ -60,8 +71,12 @@ import subprocess
 import sys
 import zipfile
 from contextlib import contextmanager
+from distutils.spawn import find_executable
+from multiprocessing.pool import ThreadPool
 
 LOCKFILE = '/var/lock/kd-ceph-backup.lock'
+# Incremental backups are exported from the last snapshot with this prefix
+SNAPSHOT_PREFIX = 'kd-backup-'
 
 logger = logging.getLogger("kd_master_backup")
 logger.setLevel(logging.INFO)
@@ -108,6 +123,37 @@ def lock(lockfile):
     return decorator
 
 
+@contextmanager
+def compressed_output(path):
+    """ Yields stream which is gzipped (by pigz if it is installed) into
+    `path`. The file appears only if everything was written successfully.
+    """
+    compressor = ['pigz' if find_executable('pigz') else 'gzip', '-c']
+    tmp_path = path + '.incomplete'
+    with open(tmp_path, 'wb') as f:
+        proc = subprocess.Popen(compressor, stdin=subprocess.PIPE, stdout=f)
+    try:
+        try:
+            yield proc.stdin
+        finally:
+            proc.stdin.close()
+            proc.wait()
+        if proc.returncode:
+            raise BackupError("Compressor has failed with code {0}".format(
+                proc.returncode))
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.rename(tmp_path, path)
+
+
+def write_manifest(path, manifest):
+    with open(path + '.incomplete', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(path + '.incomplete', path)
+
+
 def get_local_keyring_path(keyring):
     # Don't blame me for this hardcode. There 26 more of them scattered
     # all over the project. So
@@ -118,7 +164,7 @@ def get_local_keyring_path(keyring):
 
 
 def do_ceph_backup(backup_dir, pool, monitors, keyring, auth_user, skip_errors,
-                   callback, **kwargs):
+                   callback, workers=1, incremental=False, **kwargs):
     """ Backup all CEPH drives for pool
     """
     try:
@@ -138,13 +184,7 @@ def do_ceph_backup(backup_dir, pool, monitors, keyring, auth_user, skip_errors,
     logger.debug({'pool': pool, 'monitors': monitors, 'keyring': keyring,
                  'auth_user': auth_user})
 
-    mountpoint = os.environ.get('KD_CEPH_BACKUP_MOUNTPOINT', '/mnt')
-    if not os.path.exists(mountpoint):
-        os.makedirs(mountpoint)
-    if os.path.ismount(mountpoint):
-        raise BackupError("Mountpoint `{0}` already mounted. Please, "
-                          "release it or specify free mount point via"
-                          " KD_CEPH_BACKUP_MOUNTPOINT".format(mountpoint))
+    mountpoint_base = os.environ.get('KD_CEPH_BACKUP_MOUNTPOINT', '/mnt')
 
     if not all([pool, monitors, keyring, auth_user]):
         raise BackupError("Insufficient ceph parameters")
@@ -154,7 +194,7 @@ def do_ceph_backup(backup_dir, pool, monitors, keyring, auth_user, skip_errors,
 
     def get_image_format(image_name):
         info_info_raw = subprocess.check_output(
-            rbd_with_creds + ['info', '{0}/{1}'.format(pool, drive)])
+            rbd_with_creds + ['info', '{0}/{1}'.format(pool, image_name)])
         return int(info_info_raw.split('\n')[4].split(":")[1])
 
     @contextmanager
@@ -213,14 +253,31 @@ def do_ceph_backup(backup_dir, pool, monitors, keyring, auth_user, skip_errors,
                 fd.write(device_index)
 
     @contextmanager
-    def mount_context(device):
+    def mountpoint_context(drive):
+        # every drive gets its own mount point, so drives can be backed up
+        # in parallel
+        mountpoint = os.path.join(mountpoint_base,
+                                  'kd-ceph-backup-{0}'.format(drive))
+        if not os.path.exists(mountpoint):
+            os.makedirs(mountpoint)
+        if os.path.ismount(mountpoint):
+            raise BackupError("Mountpoint `{0}` already mounted. Please, "
+                              "release it or specify free mount point via"
+                              " KD_CEPH_BACKUP_MOUNTPOINT".format(mountpoint))
+        try:
+            yield mountpoint
+        finally:
+            os.rmdir(mountpoint)
+
+    @contextmanager
+    def mount_context(device, mountpoint):
         subprocess.check_call(['mount', device, mountpoint])
         try:
             yield mountpoint
         finally:
             subprocess.check_call(['umount', mountpoint])
 
-    def fsck(device):
+    def fsck(device, mountpoint):
         # mount/unmount needs to replay journal
         logger.debug('File system `{0}` check.'.format(device))
         subprocess.check_call(['mount', device, mountpoint])
@@ -237,17 +294,15 @@ def do_ceph_backup(backup_dir, pool, monitors, keyring, auth_user, skip_errors,
             raise BackupError(
                 "Callback handler has failed with `{0}`".format(err))
 
-    @lock(LOCKFILE)
     def run_backup(drive):
-        with clone(drive) as drive:
+        with clone(drive) as drive, mountpoint_context(drive) as mountpoint:
             with rbd_device_context(drive) as device:
-                fsck(device)
-                with mount_context(device) as src:
+                fsck(device, mountpoint)
+                with mount_context(device, mountpoint) as src:
                     timestamp = datetime.datetime.today().isoformat()
                     result = os.path.join(backup_dir, "{0}-{1}.zip".format(
                         drive, timestamp))
-                    tmp_result = os.path.join(backup_dir, "{0}-{1}.zip".format(
-                        drive, timestamp))
+                    tmp_result = result + '.incomplete'
                     try:
                         with zipfile.ZipFile(tmp_result, 'w',
                                              zipfile.ZIP_DEFLATED) as zf:
@@ -260,27 +315,105 @@ def do_ceph_backup(backup_dir, pool, monitors, keyring, auth_user, skip_errors,
                     logger.info('Backup created: {0}'.format(result))
                     if callback:
                         handle(callback, result)
+        return {'drive': drive[:-len('_child')], 'format': 'zip',
+                'path': os.path.basename(result),
+                'size': os.path.getsize(result)}
+
+    def get_backup_snapshots(drive):
+        """ Names of incremental backup snapshots, the oldest first. """
+        snapshots = json.loads(subprocess.check_output(
+            rbd_with_creds + ['snap', 'ls', '--format', 'json',
+                              '{0}/{1}'.format(pool, drive)]) or '[]')
+        return [snap['name'] for snap in sorted(snapshots,
+                                                key=lambda s: s['id'])
+                if snap['name'].startswith(SNAPSHOT_PREFIX)]
+
+    def run_diff_backup(drive, snap_id):
+        previous = get_backup_snapshots(drive)
+        base = previous[-1] if previous else None
+        snap_name = SNAPSHOT_PREFIX + snap_id
+        snap = '{0}/{1}@{2}'.format(pool, drive, snap_name)
+        result = os.path.join(backup_dir, "{0}-{1}.diff.gz".format(
+            drive, snap_id))
+        logger.debug("Snapshot `{0}` creating".format(snap))
+        subprocess.check_call(rbd_with_creds + ['snap', 'create', snap])
+        cmd = rbd_with_creds + ['export-diff']
+        if base is not None:
+            cmd.extend(['--from-snap', base])
+        cmd.extend([snap, '-'])
+        try:
+            with compressed_output(result) as out:
+                proc = subprocess.Popen(cmd, stdout=out)
+                if proc.wait():
+                    raise BackupError("Export of `{0}` has failed with code "
+                                      "{1}".format(snap, proc.returncode))
+        except:
+            subprocess.call(rbd_with_creds + ['snap', 'rm', snap])
+            raise
+        for old in previous:
+            logger.debug("Snapshot `{0}/{1}@{2}` removing".format(
+                pool, drive, old))
+            subprocess.check_call(rbd_with_creds + [
+                'snap', 'rm', '{0}/{1}@{2}'.format(pool, drive, old)])
+        logger.info('Backup created: {0}'.format(result))
+        if callback:
+            handle(callback, result)
+        return {'drive': drive, 'format': 'rbd-diff',
+                'path': os.path.basename(result),
+                'size': os.path.getsize(result),
+                'snapshot': snap_name, 'base': base}
+
+    @lock(LOCKFILE)
+    def run_all(drives):
+        started = datetime.datetime.today()
+        snap_id = started.strftime("%Y%m%dT%H%M%S")
+
+        def worker(drive):
+            logger.info('Proceed drive {0}'.format(drive))
+            try:
+                if incremental:
+                    return run_diff_backup(drive, snap_id)
+                return run_backup(drive)
+            except BackupError as err:
+                if not skip_errors:
+                    return err
+                logger.warning("Drive `{0}` not backuped due error '{1}'. "
+                               "Skipped".format(drive, err))
+            except Exception as err:
+                logger.exception("Drive `{0}` not backuped".format(drive))
+                return err
+
+        pool_ = ThreadPool(max(1, workers))
+        try:
+            results = pool_.map(worker, drives, chunksize=1)
+        finally:
+            pool_.close()
+            pool_.join()
+
+        entries = [r for r in results if isinstance(r, dict)]
+        write_manifest(
+            os.path.join(backup_dir, "ceph_backup_{0}.json".format(
+                started.isoformat())),
+            {'timestamp': started.isoformat(), 'pool': pool,
+             'drives': entries})
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise errors[0]
 
     logger.info('Gathering images list')
     drives = subprocess.check_output(rbd_with_creds + ['ls', pool]).split()
     logger.info('Found drives: {0}'.format(drives))
 
-    # up kernel modules
-    subprocess.check_call(['modprobe', 'rbd'])
+    if not incremental:
+        # up kernel modules
+        subprocess.check_call(['modprobe', 'rbd'])
 
-    secret = subprocess.check_output(['ceph-authtool', '--print-key', keyring,
-                                      '-n', 'client.{0}'.format(auth_user)])
-    logger.debug("Extractred secret key: '{0}'".format(secret))
+        secret = subprocess.check_output(
+            ['ceph-authtool', '--print-key', keyring,
+             '-n', 'client.{0}'.format(auth_user)])
+        logger.debug("Extractred secret key: '{0}'".format(secret))
 
-    for drive in drives:
-        logger.info('Proceed drive {0}'.format(drive))
-        try:
-            run_backup(drive)
-        except BackupError as err:
-            if not skip_errors:
-                raise
-            logger.warning("Drive `{0}` not backuped due error '{1}'. "
-                           "Skipped".format(drive, err))
+    run_all(drives)
 
 
 def parse_args(args):
@@ -306,6 +439,12 @@ def parse_args(args):
     parser.add_argument("-e", '--callback',
                         help='Callback for each backup file (backup path '
                         'passed as a 1st arg)')
+    parser.add_argument("-w", '--workers', type=int, default=1,
+                        help='Number of drives backed up in parallel. '
+                        'Default: 1')
+    parser.add_argument("-i", '--incremental', action='store_true',
+                        help='Export changed extents since the previous '
+                        'backup with `rbd export-diff`')
     parser.set_defaults(func=do_ceph_backup)
 
     return parser.parse_args(args)
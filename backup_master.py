@@ -26,6 +26,7 @@ import time
 import argparse
 import datetime
 import grp
+import json
 import logging
 import os
 import pwd
@@ -34,6 +35,7 @@ import subprocess
 import sys
 import tempfile
 import zipfile
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger("kd_master_backup")
 logger.setLevel(logging.INFO)
@@ -58,6 +60,12 @@ LICENSE = '/var/opt/kuberdock/.license'
 CEPH_SETTINGS = '/var/opt/kuberdock/kubedock/ceph_settings.py'
 CEPH_CONFIG = '/var/lib/kuberdock/conf'
 LOCKFILE = '/var/lock/kd-master-backup.lock'
+# Names of the postgres dump in archive: single file in custom format or
+# directory format dump made by parallel jobs
+PG_DUMP_FILE = 'postgresql.backup'
+PG_DUMP_DIR = 'postgresql'
+# Durations and sizes of backed up resources
+STATS_FILE = 'resources.json'
 
 
 def lock(lockfile):
@@ -94,11 +102,28 @@ def sudo(cmd, as_user):
     return ["sudo", "-Hiu", as_user] + cmd
 
 
+def is_compressed(arcname):
+    """ Postgres dumps are compressed by pg_dump already. """
+    return (arcname == PG_DUMP_FILE or
+            arcname.startswith(PG_DUMP_DIR + os.sep))
+
+
 def zipdir(path, ziph):
     for root, dirs, files in os.walk(path):
         for fn in files:
             full_fn = os.path.join(root, fn)
-            ziph.write(full_fn, os.path.relpath(full_fn, path))
+            arcname = os.path.relpath(full_fn, path)
+            # compressing already compressed data again only wastes time
+            ziph.write(full_fn, arcname,
+                       zipfile.ZIP_STORED if is_compressed(arcname)
+                       else zipfile.ZIP_DEFLATED)
+
+
+def path_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, fn))
+               for root, _, files in os.walk(path) for fn in files)
 
 
 def rmtree(path):
@@ -107,7 +132,17 @@ def rmtree(path):
     subprocess.call(cmd)
 
 
-def pg_dump(src, dst, db_username="postgres"):
+def pg_dump(src, dst, db_username="postgres", jobs=1):
+    """ Dump database to file in custom format or, if `jobs` > 1, to
+    directory in directory format using `jobs` parallel jobs. Directory
+    dump is written by postgres user, so its parent must be accessible and
+    writable by postgres.
+    """
+    if jobs > 1:
+        cmd = sudo(nice(["pg_dump", "-C", "-Fd", "-j", str(jobs), "-f", dst,
+                         "-U", db_username, src], NICENESS), "postgres")
+        subprocess.check_call(cmd)
+        return
     cmd = sudo(nice(["pg_dump", "-C", "-Fc", "-U",
                      db_username, src], NICENESS), "postgres")
     with open(dst, 'wb') as out:
@@ -120,7 +155,7 @@ def etcd_backup(src, dst):
     subprocess.check_call(cmd, stdout=subprocess.PIPE)
 
 
-def pg_restore(src, db_username="postgres"):
+def pg_restore(src, db_username="postgres", jobs=1):
     cmd = sudo(["psql", "-c", "DROP DATABASE {}".format(DATABASES[0])],
                "postgres")
     subprocess.check_call(cmd)
@@ -129,8 +164,11 @@ def pg_restore(src, db_username="postgres"):
         DATABASES[0])], "postgres")
     subprocess.check_call(cmd)
 
-    cmd = sudo(["pg_restore", "-U", db_username, "-n", "public",
-                "-1", "-d", "kuberdock", src],
+    # a single transaction can't be used by parallel jobs, database is
+    # recreated anyway
+    options = ["-j", str(jobs)] if jobs > 1 else ["-1"]
+    cmd = sudo(["pg_restore", "-U", db_username, "-n", "public"] +
+               options + ["-d", "kuberdock", src],
                "postgres")
     subprocess.check_call(cmd)
 
@@ -195,26 +233,60 @@ class BackupResource(object):
 
 class PostgresResource(BackupResource):
 
+    # number of parallel pg_dump/pg_restore jobs
+    jobs = 1
+
     @classmethod
     def backup(cls, dst):
+        if cls.jobs > 1:
+            # dst is accessible by root only, so postgres writes directory
+            # dump to a temporary directory of its own, then it's moved to dst
+            postgres_tmp = tempfile.mkdtemp(prefix="postgres-",
+                                            suffix="-inprogress")
+            try:
+                os.chown(postgres_tmp, pwd.getpwnam("postgres").pw_uid, -1)
+                pg_dump(DATABASES[0], os.path.join(postgres_tmp, PG_DUMP_DIR),
+                        jobs=cls.jobs)
+                result = os.path.join(dst, PG_DUMP_DIR)
+                shutil.move(os.path.join(postgres_tmp, PG_DUMP_DIR), result)
+            finally:
+                rmtree(postgres_tmp)
+            return result
+
         _, postgres_tmp = tempfile.mkstemp(prefix="postgres-", dir=dst,
                                            suffix='.backup.in_progress')
         pg_dump(DATABASES[0], postgres_tmp)
 
-        result = os.path.join(dst, "postgresql.backup")
+        result = os.path.join(dst, PG_DUMP_FILE)
         os.rename(postgres_tmp, result)
         return result
 
     @classmethod
     def restore(cls, zip_archive, **kwargs):
+        uid = pwd.getpwnam("postgres").pw_uid
+        names = zip_archive.namelist()
+        if PG_DUMP_FILE not in names:
+            src = tempfile.mkdtemp()
+            try:
+                zip_archive.extractall(
+                    src, [n for n in names
+                          if n.startswith(PG_DUMP_DIR + '/')])
+                for root, dirs, files in os.walk(src):
+                    for fn in dirs + files:
+                        os.chown(os.path.join(root, fn), uid, -1)
+                os.chown(src, uid, -1)
+                pg_restore(os.path.join(src, PG_DUMP_DIR), jobs=cls.jobs)
+            finally:
+                rmtree(src)
+            return src
+
         fd, path = tempfile.mkstemp()
         try:
-            uid = pwd.getpwnam("postgres").pw_uid
             os.fchown(fd, uid, -1)
             with os.fdopen(fd, 'w') as tmp:
-                shutil.copyfileobj(zip_archive.open('postgresql.backup'), tmp)
-                tmp.seek(0)
-                pg_restore(path)
+                shutil.copyfileobj(zip_archive.open(PG_DUMP_FILE), tmp)
+                tmp.flush()
+                pg_restore(path, jobs=cls.jobs)
         finally:
             os.remove(path)
         return path
@@ -316,7 +388,7 @@ class KubeConfigResource(BackupResource):
         return result
 
     @classmethod
-    def restore(cls, zip_archive):
+    def restore(cls, zip_archive, **kwargs):
         src = tempfile.mkdtemp()
         file_to_extract = filter(lambda x: x.startswith('conf/'),
                                  zip_archive.namelist())
@@ -430,8 +502,30 @@ restore_chain = [PostgresResource, EtcdDataResource, SSHKeysResource,
                  SharedNginxConfigResource, KubeConfigResource]
 
 
+def backup_resource(res, dst):
+    """ Backup one resource. Returns its stats or exception. """
+    logger.debug("Starting backup of {} resource".format(res.__name__))
+    started = time.time()
+    try:
+        subresult = res.backup(dst)
+    except Exception as err:
+        logger.error("%s backup error: %s" % (res, err))
+        return err
+    duration = time.time() - started
+    paths = subresult.split(', ') if subresult else []
+    size = sum(path_size(path) for path in paths)
+    if subresult:
+        logger.info("File(s) collected: {0}".format(subresult))
+    logger.info("{0} backed up in {1:.2f}s, {2} bytes".format(
+        res.__name__, duration, size))
+    return {'resource': res.__name__, 'duration': round(duration, 3),
+            'size': size, 'files': [os.path.relpath(path, dst)
+                                    for path in paths]}
+
+
 @lock(LOCKFILE)
-def do_backup(backup_dir, callback, skip_errors, **kwargs):
+def do_backup(backup_dir, callback, skip_errors, workers=None, pg_jobs=1,
+              **kwargs):
 
     if not os.path.exists(backup_dir):
         os.makedirs(backup_dir)
@@ -443,21 +537,34 @@ def do_backup(backup_dir, callback, skip_errors, **kwargs):
     logger.addHandler(logging.FileHandler(os.path.join(backup_dst,
                       'main.log')))
 
-    for res in backup_chain:
-        try:
-            logger.debug("Starting backup of {} resource".format(res.__name__))
-            subresult = res.backup(backup_dst)
-            if subresult:
-                logger.info("File(s) collected: {0}".format(subresult))
-        except subprocess.CalledProcessError as err:
-            logger.error("%s backup error: %s" % (res, err))
-            if not skip_errors:
-                raise
-
+    # resources are independent and write to different files, so all of
+    # them are backed up concurrently by default
+    PostgresResource.jobs = pg_jobs
+    pool = ThreadPool(workers or len(backup_chain))
+    try:
+        results = pool.map(lambda res: backup_resource(res, backup_dst),
+                           backup_chain, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    for res in results:
+        if not isinstance(res, Exception):
+            continue
+        if not skip_errors or not isinstance(res,
+                                             subprocess.CalledProcessError):
+            raise res
+    stats = [res for res in results if isinstance(res, dict)]
+    with open(os.path.join(backup_dst, STATS_FILE), 'w') as stats_file:
+        json.dump(stats, stats_file, indent=2)
+
+    started = time.time()
     result = os.path.join(backup_dir, timestamp + ".zip")
-    with zipfile.ZipFile(result, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    with zipfile.ZipFile(result, 'w', zipfile.ZIP_DEFLATED,
+                         allowZip64=True) as zipf:
         zipdir(backup_dst, zipf)
     rmtree(backup_dst)
+    logger.info("Archive created in {0:.2f}s, {1} bytes".format(
+        time.time() - started, os.path.getsize(result)))
 
     logger.info('Backup finished successfully: {0}'.format(result))
     if callback:
@@ -467,7 +574,7 @@ def do_backup(backup_dir, callback, skip_errors, **kwargs):
 
 
 @lock(LOCKFILE)
-def do_restore(backup_file, drop_nodes, skip_errors, **kwargs):
+def do_restore(backup_file, drop_nodes, skip_errors, pg_jobs=1, **kwargs):
     """ Restore from backup file.
     If skip_error is True it will not interrupt restore due to errors
     raised on some step from restore_chain.
@@ -483,6 +590,7 @@ def do_restore(backup_file, drop_nodes, skip_errors, **kwargs):
 
     if drop_nodes:
         restore_chain.remove(EtcdDataResource)
+    PostgresResource.jobs = pg_jobs
 
     with zipfile.ZipFile(backup_file, 'r') as zip_archive:
         for res in restore_chain:
@@ -531,6 +639,13 @@ def parse_args(args):
     parser_backup.add_argument(
         "-e", '--callback', help='Callback for each backup file'
         ' (backup path passed as a 1st arg)')
+    parser_backup.add_argument(
+        "-w", '--workers', type=int,
+        help='Number of resources backed up concurrently. Default: all')
+    parser_backup.add_argument(
+        "-j", '--pg-jobs', type=int, default=1, dest='pg_jobs',
+        help='Dump database with this number of parallel jobs (directory '
+             'format). Default: 1')
     parser_backup.set_defaults(func=do_backup)
 
     parser_restore = subparsers.add_parser('restore', help='restore')
@@ -540,6 +655,10 @@ def parse_args(args):
              "if you are going to re-deploy nodes thereafter)."
              " Note that this option also implies removing "
              "all user pods from the DB dump.")
+    parser_restore.add_argument(
+        "-j", '--pg-jobs', type=int, default=1, dest='pg_jobs',
+        help='Restore database with this number of parallel jobs. '
+             'Default: 1')
     parser_restore.add_argument('backup_file')
     parser_restore.set_defaults(func=do_restore)
 
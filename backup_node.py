@@ -25,6 +25,7 @@
 Node backup script
 """
 
+import errno
 import sys
 import datetime
 import os
@@ -34,7 +35,10 @@ import logging
 import tarfile
 import random
 import string
+import json
 from contextlib import contextmanager
+from distutils.spawn import find_executable
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger("kd_master_backup")
 logger.setLevel(logging.INFO)
@@ -50,6 +54,9 @@ stdout_handler.setFormatter(formatter)
 
 STORAGE_LOCATION = '/var/lib/kuberdock/storage/'
 LOCKFILE = '/var/lock/kd-node-backup.lock'
+MANIFEST = 'manifest.json'
+# Incremental backups are sent from the last snapshot with this prefix
+SNAPSHOT_PREFIX = 'kd-backup-'
 
 
 def lock(lockfile):
@@ -98,36 +105,138 @@ def get_zfs_mountpoints():
     return dict(a.split('\t') for a in result_raw.split('\n') if a)
 
 
-def make_tar_backup(name, src, dst, skip_errors=False):
+def get_compressor(threads=None):
+    """ Command which compresses stdin to stdout. pigz uses all cores
+    (or `threads` of them), plain gzip is used if pigz is not installed.
+    """
+    if find_executable('pigz'):
+        cmd = ['pigz', '-c']
+        if threads:
+            cmd.extend(['-p', str(threads)])
+        return cmd
+    return ['gzip', '-c']
+
+
+@contextmanager
+def compressed_output(path, compressor):
+    """ Yields stream which is compressed by `compressor` into `path`.
+    The file appears only if everything was written successfully.
+    """
+    tmp_path = path + '.incomplete'
+    with open(tmp_path, 'wb') as f:
+        proc = subprocess.Popen(compressor, stdin=subprocess.PIPE, stdout=f)
+    broken_pipe = None
+    try:
+        try:
+            try:
+                yield proc.stdin
+            finally:
+                proc.stdin.close()
+        except IOError as err:
+            # compressor has exited before reading everything, its exit code
+            # tells more than the broken pipe
+            if err.errno != errno.EPIPE:
+                raise
+            broken_pipe = err
+        finally:
+            proc.wait()
+        if proc.returncode:
+            raise BackupError("Compressor `{0}` has failed with code "
+                              "{1}".format(' '.join(compressor),
+                                           proc.returncode))
+        if broken_pipe is not None:
+            raise broken_pipe
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.rename(tmp_path, path)
+
+
+def make_tar_backup(name, src, dst, skip_errors=False, compressor=None):
     """ Make a backup by archiving all files in src
     to tar.gz  located in dst
     """
     result = os.path.join(dst, "{0}.tar.gz".format(name))
-    tmp_result = result + '.incomplete'
     logger.debug({"dst": result})
 
-    with tarfile.open(tmp_result, "w:gz") as tgzf:
-        for fn in iterate_src(src):
-            try:
-                logger.debug([fn, os.path.relpath(fn, src)])
-                tgzf.add(fn, arcname=os.path.relpath(fn, src))
-            except (IOError, OSError) as err:
-                if not skip_errors:
-                    if os.path.exists(tmp_result):
-                        os.remove(tmp_result)
-                    raise
-                logger.warning("File `{0}` backup skipped due to "
-                               "error `{1}`. Skipped".format(fn, err))
-    os.rename(tmp_result, result)
+    with compressed_output(result, compressor or get_compressor()) as out:
+        with tarfile.open(fileobj=out, mode="w|") as tarf:
+            for fn in iterate_src(src):
+                try:
+                    logger.debug([fn, os.path.relpath(fn, src)])
+                    tarf.add(fn, arcname=os.path.relpath(fn, src),
+                             recursive=False)
+                except (IOError, OSError) as err:
+                    if not skip_errors:
+                        raise
+                    logger.warning("File `{0}` backup skipped due to "
+                                   "error `{1}`. Skipped".format(fn, err))
     return result
 
 
+def get_zfs_dataset(src, zfs_map=None):
+    if zfs_map is None:
+        try:
+            zfs_map = get_zfs_mountpoints()
+        except OSError:
+            raise NonZFSException("ZFS not installed")
+    logger.debug("zfs map: {}".format(zfs_map))
+    if src not in zfs_map:
+        raise NonZFSException("`src` is not ZFS volume")
+    return zfs_map[src]
+
+
+def get_backup_snapshots(dataset):
+    """ Snapshots of incremental backups, the oldest first. """
+    result_raw = subprocess.check_output(
+        ["zfs", "list", "-H", "-t", "snapshot", "-d", "1", "-s", "creation",
+         "-o", "name", dataset])
+    return [name for name in result_raw.split('\n')
+            if name.partition('@')[2].startswith(SNAPSHOT_PREFIX)]
+
+
+def make_zfs_backup(name, dataset, dst, snap_id, compressor=None):
+    """ Send ZFS snapshot of the dataset to gzipped stream located in dst.
+    The stream is incremental from the previous backup snapshot, if there
+    is one. Only the last backup snapshot is kept.
+    Returns path of the stream, its snapshot and the base snapshot.
+    """
+    previous = get_backup_snapshots(dataset)
+    base = previous[-1] if previous else None
+    snap_name = '{0}@{1}{2}'.format(dataset, SNAPSHOT_PREFIX, snap_id)
+    result = os.path.join(dst, "{0}.{1}.zfs.gz".format(name, snap_id))
+    logger.debug({"dst": result, "base": base, "snapshot": snap_name})
+
+    subprocess.check_call(["zfs", "snap", snap_name])
+    try:
+        cmd = ["zfs", "send"]
+        if base is not None:
+            cmd.extend(["-i", base])
+        cmd.append(snap_name)
+        with compressed_output(result, compressor or get_compressor()) as out:
+            proc = subprocess.Popen(cmd, stdout=out)
+            if proc.wait():
+                raise BackupError("`{0}` has failed with code {1}".format(
+                    ' '.join(cmd), proc.returncode))
+    except:
+        subprocess.call(["zfs", "destroy", snap_name])
+        raise
+    for snapshot in previous:
+        subprocess.check_call(["zfs", "destroy", snapshot])
+    return result, snap_name, base
+
+
 @contextmanager
 def mount_context(device):
     if device is None:
         yield None
         return
-    mountpoint = os.environ.get('KD_CEPH_BACKUP_MOUNTPOINT', '/mnt')
+    # every snapshot gets its own mount point, so volumes can be backed up
+    # in parallel
+    mountpoint = os.path.join(
+        os.environ.get('KD_CEPH_BACKUP_MOUNTPOINT', '/mnt'),
+        'kd-node-backup-{0}'.format(device.rsplit('@', 1)[-1]))
     if not os.path.exists(mountpoint):
         os.makedirs(mountpoint)
     if os.path.ismount(mountpoint):
@@ -139,20 +248,12 @@ def mount_context(device):
         yield mountpoint
     finally:
         subprocess.check_call(['umount', mountpoint])
+        os.rmdir(mountpoint)
 
 
 @contextmanager
-def zfs_snapshot(src):
-    try:
-        zfs_map = get_zfs_mountpoints()
-    except OSError:
-        raise NonZFSException("ZFS not installed")
-
-    logger.debug("zfs map: {}".format(zfs_map))
-    if src not in zfs_map:
-        raise NonZFSException("`src` is not ZFS volume")
-
-    name = zfs_map[src]
+def zfs_snapshot(src, zfs_map=None):
+    name = get_zfs_dataset(src, zfs_map)
     snap_id = ''.join(random.sample(string.ascii_letters + string.digits, 9))
     snap_name = '@'.join([name, snap_id])
     subprocess.check_call(["zfs", "snap", snap_name])
@@ -164,8 +265,109 @@ def zfs_snapshot(src):
         subprocess.check_call(["zfs", "destroy", snap_name])
 
 
+def backup_volume(user_id, volume_id, dst, skip_errors=False,
+                  incremental=False, compressor=None, zfs_map=None,
+                  snap_id=None):
+    """ Backup one local persistent volume.
+    Returns manifest entry of the volume.
+    """
+    volume_dir = os.path.join(STORAGE_LOCATION, user_id, volume_id)
+    result_dir = os.path.join(dst, user_id)
+    if not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+    logger.debug({"src": STORAGE_LOCATION, "user": user_id,
+                  "volume_id": volume_id})
+    entry = {"user": user_id, "volume": volume_id, "format": "tar.gz"}
+    try:
+        if incremental:
+            dataset = get_zfs_dataset(volume_dir, zfs_map)
+            result, snapshot, base = make_zfs_backup(
+                volume_id, dataset, result_dir, snap_id, compressor)
+            entry.update(format="zfs", snapshot=snapshot, base=base)
+        else:
+            with zfs_snapshot(volume_dir, zfs_map) as snap_name:
+                with mount_context(snap_name) as mountpoint:
+                    result = make_tar_backup(volume_id, mountpoint,
+                                             result_dir, skip_errors,
+                                             compressor)
+    except NonZFSException as err:
+        logger.warning("Possible inconsistent backup "
+                       "creation: {}".format(err))
+        result = make_tar_backup(volume_id, volume_dir,
+                                 result_dir, skip_errors, compressor)
+    entry.update(path=os.path.relpath(result, dst),
+                 size=os.path.getsize(result))
+    logger.info('Backup created: {0}'.format(result))
+    return entry
+
+
+def write_manifest(dst, timestamp, volumes):
+    """ Manifest lists volumes of the backup. For incremental ZFS streams
+    it also lists snapshot and base snapshot, so the chain of streams which
+    makes a full image can be found across backups.
+    """
+    manifest = {"timestamp": timestamp,
+                "volumes": sorted(volumes,
+                                  key=lambda v: (v["user"], v["volume"]))}
+    path = os.path.join(dst, MANIFEST)
+    with open(path + '.incomplete', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(path + '.incomplete', path)
+    return path
+
+
+def backup_volumes(dst, volumes, skip_errors=False, workers=1,
+                   incremental=False, compress_threads=None, timestamp=None):
+    """ Backup `volumes` (list of (user_id, volume_id)) to dst using
+    `workers` parallel workers. Writes manifest of created backups.
+    """
+    compressor = get_compressor(compress_threads)
+    try:
+        zfs_map = get_zfs_mountpoints()
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.debug("ZFS is not available: {0}".format(err))
+        zfs_map = {}
+    snap_id = (timestamp or datetime.datetime.today()).strftime(
+        "%Y%m%dT%H%M%S")
+
+    def worker(volume):
+        user_id, volume_id = volume
+        try:
+            return backup_volume(user_id, volume_id, dst, skip_errors,
+                                 incremental, compressor, zfs_map, snap_id)
+        except Exception as err:
+            logger.error("Backup of volume `{0}/{1}` has failed: "
+                         "{2}".format(user_id, volume_id, err))
+            return err
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        results = pool.map(worker, volumes, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    entries = [r for r in results if not isinstance(r, Exception)]
+    if not os.path.exists(dst):
+        os.makedirs(dst)
+    write_manifest(dst, (timestamp or datetime.datetime.today()).isoformat(),
+                   entries)
+    failed = len(results) - len(entries)
+    if failed:
+        raise BackupError("Backup of {0} volume(s) has failed".format(failed))
+    return entries
+
+
+def list_volumes():
+    return [(user_id, volume_id)
+            for user_id in sorted(os.listdir(STORAGE_LOCATION))
+            for volume_id in sorted(os.listdir(
+                os.path.join(STORAGE_LOCATION, user_id)))]
+
+
 @lock(LOCKFILE)
-def do_node_backup(backup_dir, callback, skip_errors, **kwargs):
+def do_node_backup(backup_dir, callback, skip_errors, workers=1,
+                   incremental=False, compress_threads=None, **kwargs):
 
     def handle(handler, result):
         try:
@@ -175,28 +377,11 @@ def do_node_backup(backup_dir, callback, skip_errors, **kwargs):
             raise BackupError(
                 "Callback handler has failed with `{0}`".format(err))
 
-    timestamp = datetime.datetime.today().isoformat()
-    dst = os.path.join(backup_dir, "local_pv_backup_{0}".format(timestamp))
-    for user_id in os.listdir(STORAGE_LOCATION):
-        user_dir = os.path.join(STORAGE_LOCATION, user_id)
-        for volume_id in os.listdir(user_dir):
-            volume_dir = os.path.join(user_dir, volume_id)
-            result_dir = os.path.join(dst, user_id)
-            if not os.path.exists(result_dir):
-                os.makedirs(result_dir)
-            logger.debug({"src": STORAGE_LOCATION, "user": user_id,
-                          "volume_id": volume_id})
-            try:
-                with zfs_snapshot(volume_dir) as snap_name:
-                    with mount_context(snap_name) as mountpoint:
-                        result = make_tar_backup(volume_id, mountpoint,
-                                                 result_dir, skip_errors)
-            except NonZFSException as err:
-                logging.warning("Possible inconsistent backup "
-                                "creation: {}".format(err))
-                result = make_tar_backup(volume_id, volume_dir,
-                                         result_dir, skip_errors)
-            logger.info('Backup created: {0}'.format(result))
+    timestamp = datetime.datetime.today()
+    dst = os.path.join(backup_dir,
+                       "local_pv_backup_{0}".format(timestamp.isoformat()))
+    backup_volumes(dst, list_volumes(), skip_errors, workers, incremental,
+                   compress_threads, timestamp)
     if callback:
         handle(callback, dst)
 
@@ -217,6 +402,16 @@ def parse_args(args):
     parser.add_argument("-e", '--callback',
                         help='Callback for backup file (backup path '
                         'passed as a 1st arg)')
+    parser.add_argument("-w", '--workers', type=int, default=1,
+                        help='Number of volumes backed up in parallel. '
+                        'Default: 1')
+    parser.add_argument("-t", '--compress-threads', type=int,
+                        dest='compress_threads',
+                        help='Threads used to compress every volume '
+                        '(pigz only). Default: all cores')
+    parser.add_argument("-i", '--incremental', action='store_true',
+                        help='Send ZFS volumes as incremental streams '
+                        'from the previous backup snapshot')
     parser.add_argument(
         'backup_dir', help="Destination for all created files")
     parser.set_defaults(func=do_node_backup)
@@ -23,12 +23,16 @@
 
 import os
 import sys
+import json
+import time
+import errno
+import shutil
 import logging
 import argparse
 import datetime
 
-from distutils import dir_util
 from itertools import tee
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger("kd_node_backup_merge")
 logger.setLevel(logging.INFO)
@@ -42,6 +46,10 @@ formatter = logging.Formatter(
 stdout_handler.setFormatter(formatter)
 
 
+# Manifest of volumes written by backup_node
+MANIFEST = 'manifest.json'
+
+
 class MergeError(Exception):
     pass
 
@@ -92,20 +100,131 @@ def group_by_timestamp(data, precision, skip_errors=False):
 
 
 def will_override(src, group):
-    base = []
+    base = set()
     for item in group:
         path = os.path.join(src, item)
         for root, _, files in os.walk(path):
             for f in files:
                 foo = os.path.relpath(os.path.join(root, f), path)
+                if foo == MANIFEST:
+                    continue
                 if foo in base:
                     return True
-                base.append(foo)
+                base.add(foo)
     return False
 
 
+def move_file(src, dst):
+    """ Rename file, which is metadata-only work within one filesystem.
+    Falls back to copying if `dst` is on another filesystem.
+    """
+    try:
+        os.rename(src, dst)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        shutil.copy2(src, dst)
+        os.remove(src)
+
+
+def move_tree(src, dst, dry_run=False):
+    """ Move all files from `src` to the same paths in `dst` and remove
+    `src`. Manifest is skipped, it is merged separately.
+    Returns number of moved bytes.
+    """
+    moved = 0
+    for root, _, files in os.walk(src):
+        dst_root = os.path.join(dst, os.path.relpath(root, src))
+        if not dry_run and not os.path.isdir(dst_root):
+            os.makedirs(dst_root)
+        for f in files:
+            src_file = os.path.join(root, f)
+            if root == src and f == MANIFEST:
+                continue
+            moved += os.path.getsize(src_file)
+            logger.debug("{0} -> {1}".format(src_file, dst_root))
+            if not dry_run:
+                move_file(src_file, os.path.join(dst_root, f))
+    logger.debug("Removing `{0}`".format(src))
+    if not dry_run:
+        shutil.rmtree(src)
+    return moved
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except IOError:
+        # backups made before manifests were introduced
+        return None
+
+
+def merge_manifests(manifests):
+    """ Join volumes of several manifests, the oldest first. """
+    manifests = sorted((m for m in manifests if m is not None),
+                       key=lambda m: m['timestamp'])
+    if not manifests:
+        return None
+    volumes = []
+    for manifest in manifests:
+        volumes.extend(manifest['volumes'])
+    return {'timestamp': manifests[0]['timestamp'], 'volumes': volumes}
+
+
+def get_image_chain(volumes, user, volume):
+    """ Returns manifest entries needed to reconstruct the full image of
+    the volume from `volumes` (entries of one or several manifests), in
+    the order they must be restored. Tar backups are full images by
+    themselves; incremental ZFS streams are followed through their base
+    snapshots down to the full stream.
+    """
+    entries = [v for v in volumes
+               if v['user'] == user and v['volume'] == volume]
+    if not entries:
+        raise MergeError("No backups of volume `{0}/{1}`".format(
+            user, volume))
+    by_snapshot = dict((e.get('snapshot'), e) for e in entries
+                       if e.get('format') == 'zfs')
+    chain = [entries[-1]]
+    while chain[-1].get('format') == 'zfs' and chain[-1].get('base'):
+        base = by_snapshot.get(chain[-1]['base'])
+        if base is None:
+            raise MergeError("Base snapshot `{0}` of volume `{1}/{2}` is "
+                             "missing".format(chain[-1]['base'], user,
+                                              volume))
+        chain.append(base)
+    return chain[::-1]
+
+
+def write_manifest(path, manifest, dry_run=False):
+    logger.info("Writing manifest `{0}`".format(path))
+    if dry_run or manifest is None:
+        return
+    with open(path + '.incomplete', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(path + '.incomplete', path)
+
+
+def merge_group(backups, group, dry_run=False):
+    """ Merge all folders of the group into the first one.
+    Returns number of merged bytes.
+    """
+    started = time.time()
+    manifest = merge_manifests(read_manifest(os.path.join(backups, item))
+                               for item in group)
+    dst = os.path.join(backups, group[0])
+    merged = sum(move_tree(os.path.join(backups, item), dst, dry_run)
+                 for item in group[1:])
+    write_manifest(os.path.join(dst, MANIFEST), manifest, dry_run)
+    logger.info("Merged {0} folders into `{1}`: {2} bytes in {3:.2f}s".format(
+        len(group) - 1, group[0], merged, time.time() - started))
+    return merged
+
+
 def do_merge(backups, precision, dry_run, include_latest, skip_errors,
-             **kwargs):
+             workers=1, **kwargs):
+    started = time.time()
     data = sorted(os.listdir(backups))
     if not data:
         raise MergeError("Nothing found.")
@@ -114,6 +233,7 @@ def do_merge(backups, precision, dry_run, include_latest, skip_errors,
                                             skip_errors))
     next(helper, None)
 
+    to_merge = []
     for group in groups:
         try:
             next(helper)
@@ -128,11 +248,22 @@ def do_merge(backups, precision, dry_run, include_latest, skip_errors,
             raise MergeError("Group `{0}` contains overlapping files. May be "
                              "precision was bigger then backup "
                              "periodicity.".format(group))
-        dst = os.path.join(backups, group.pop(0))
-        for item in group:
-            src = os.path.join(backups, item)
-            dir_util.copy_tree(src, dst, verbose=True, dry_run=dry_run)
-            dir_util.remove_tree(src, verbose=True, dry_run=dry_run)
+        if len(group) > 1:
+            to_merge.append(group)
+
+    # groups are checked before any of them is touched, and they do not
+    # share folders, so they can be merged in parallel
+    pool = ThreadPool(max(1, workers))
+    try:
+        merged = sum(pool.map(lambda group: merge_group(backups, group,
+                                                        dry_run),
+                              to_merge, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+    logger.info("Merged {0} groups: {1} bytes in {2:.2f}s".format(
+        len(to_merge), merged, time.time() - started))
+    return merged
 
 
 def parse_args(args):
@@ -153,6 +284,9 @@ def parse_args(args):
                         help="Do not touch any files")
     parser.add_argument("-p", '--precision', help="Maximum time gap to group "
                         "in hours. Default: 1hr.", default=1, type=int)
+    parser.add_argument("-w", '--workers', type=int, default=1,
+                        help="Number of groups merged in parallel. "
+                        "Default: 1")
     parser.add_argument("-i", '--include-latest', action='store_true',
                         dest='include_latest', help="Set to also include "
                         "latest (possible incomplete) backup folder")
@@ -28,6 +28,7 @@ fslimit.py storage mydrive1_23=3g
 """
 
 import glob
+import json
 import os
 import re
 import subprocess
@@ -40,6 +41,9 @@ PROJID = '/etc/projid'
 PROJECT_PATTERN = re.compile(r'^(?P<id>\d+):(?P<path>.+)$')
 PROJID_PATTERN = re.compile(r'^(?P<name>.+):(?P<id>\d+)$')
 STORAGE = '/var/lib/kuberdock/storage'
+# Index of projects by name with applied limits. /etc/projects and
+# /etc/projid are generated from it
+STATE = '/var/lib/kuberdock/fslimit.json'
 
 
 def _containers():
@@ -140,56 +144,104 @@ def check_prjquota(fs):
         _exit('Enable project quota for {0}'.format(fs['device']), 2)
 
 
-def fslimit(fs, parent, dirs, abspath=False):
-    delete = set()
-    max_id = 0
-    projects = set()
-    projects_lines = []
-    projid_lines = []
-    if os.path.exists(PROJECTS) and os.path.exists(PROJID):
-        with open(PROJECTS) as projects_file:
-            for project in projects_file.read().splitlines():
-                project_match = PROJECT_PATTERN.match(project)
-                if project_match:
-                    project_dict = project_match.groupdict()
-                    id_ = int(project_dict['id'])
-                    path = project_dict['path']
-                    if path.startswith(parent):
-                        if abspath:
-                            name = path
-                        else:
-                            name = os.path.basename(path)
-                        if name not in dirs:
-                            delete.add(id_)
-                            continue
-                        projects.add(name)
-                    max_id = max([max_id, id_])
-                projects_lines.append(project)
-        with open(PROJID) as projid_file:
-            for projid in projid_file.read().splitlines():
-                projid_match = PROJID_PATTERN.match(projid)
-                if projid_match:
-                    projid_dict = projid_match.groupdict()
-                    id_ = int(projid_dict['id'])
-                    if id_ in delete:
-                        continue
-                    max_id = max([max_id, id_])
-                projid_lines.append(projid)
-    new = _limits(parent)
-    for name, data in new.iteritems():
-        if name not in projects:
-            max_id += 1
-            projects_lines.append('{0}:{1}'.format(max_id, data['path']))
-            projid_lines.append('{0}:{1}'.format(name, max_id))
-    with open(PROJECTS, 'w') as projects_file:
-        projects_file.writelines(l + os.linesep for l in projects_lines)
-    with open(PROJID, 'w') as projid_file:
-        projid_file.writelines(l + os.linesep for l in projid_lines)
-    for name, data in new.items():
-        project = 'project -s {0}'.format(name)
-        limit = 'limit -p bsoft={0} bhard={0} {1}'.format(data['limit'], name)
-        for c in project, limit:
-            subprocess.call(['xfs_quota', '-x', '-c', c, fs['mount_point']])
+def _read_projects():
+    """Build index of projects from /etc/projects and /etc/projid.
+    Applied limits are unknown, so they will be applied again.
+    """
+    paths = {}
+    state = {}
+    if not (os.path.exists(PROJECTS) and os.path.exists(PROJID)):
+        return state
+    with open(PROJECTS) as projects_file:
+        for project in projects_file.read().splitlines():
+            project_match = PROJECT_PATTERN.match(project)
+            if project_match:
+                project_dict = project_match.groupdict()
+                paths[int(project_dict['id'])] = project_dict['path']
+    with open(PROJID) as projid_file:
+        for projid in projid_file.read().splitlines():
+            projid_match = PROJID_PATTERN.match(projid)
+            if projid_match:
+                projid_dict = projid_match.groupdict()
+                id_ = int(projid_dict['id'])
+                if id_ in paths:
+                    state[projid_dict['name']] = {
+                        'id': id_, 'path': paths[id_], 'limit': None}
+    return state
+
+
+def _load_state():
+    try:
+        with open(STATE) as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return _read_projects()
+
+
+def _write(path, lines):
+    with open(path + '.tmp', 'w') as f:
+        f.writelines(l + os.linesep for l in lines)
+    os.rename(path + '.tmp', path)
+
+
+def _save_state(state):
+    _write(STATE, [json.dumps(state, sort_keys=True)])
+
+
+def _write_projects(state):
+    projects = sorted(state.iteritems(), key=lambda item: item[1]['id'])
+    _write(PROJECTS, ['{0}:{1}'.format(data['id'], data['path'])
+                      for name, data in projects])
+    _write(PROJID, ['{0}:{1}'.format(name, data['id'])
+                    for name, data in projects])
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
+
+
+def fslimit(fs, parent, dirs):
+    state = _load_state()
+    projects_changed = False
+    for name, data in state.items():
+        if data['path'].startswith(parent) and name not in dirs:
+            del state[name]
+            projects_changed = True
+    max_id = max([data['id'] for data in state.itervalues()] or [0])
+
+    commands = []
+    applied = []
+    for name, data in sorted(_limits(parent).iteritems()):
+        project = state.get(name)
+        inode = _inode(data['path'])
+        if project is None or project['path'] != data['path']:
+            if project is None:
+                max_id += 1
+                project = state[name] = {'id': max_id}
+            project.update(path=data['path'], limit=None)
+            projects_changed = True
+        elif project['limit'] == data['limit'] and project.get('ino') == inode:
+            # directory is the same and limit is already applied
+            continue
+        commands.extend([
+            '-c', 'project -s {0}'.format(name),
+            '-c', 'limit -p bsoft={0} bhard={0} {1}'.format(data['limit'],
+                                                            name)])
+        applied.append((project, data['limit'], inode))
+
+    if projects_changed:
+        _write_projects(state)
+    if commands:
+        code = subprocess.call(['xfs_quota', '-x'] + commands +
+                               [fs['mount_point']])
+        if code == 0:
+            for project, limit, inode in applied:
+                project.update(limit=limit, ino=inode)
+    if projects_changed or applied:
+        _save_state(state)
 
 
 if __name__ == '__main__':
@@ -197,10 +249,7 @@ if __name__ == '__main__':
     target_ = _target()
     parent_, get_dirs = FSLIMIT_TARGETS[target_]
 
-    use_abspath = False
-    if target_ == 'storage':
-        use_abspath = True
     fs_ = _fs()[_mount(parent_)]
     check_xfs(fs_)
     check_prjquota(fs_)
-    fslimit(fs_, parent_, get_dirs(), abspath=use_abspath)
+    fslimit(fs_, parent_, get_dirs())
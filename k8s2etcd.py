@@ -21,11 +21,13 @@
 
 
 import json
+import os
 import time
 import logging
 import requests
+from collections import deque
 from datetime import datetime
-from websocket import create_connection
+from websocket import create_connection, WebSocketTimeoutException
 
 logger = logging.getLogger()
 
@@ -34,14 +36,32 @@ attempt_timeout = 1
 index_file = '/var/lib/kuberdock/k8s2etcd_resourceVersion'
 loop_timeout = 0.2
 
+#: Events received within this window (in seconds) are sent to etcd as one key
+batch_window = 0.2
+#: Max number of events in one etcd key
+batch_size = 100
+#: Max number of events waiting for etcd. The oldest are dropped on overflow
+max_backlog = 10000
+#: How often (in seconds) the last sent resourceVersion is saved to disk
+checkpoint_interval = 5
+#: How often (in seconds) relay counters are written to the log
+metrics_interval = 60
+
 watch_url = 'ws://127.0.0.1:8080/api/v1/pods?watch=true&resourceVersion={}'
 list_url = 'http://127.0.0.1:8080/api/v1/pods'
 etcd_url = 'http://127.0.0.1:4001/v2/keys/kuberdock/pod_states'
 
+#: Pod annotations used by listeners (see `kapi.usage.update_states`)
+kept_annotations = ('kuberdock-container-kubes',)
+
+session = requests.Session()
+
 
 def store(resource_version):
-    with open(index_file, 'w') as f:
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'w') as f:
         f.write('{0:d}'.format(int(resource_version)))
+    os.rename(tmp_file, index_file)
 
 
 def get():
@@ -55,49 +75,210 @@ def get():
 
 def prelist():
     """ Just get resourceVersion from list """
-    res = requests.get(list_url)
+    res = session.get(list_url)
     if res.ok:
         return int(res.json()['metadata']['resourceVersion'])
     else:
         raise Exception("Error during pre list resource version")
 
 
-def process(content):
-    """ Put content to etcd with timestamp as key """
-    ts = str((datetime.utcnow() - datetime.fromtimestamp(0)).total_seconds())
-    for i in range(attempts):
+def timestamp():
+    return (datetime.utcnow() - datetime.fromtimestamp(0)).total_seconds()
+
+
+def trim(data):
+    """Keep only fields of the event that listeners use.
+    Pod spec (env, volumes, probes, etc.) is the biggest part of the event
+    and is not needed there.
+    """
+    pod = data.get('object') or {}
+    metadata = pod.get('metadata') or {}
+    annotations = metadata.get('annotations') or {}
+    trimmed_metadata = dict(
+        (key, metadata[key])
+        for key in ('name', 'namespace', 'uid', 'labels', 'resourceVersion',
+                    'deletionTimestamp')
+        if key in metadata)
+    trimmed_annotations = dict((key, annotations[key])
+                               for key in kept_annotations
+                               if key in annotations)
+    if trimmed_annotations:
+        trimmed_metadata['annotations'] = trimmed_annotations
+    spec = pod.get('spec') or {}
+    trimmed_pod = {'metadata': trimmed_metadata,
+                   'spec': {'nodeName': spec.get('nodeName')}}
+    if 'status' in pod:
+        trimmed_pod['status'] = pod['status']
+    return {'type': data.get('type'), 'object': trimmed_pod}
+
+
+class Metrics(object):
+    """Relay counters, written to the log periodically."""
+
+    def __init__(self):
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed_puts = 0
+        self.last_flush_duration = 0.0
+        self.received_bytes = 0
+        self.sent_bytes = 0
+        self.reported_at = time.time()
+
+    def report(self, backlog, force=False):
+        now = time.time()
+        if not force and now - self.reported_at < metrics_interval:
+            return
+        self.reported_at = now
+        logger.info(
+            'k8s2etcd: received {0} events ({1} bytes), sent {2} events '
+            '({3} bytes) in {4} batches, dropped {5}, failed puts {6}, '
+            'backlog {7}, last flush {8:.3f}s'.format(
+                self.received, self.received_bytes, self.sent,
+                self.sent_bytes, self.batches, self.dropped,
+                self.failed_puts, backlog, self.last_flush_duration))
+
+
+class Relay(object):
+    """Buffers pod events and sends them to etcd in batches.
+    Every etcd key holds a JSON list of [timestamp, event] pairs.
+    """
+
+    def __init__(self, metrics=None):
+        self.backlog = deque()
+        self.metrics = metrics or Metrics()
+        self.received_version = None
+        self.sent_version = None
+        self.stored_version = None
+        self.stored_at = time.time()
+        self.batch_started = None
+
+    def add(self, content, data):
+        """Add watch event to backlog.
+
+        :param content: raw event as received from kubernetes
+        :param data: parsed event
+        """
+        self.metrics.received += 1
+        self.metrics.received_bytes += len(content)
+        if len(self.backlog) >= max_backlog:
+            _, dropped = self.backlog.popleft()
+            self.metrics.dropped += 1
+            logger.error("Backlog is full, event {0} is dropped".format(
+                dropped['object']['metadata'].get('resourceVersion')))
+        if not self.backlog:
+            self.batch_started = time.time()
+        self.backlog.append((timestamp(), trim(data)))
+        self.received_version = data['object']['metadata']['resourceVersion']
+
+    def ready(self):
+        return bool(self.backlog) and (
+            len(self.backlog) >= batch_size or
+            time.time() - self.batch_started >= batch_window)
+
+    def put(self, batch):
+        content = json.dumps(batch)
+        key = '{0!r}'.format(batch[0][0])
         try:
-            requests.put('/'.join([etcd_url, ts]), data={'value': content})
-            break
-        except:
-            logger.exception("{}: Can't process event {}".format(i, content))
-            time.sleep(attempt_timeout)
-    else:
-        logger.error("Can't process event {}, skipping...".format(content))
+            res = session.put('/'.join([etcd_url, key]),
+                              data={'value': content})
+        except requests.RequestException:
+            logger.exception("Can't put batch of {0} events".format(
+                len(batch)))
+        else:
+            if res.ok:
+                self.metrics.sent_bytes += len(content)
+                return True
+            logger.error("Can't put batch of {0} events: {1}".format(
+                len(batch), res.text))
+        self.metrics.failed_puts += 1
+        return False
 
+    def flush(self):
+        """Send events from backlog to etcd.
+        Events that could not be sent stay in backlog and will be sent on
+        the next flush.
+        """
+        started = time.time()
+        while self.backlog:
+            batch = [self.backlog[i]
+                     for i in range(min(batch_size, len(self.backlog)))]
+            if not self.put(batch):
+                break
+            for _ in batch:
+                self.backlog.popleft()
+            self.metrics.sent += len(batch)
+            self.metrics.batches += 1
+            self.sent_version = (
+                batch[-1][1]['object']['metadata'].get('resourceVersion') or
+                self.sent_version)
+        self.batch_started = time.time()
+        self.metrics.last_flush_duration = time.time() - started
+        self.checkpoint()
+        self.metrics.report(len(self.backlog))
+        return not self.backlog
+
+    def checkpoint(self, force=False):
+        """Save resourceVersion of the last sent event periodically."""
+        if self.sent_version in (None, self.stored_version):
+            return
+        if not force and time.time() - self.stored_at < checkpoint_interval:
+            return
+        store(self.sent_version)
+        self.stored_version = self.sent_version
+        self.stored_at = time.time()
+        logger.debug("new resourceVersion {}".format(self.stored_version))
 
-resourceVersion = get()
-while True:
+
+def watch(relay, resource_version):
+    """Relay events until connection is broken.
+    Returns resourceVersion to continue from or None to start from scratch.
+    """
+    logger.info("start watch from {}".format(resource_version))
+    ws = create_connection(watch_url.format(resource_version))
+    ws.settimeout(batch_window)
     try:
-        if resourceVersion is None:
-            resourceVersion = prelist()
-        else:
-            resourceVersion = min(resourceVersion, prelist())
-        logger.info("start watch from {}".format(resourceVersion))
-        ws = create_connection(watch_url.format(resourceVersion))
         while True:
-            content = ws.recv()
+            try:
+                content = ws.recv()
+            except WebSocketTimeoutException:
+                relay.flush()
+                continue
             data = json.loads(content)
             if (data['type'].lower() == 'error' and
                     '401' in data['object']['message']):
-                resourceVersion = None
-                break
-            process(content)
-            resourceVersion = data['object']['metadata']['resourceVersion']
-            logger.debug("new resourceVersion {}".format(resourceVersion))
-            store(resourceVersion)
-    except KeyboardInterrupt:
-        break
-    except Exception as e:
-        logger.exception('restarting')
-        time.sleep(loop_timeout)
+                return None
+            relay.add(content, data)
+            if relay.ready():
+                relay.flush()
+    finally:
+        ws.close()
+        relay.flush()
+        relay.checkpoint(force=True)
+
+
+def main():
+    relay = Relay()
+    resource_version = get()
+    while True:
+        try:
+            if resource_version is None:
+                resource_version = prelist()
+            else:
+                resource_version = min(int(resource_version), prelist())
+            resource_version = watch(relay, resource_version)
+        except KeyboardInterrupt:
+            relay.metrics.report(len(relay.backlog), force=True)
+            break
+        except Exception:
+            logger.exception('restarting')
+            # events that are not sent yet stay in backlog,
+            # so watch is continued after the last received event
+            if relay.received_version is not None:
+                resource_version = relay.received_version
+            time.sleep(loop_timeout)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,17 +18,29 @@
 # You should have received a copy of the GNU General Public License
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import pipes
+import time
+from collections import Counter
 from functools import wraps
 
-from fabric.api import env, run, put, output
 from flask import jsonify, request, g
 
-from kubedock.core import current_app
-from kubedock.utils import KubeUtils, send_event_to_role, API_VERSIONS
+from kubedock.core import current_app, ssh_connect
+from kubedock.utils import (
+    KubeUtils, send_event_to_role, API_VERSIONS, parallel_map)
 from kubedock import factory
 from kubedock import sessions
 from kubedock.exceptions import APIError, InternalAPIError, NotFound
-from kubedock.settings import SSH_KEY_FILENAME, SESSION_LIFETIME
+from kubedock.settings import SESSION_LIFETIME, PRE_START_HOOK_CONCURRENCY
+
+PLUGIN_DIR = '/usr/libexec/kubernetes/kubelet-plugins/net/exec/kuberdock/'
+
+#: Node parts updated by `pre_start_hook` (local path, path on node)
+NODE_PARTS = (
+    ('./node_network_plugin.sh', PLUGIN_DIR + 'kuberdock'),
+    ('./node_network_plugin.py', PLUGIN_DIR + 'kuberdock.py'),
+)
 
 
 class InvalidAPIVersion(APIError):
@@ -103,21 +115,80 @@ def handle_api_version():
         return on_app_error(InvalidAPIVersion())
 
 
+def _md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def _remote_md5(ssh, paths):
+    _, out, _ = ssh.exec_command(
+        'md5sum ' + ' '.join(pipes.quote(path) for path in paths))
+    checksums = {}
+    for line in out.read().splitlines():
+        checksum, _, path = line.partition('  ')
+        checksums[path] = checksum
+    return checksums
+
+
+def update_node_parts(hostname, checksums):
+    """Copies changed node parts to the node and restarts its services.
+
+    :param checksums: md5 of local files by local path
+    :return: outcome: 'updated', 'unchanged' or 'failed: <reason>'
+    """
+    ssh, error = ssh_connect(hostname)
+    if error:
+        return 'failed: {0}'.format(error)
+    try:
+        remote = _remote_md5(ssh, [path for _, path in NODE_PARTS])
+        changed = [(local, path) for local, path in NODE_PARTS
+                   if remote.get(path) != checksums[local]]
+        if not changed:
+            return 'unchanged'
+        sftp = ssh.open_sftp()
+        try:
+            for local, path in changed:
+                sftp.put(local, path)
+        finally:
+            sftp.close()
+        _, out, err = ssh.exec_command('systemctl restart kuberdock-watcher')
+        if out.channel.recv_exit_status():
+            return 'failed: {0}'.format(err.read().strip())
+        return 'updated'
+    finally:
+        ssh.close()
+
+
 def pre_start_hook(app):
+    """Updates node parts on all nodes concurrently. Nodes which already
+    have the same files are not touched.
+    """
     from ..nodes.models import Node
-    # env.warn_only = True
-    env.user = 'root'
-    env.key_filename = SSH_KEY_FILENAME
-    output.stdout = False
-    output.running = False
-    PLUGIN_DIR = '/usr/libexec/kubernetes/kubelet-plugins/net/exec/kuberdock/'
     with app.app_context():
-        for node in Node.query.all():
-            env.host_string = node.hostname
-            put('./node_network_plugin.sh', PLUGIN_DIR + 'kuberdock')
-            put('./node_network_plugin.py', PLUGIN_DIR + 'kuberdock.py')
-            run('systemctl restart kuberdock-watcher')
-            print 'Kuberdock node parts are updated'
+        hostnames = [hostname for (hostname,) in
+                     Node.query.with_entities(Node.hostname)]
+        checksums = {local: _md5(local) for local, _ in NODE_PARTS}
+
+        def update(hostname):
+            started = time.time()
+            try:
+                outcome = update_node_parts(hostname, checksums)
+            except Exception as e:
+                current_app.logger.exception(
+                    'Failed to update node parts on %s', hostname)
+                outcome = 'failed: {0}'.format(e)
+            current_app.logger.info('Node %s: %s in %.2fs', hostname,
+                                    outcome, time.time() - started)
+            return outcome.split(':', 1)[0]
+
+        started = time.time()
+        outcomes = Counter(parallel_map(update, hostnames,
+                                        PRE_START_HOOK_CONCURRENCY))
+        summary = ', '.join('{0} {1}'.format(count, outcome)
+                            for outcome, count in sorted(outcomes.items()))
+        current_app.logger.info(
+            'Kuberdock node parts are updated in %.2fs: %s',
+            time.time() - started, summary or 'no nodes')
 
 
 def on_app_error(e):
@@ -28,6 +28,16 @@ from ..utils import KubeUtils
 from ..validation import V, ValidationError, port_schema, protocol_schema
 
 
+ports_list_schema = {
+    'type': 'list',
+    'schema': {
+        'type': 'dict',
+        'schema': {'port': dict(port_schema, required=True),
+                   'protocol': dict(protocol_schema, required=True)},
+    },
+}
+
+
 allowed_ports = Blueprint('allowed-ports', __name__,
                           url_prefix='/allowed-ports')
 
@@ -60,3 +70,15 @@ def del_port(port, protocol):
                       {'port': port_schema, 'protocol': protocol_schema}):
         raise ValidationError(v.errors)
     kapi_allowed_ports.del_port(port, protocol)
+
+
+@allowed_ports.route('/', methods=['PATCH'])
+@auth_required
+@check_permission('create', 'allowed-ports')
+@check_permission('delete', 'allowed-ports')
+@KubeUtils.jsonwrap
+@use_kwargs({'set_ports': ports_list_schema, 'del_ports': ports_list_schema})
+def update_ports(set_ports=(), del_ports=()):
+    return kapi_allowed_ports.update_ports(
+        [(p['port'], p['protocol']) for p in set_ports],
+        [(p['port'], p['protocol']) for p in del_ports])
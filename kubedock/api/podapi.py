@@ -240,6 +240,37 @@ def restore(pod_dump, owner, **kwargs):
         return backup_pods.restore(pod_dump=pod_dump, owner=owner, **kwargs)
 
 
+restore_many_args_schema = dict(
+    (key, value) for key, value in restore_args_schema.iteritems()
+    if key != 'pod_dump')
+restore_many_args_schema.update({
+    'pod_dumps': {
+        'type': 'list',
+        'required': True,
+        'schema': {'type': 'dict'}
+    },
+    'concurrency': {
+        'type': 'integer',
+        'required': False,
+        'nullable': True,
+        'min': 1
+    },
+})
+
+
+@podapi.route('/restore-many', methods=['POST'])
+@auth_required
+@maintenance_protected
+@check_permission('create_non_owned', 'pods')
+@KubeUtils.jsonwrap
+@use_kwargs(restore_many_args_schema)
+def restore_many(pod_dumps, owner, **kwargs):
+    with check_permission('own', 'pods', user=owner):
+        return backup_pods.restore_many(
+            pod_dumps=pod_dumps, owner=owner,
+            notify_user_id=KubeUtils.get_current_user().id, **kwargs)
+
+
 @podapi.route('/<pod_id>/plans-info', methods=['GET'])
 @auth_required
 @KubeUtils.jsonwrap
@@ -18,6 +18,7 @@
 # You should have received a copy of the GNU General Public License
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
+import json
 import unittest
 
 import etcd
@@ -61,6 +62,9 @@ class TestAllowedPorts(APITestCase):
     @mock.patch('kubedock.kapi.allowed_ports.AllowedPort')
     @mock.patch('kubedock.kapi.allowed_ports.etcd.Client')
     def test_set_port(self, etcd_client_mock, allowed_port_mock, db_mock):
+        # policy is made of all ports, including the one just added
+        allowed_port_mock.query.__iter__.side_effect = lambda: iter(
+            [FakeAllowedPort(**port) for port in self.ports])
         response = self.admin_open(method='POST')
         self.assertAPIError(response, 400, 'ValidationError',
                             {u'protocol': u'required field',
@@ -111,6 +115,19 @@ class TestAllowedPorts(APITestCase):
             {u'message': u"Can't update allowed port policy in etcd"},
         )
 
+        etcd_client_mock.return_value.read.side_effect = \
+            etcd.EtcdKeyNotFound('!!!')
+        etcd_client_mock.return_value.write.side_effect = \
+            etcd.EtcdException('!!!')
+        response = self.admin_open(method='POST',
+                                   json={'port': 8002, 'protocol': 'tcp'})
+        self.assertAPIError(
+            response,
+            400,
+            'AllowedPortsException.OpenPortError',
+            {u'message': u"Can't update allowed port policy in etcd"},
+        )
+
     @mock.patch('kubedock.kapi.allowed_ports.db')
     @mock.patch('kubedock.kapi.allowed_ports.AllowedPort')
     @mock.patch('kubedock.kapi.allowed_ports.etcd.Client')
@@ -162,6 +179,55 @@ class TestAllowedPorts(APITestCase):
             {u'message': u"Can't remove allowed ports policy from etcd"},
         )
 
+    @mock.patch('kubedock.kapi.allowed_ports.db')
+    @mock.patch('kubedock.kapi.allowed_ports.AllowedPort')
+    @mock.patch('kubedock.kapi.allowed_ports.etcd.Client')
+    def test_update_ports(self, etcd_client_mock, port_mock, db_mock):
+        port_mock.query = [FakeAllowedPort(**port) for port in self.ports]
+
+        response = self.admin_open(method='PATCH', json={'set_ports': 8000})
+        self.assertAPIError(response, 400, 'ValidationError',
+                            {u'set_ports': u'must be of list type'})
+
+        # nothing to change: neither database nor etcd is touched
+        response = self.admin_open(method='PATCH', json={
+            'set_ports': [{'port': 8000, 'protocol': 'TCP'}],
+            'del_ports': [{'port': 9000, 'protocol': 'tcp'}],
+        })
+        self.assert200(response)
+        self.assertEqual(response.json['data'], {'opened': [], 'closed': []})
+        self.assertFalse(db_mock.session.commit.called)
+        self.assertFalse(etcd_client_mock.called)
+
+        response = self.admin_open(method='PATCH', json={
+            'set_ports': [{'port': 8002, 'protocol': 'tcp'},
+                          {'port': 8003, 'protocol': 'tcp'}],
+            'del_ports': [{'port': 8001, 'protocol': 'udp'}],
+        })
+        self.assert200(response)
+        self.assertEqual(response.json['data'], {
+            'opened': [{'port': 8002, 'protocol': 'tcp'},
+                       {'port': 8003, 'protocol': 'tcp'}],
+            'closed': [{'port': 8001, 'protocol': 'udp'}],
+        })
+        self.assertEqual(db_mock.session.add.call_count, 2)
+        self.assertEqual(db_mock.session.delete.call_count, 1)
+        db_mock.session.commit.assert_called_once_with()
+        etcd_client = etcd_client_mock.return_value
+        etcd_client.update.assert_called_once_with(
+            etcd_client.read.return_value)
+        policy = json.loads(etcd_client.read.return_value.value)
+        rules = policy['inbound_rules']
+        self.assertEqual([(r['protocol'], r['dst_ports']) for r in rules],
+                         [('tcp', [8000, 8002, 8003])])
+
+        response = self.admin_open(method='PATCH', json={
+            'set_ports': [{'port': 8002, 'protocol': 'tcp'}],
+            'del_ports': [{'port': 8002, 'protocol': 'TCP'}],
+        })
+        self.assertAPIError(response, 400,
+                            'AllowedPortsException.OpenPortError')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+import mock
+
+from kubedock import api
+
+
+def ssh_mock(remote_checksums, restart_code=0):
+    ssh = mock.Mock()
+
+    def exec_command(cmd):
+        out, err = mock.Mock(), mock.Mock()
+        if cmd.startswith('md5sum'):
+            out.read.return_value = '\n'.join(
+                '{0}  {1}'.format(checksum, path)
+                for path, checksum in remote_checksums.items())
+        else:
+            out.channel.recv_exit_status.return_value = restart_code
+            err.read.return_value = 'error'
+        return None, out, err
+
+    ssh.exec_command.side_effect = exec_command
+    return ssh
+
+
+@mock.patch.object(api, 'ssh_connect')
+class TestUpdateNodeParts(unittest.TestCase):
+    checksums = {local: 'md5-' + local for local, _ in api.NODE_PARTS}
+
+    def test_unchanged_node_is_not_touched(self, ssh_connect):
+        ssh = ssh_mock({path: self.checksums[local]
+                        for local, path in api.NODE_PARTS})
+        ssh_connect.return_value = ssh, None
+        self.assertEqual(
+            api.update_node_parts('node1', self.checksums), 'unchanged')
+        ssh_connect.assert_called_once_with('node1')
+        self.assertFalse(ssh.open_sftp.called)
+        self.assertEqual(ssh.exec_command.call_count, 1)
+        ssh.close.assert_called_once_with()
+
+    def test_changed_files_are_copied(self, ssh_connect):
+        (local1, path1), (local2, path2) = api.NODE_PARTS
+        ssh = ssh_mock({path1: self.checksums[local1], path2: 'old'})
+        ssh_connect.return_value = ssh, None
+        self.assertEqual(
+            api.update_node_parts('node1', self.checksums), 'updated')
+        ssh.open_sftp.return_value.put.assert_called_once_with(local2, path2)
+        ssh.exec_command.assert_called_with(
+            'systemctl restart kuberdock-watcher')
+
+    def test_failures(self, ssh_connect):
+        ssh_connect.return_value = mock.Mock(), 'timeout'
+        self.assertEqual(api.update_node_parts('node1', self.checksums),
+                         'failed: timeout')
+
+        ssh_connect.return_value = ssh_mock({}, restart_code=1), None
+        self.assertEqual(api.update_node_parts('node1', self.checksums),
+                         'failed: error')
+
+
+if __name__ == '__main__':
+    unittest.main()
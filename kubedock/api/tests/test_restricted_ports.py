@@ -18,6 +18,7 @@
 # You should have received a copy of the GNU General Public License
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
+import json
 import unittest
 
 import etcd
@@ -61,6 +62,9 @@ class TestRestrictedPorts(APITestCase):
     @mock.patch('kubedock.kapi.restricted_ports.RestrictedPort')
     @mock.patch('kubedock.kapi.restricted_ports.etcd.Client')
     def test_set_port(self, etcd_client_mock, restricted_port_mock, db_mock):
+        # policy is made of all ports, including the one just added
+        restricted_port_mock.query.__iter__.side_effect = lambda: iter(
+            [FakeRestrictedPort(**port) for port in self.ports])
         response = self.admin_open(method='POST')
         self.assertAPIError(response, 400, 'ValidationError',
                             {u'protocol': u'required field',
@@ -111,6 +115,19 @@ class TestRestrictedPorts(APITestCase):
             {u'message': u"Can't update restricted port policy in etcd"},
         )
 
+        etcd_client_mock.return_value.read.side_effect = \
+            etcd.EtcdKeyNotFound('!!!')
+        etcd_client_mock.return_value.write.side_effect = \
+            etcd.EtcdException('!!!')
+        response = self.admin_open(method='POST',
+                                   json={'port': 8002, 'protocol': 'tcp'})
+        self.assertAPIError(
+            response,
+            400,
+            'RestrictedPortsException.ClosePortError',
+            {u'message': u"Can't update restricted port policy in etcd"},
+        )
+
     @mock.patch('kubedock.kapi.restricted_ports.db')
     @mock.patch('kubedock.kapi.restricted_ports.RestrictedPort')
     @mock.patch('kubedock.kapi.restricted_ports.etcd.Client')
@@ -162,6 +179,55 @@ class TestRestrictedPorts(APITestCase):
             {u'message': u"Can't remove restricted ports policy from etcd"},
         )
 
+    @mock.patch('kubedock.kapi.restricted_ports.db')
+    @mock.patch('kubedock.kapi.restricted_ports.RestrictedPort')
+    @mock.patch('kubedock.kapi.restricted_ports.etcd.Client')
+    def test_update_ports(self, etcd_client_mock, port_mock, db_mock):
+        port_mock.query = [FakeRestrictedPort(**port) for port in self.ports]
+
+        response = self.admin_open(method='PATCH', json={'set_ports': 8000})
+        self.assertAPIError(response, 400, 'ValidationError',
+                            {u'set_ports': u'must be of list type'})
+
+        # nothing to change: neither database nor etcd is touched
+        response = self.admin_open(method='PATCH', json={
+            'set_ports': [{'port': 25, 'protocol': 'TCP'}],
+            'del_ports': [{'port': 9000, 'protocol': 'tcp'}],
+        })
+        self.assert200(response)
+        self.assertEqual(response.json['data'], {'closed': [], 'opened': []})
+        self.assertFalse(db_mock.session.commit.called)
+        self.assertFalse(etcd_client_mock.called)
+
+        response = self.admin_open(method='PATCH', json={
+            'set_ports': [{'port': 26, 'protocol': 'tcp'},
+                          {'port': 27, 'protocol': 'tcp'}],
+            'del_ports': [{'port': 53, 'protocol': 'udp'}],
+        })
+        self.assert200(response)
+        self.assertEqual(response.json['data'], {
+            'closed': [{'port': 26, 'protocol': 'tcp'},
+                       {'port': 27, 'protocol': 'tcp'}],
+            'opened': [{'port': 53, 'protocol': 'udp'}],
+        })
+        self.assertEqual(db_mock.session.add.call_count, 2)
+        self.assertEqual(db_mock.session.delete.call_count, 1)
+        db_mock.session.commit.assert_called_once_with()
+        etcd_client = etcd_client_mock.return_value
+        etcd_client.update.assert_called_once_with(
+            etcd_client.read.return_value)
+        policy = json.loads(etcd_client.read.return_value.value)
+        rules = policy['outbound_rules']
+        self.assertEqual([(r['protocol'], r['dst_ports']) for r in rules],
+                         [('tcp', [25, 26, 27])])
+
+        response = self.admin_open(method='PATCH', json={
+            'set_ports': [{'port': 26, 'protocol': 'tcp'}],
+            'del_ports': [{'port': 26, 'protocol': 'TCP'}],
+        })
+        self.assertAPIError(response, 400,
+                            'RestrictedPortsException.ClosePortError')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -26,8 +26,10 @@ from kubedock.testutils.testcases import APITestCase
 from flask import current_app
 
 from uuid import uuid4
-from kubedock.core import db
+from kubedock.core import db, ConnectionPool
 from kubedock.users.models import User, UserActivity
+from kubedock.users.utils import (
+    ONLINE_USERS_KEY, clear_online_collection, mark_online)
 from kubedock.pods.models import Pod
 from kubedock.billing.models import Package, PackageKube, Kube
 from kubedock.kapi import podcollection as kapi_podcollection
@@ -372,9 +374,22 @@ class TestUsers(APITestCase):
         # TODO: check response; 404 case; check date_from, date_to params
 
     def test_get_online(self):
+        ConnectionPool.get_connection().delete(ONLINE_USERS_KEY)
+        mark_online(self.user.id)
         response = self.admin_open(self.item_url('online'))
         self.assert200(response)  # only admin has permission
-        # TODO: check response; 404 case
+        self.assertIn(self.user.id,
+                      [user['id'] for user in response.json['data']])
+
+        # collection is cached for a while
+        mark_online(self.admin.id)
+        response = self.admin_open(self.item_url('online'))
+        self.assertNotIn(self.admin.id,
+                         [user['id'] for user in response.json['data']])
+        clear_online_collection()
+        response = self.admin_open(self.item_url('online'))
+        self.assertIn(self.admin.id,
+                      [user['id'] for user in response.json['data']])
 
     def test_login_as(self):
         response = self.admin_open(self.item_url('loginA'), method='POST',
@@ -19,16 +19,22 @@
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
 import os
+from collections import Counter
+
+from flask import current_app
 
 from kubedock import validation
 from kubedock.backups import utils
-from kubedock.exceptions import APIError
+from kubedock.exceptions import APIError, NoFreeIPs
 from kubedock.kapi.pod import VolumeExists
 from kubedock.kapi.podcollection import PodCollection
-from kubedock.pods.models import Pod as DBPod, PersistentDisk, \
+from kubedock.pods.models import Pod as DBPod, IPPool, PersistentDisk, \
     PersistentDiskStatuses
+from kubedock.settings import POD_RESTORE_CONCURRENCY
 from kubedock.users import User
-from kubedock.utils import nested_dict_utils
+from kubedock.utils import (
+    POD_STATUSES, atomic, nested_dict_utils, parallel_map,
+    send_event_to_user)
 
 DEFAULT_BACKUP_PATH_TEMPLATE = '/{owner_id}/{volume_name}.tar.gz'
 
@@ -41,23 +47,29 @@ def _filter_persistent_volumes(pod_spec):
     return [v for v in pod_spec['volumes'] if is_local_storage(v)]
 
 
+def _error_to_dict(e):
+    return {
+        'data': e.message,
+        'type': getattr(e, 'type', e.__class__.__name__),
+        'details': getattr(e, 'details', None)
+    }
+
+
 class MultipleErrors(APIError):
     message = 'Multiple errors'
 
     def __init__(self, errors):
-        details = {
-            'errors': [
-                {
-                    'data': e.message,
-                    'type': getattr(e, 'type', e.__class__.__name__),
-                    'details': e.details
-                }
-                for e in errors
-            ]
-        }
+        details = {'errors': [_error_to_dict(e) for e in errors]}
         super(MultipleErrors, self).__init__(details=details)
 
 
+def _raise_errors(errors):
+    if len(errors) == 1:
+        raise errors[0]
+    elif errors:
+        raise MultipleErrors(errors)
+
+
 class BackupUrlFactory(object):
     def __init__(self, base_url, path_template, **kwargs):
         self.base_url = base_url
@@ -93,7 +105,24 @@ class _PodRestoreCommand(object):
         self.backup_url_factory = BackupUrlFactory(
             pv_backups_location, pv_backups_path_template, **template_dict)
 
+    @property
+    def pod_name(self):
+        return nested_dict_utils.get(self.pod_dump, 'pod_data.name')
+
+    @property
+    def saved_status(self):
+        return self.pod_dump['pod_data']['status']
+
     def __call__(self):
+        self.prepare()
+        restored_pod_dict = self._restore_pod(self.pod_dump)
+        restored_pod_dict = self._start_pod_if_needed(restored_pod_dict)
+        return restored_pod_dict
+
+    def prepare(self):
+        """Validate the dump and check that the pod does not conflict
+        with existing pods and persistent disks.
+        """
         pod_dump = self.pod_dump
         validation.check_pod_dump(pod_dump, user=self.owner,
                                   allow_unknown=True)
@@ -114,10 +143,6 @@ class _PodRestoreCommand(object):
 
         self._check_for_conflicts(pod_data, volumes_map)
 
-        restored_pod_dict = self._restore_pod(pod_dump)
-        restored_pod_dict = self._start_pod_if_needed(restored_pod_dict)
-        return restored_pod_dict
-
     def _extend_pv_specs_with_backup_info(self, pv_specs, volumes_map):
         for pv_spec in pv_specs:
             pd_name = nested_dict_utils.get(pv_spec, 'name')
@@ -141,11 +166,7 @@ class _PodRestoreCommand(object):
                 e = self._check_volume_name(volume_name)
                 if e:
                     errors.append(e)
-        if errors:
-            if len(errors) == 1:
-                raise errors[0]
-            else:
-                raise MultipleErrors(errors)
+        _raise_errors(errors)
 
     def _check_pod_name(self, pod_name):
         pod = DBPod.query.filter(
@@ -170,15 +191,21 @@ class _PodRestoreCommand(object):
         if persistent_disk:
             return VolumeExists(persistent_disk.name, persistent_disk.id)
 
+    def restored_volume_names(self):
+        """Names of persistent disks which will be created from backups."""
+        pod_data = self.pod_dump['pod_data']
+        volumes_map = self.pod_dump['volumes_map']
+        return [nested_dict_utils.get(vol, 'persistentDisk.pdName')
+                for vol in _filter_persistent_volumes(pod_data)
+                if volumes_map.get(vol.get('name')) != 'ceph']
+
     def _restore_pod(self, pod_dump):
         pod_collection = PodCollection(owner=self.owner)
         restored_pod_dict = pod_collection.add_from_dump(pod_dump)
         return restored_pod_dict
 
     def _start_pod_if_needed(self, restored_pod_dict):
-        saved_status = self.pod_dump['pod_data']['status']
-
-        if saved_status == 'running':
+        if self.saved_status == POD_STATUSES.running:
             restored_pod_id = restored_pod_dict['id']
             restored_pod_dict = PodCollection(owner=self.owner).update(
                 pod_id=restored_pod_id, data={'command': 'start'}
@@ -211,3 +238,118 @@ def restore(pod_dump, owner, pv_backups_location=None,
     return _PodRestoreCommand(
         pod_dump, owner, pv_backups_location, pv_backups_path_template,
     )()
+
+
+def _check_duplicates(commands):
+    """Pods restored at once must not conflict with each other."""
+    errors = []
+    names = Counter(command.pod_name for command in commands)
+    for name, count in sorted(names.items()):
+        if count > 1:
+            errors.append(APIError(
+                'Pod with name "{0}" is restored more than once.'.format(name),
+                status_code=409, type='PodNameConflict',
+                details={'name': name}))
+    volumes = Counter(volume for command in commands
+                      for volume in command.restored_volume_names())
+    for name, count in sorted(volumes.items()):
+        if count > 1:
+            errors.append(APIError(
+                'Persistent volume "{0}" is restored more than once.'.format(
+                    name),
+                status_code=409, type='VolumeExists', details={'name': name}))
+    return errors
+
+
+def _send_progress(user_id, data):
+    if user_id is None:
+        return
+    try:
+        send_event_to_user('pod:restore', data, user_id)
+    except Exception:
+        current_app.logger.warning('Failed to send pod restore progress',
+                                   exc_info=True)
+
+
+def _check_free_public_ips(commands, reserved):
+    """Public IPs are assigned when pods are started, so check that there
+    are enough free IPs for all pods which will be started after restore.
+    With fixed IP pools it's only a necessary condition, because then
+    the IP also depends on the node of the pod.
+    """
+    started = [reservation.data
+               for command, reservation in zip(commands, reserved)
+               if command.saved_status == POD_STATUSES.running]
+    needed = len(filter(PodCollection.needs_public_ip, started))
+    if needed and not IPPool.has_free_hosts(needed):
+        raise NoFreeIPs()
+
+
+def restore_many(pod_dumps, owner, pv_backups_location=None,
+                 pv_backups_path_template=None, concurrency=None,
+                 notify_user_id=None):
+    """Restore several pods (e.g. all pods of the user) from backup.
+
+    All dumps are validated first. Then pods, their persistent disks and
+    domains are saved to DB in one transaction, so either all pods get their
+    resources or none. Public IPs are assigned when pods are started, so
+    the transaction only checks that there are enough free IPs for all pods
+    that were running. After that pods are created in kubernetes (and
+    started if they were running) concurrently.
+
+    Args:
+        pod_dumps (list): Pod dumps.
+        owner (User): Owner of all pods.
+        pv_backups_location (str): See `restore`.
+        pv_backups_path_template (str): See `restore`.
+        concurrency (int): Max number of pods created simultaneously,
+            `POD_RESTORE_CONCURRENCY` by default.
+        notify_user_id (int): If specified, progress of every pod is sent
+            to the user as 'pod:restore' SSE event.
+
+    Returns:
+        list: Result for every dump, in the same order. Dictionary
+            with 'name' and either 'pod' (restored pod's data) or 'error'.
+    """
+    commands = [_PodRestoreCommand(pod_dump, owner, pv_backups_location,
+                                   pv_backups_path_template)
+                for pod_dump in pod_dumps]
+    errors = []
+    for command in commands:
+        try:
+            command.prepare()
+        except APIError as e:
+            errors.append(e)
+    errors.extend(_check_duplicates(commands))
+    _raise_errors(errors)
+
+    with atomic(nested=False):
+        reserved = [PodCollection(owner).reserve_from_dump(command.pod_dump)
+                    for command in commands]
+        _check_free_public_ips(commands, reserved)
+
+    owner_id, total = owner.id, len(commands)
+    done = []
+
+    def create(item):
+        command, reservation = item
+        result = {'name': command.pod_name}
+        try:
+            command.owner = User.query.get(owner_id)
+            restored = PodCollection(command.owner).create_reserved(
+                reservation)
+            result['pod'] = command._start_pod_if_needed(restored)
+        except Exception as e:
+            if not isinstance(e, APIError):
+                current_app.logger.exception(
+                    'Failed to restore pod "%s"', command.pod_name)
+            result['error'] = _error_to_dict(e)
+        done.append(command.pod_name)
+        _send_progress(notify_user_id, {
+            'name': command.pod_name,
+            'status': 'failed' if 'error' in result else 'restored',
+            'done': len(done), 'total': total})
+        return result
+
+    return parallel_map(create, zip(commands, reserved),
+                        concurrency or POD_RESTORE_CONCURRENCY)
@@ -18,12 +18,13 @@
 # You should have received a copy of the GNU General Public License
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 import tarfile
 
 import pytest
 import responses
-from requests.exceptions import RequestException
+from requests.exceptions import ConnectionError, RequestException
 
 from node_network_plugin import VolumeRestoreException, LocalStorage, \
     VolumeManager, VolumeSpec
@@ -182,3 +183,66 @@ def test_local_storage_init_remove_storage_if_failed_to_download_backup(
     node_network_plugin._run_storage_manage_command.assert_called_with(
         ['remove-volume', '--path', volume_spec.path]
     )
+
+
+@responses.activate
+def test_restore_volume_verifies_checksum(
+        storage_dir, volume_spec, backup_archive):
+    mock_remote_storage(volume_spec.backup_url, status=200,
+                        body=backup_archive)
+    mock_remote_storage(volume_spec.backup_url + '.sha256', status=200,
+                        body=hashlib.sha256(backup_archive).hexdigest() +
+                        '  test_nginx.tar.gz\n')
+    volume_manager.restore_if_needed(volume_spec)
+    assert len(storage_dir.listdir()) > 0
+
+    volume_spec.backup_checksum = hashlib.sha256('other').hexdigest()
+    with pytest.raises(VolumeRestoreException):
+        volume_manager.restore_if_needed(volume_spec)
+
+
+def test_download_is_resumed(mocker):
+    data = 'x' * 100 + 'y' * 100
+
+    def response(status_code, chunks):
+        r = mocker.Mock(status_code=status_code)
+
+        def iter_content(chunk_size):
+            for chunk in chunks:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        r.iter_content.side_effect = iter_content
+        return r
+
+    session = mocker.Mock()
+    session.get.side_effect = [
+        response(200, [data[:50], ConnectionError()]),
+        # server supports ranges
+        response(206, [data[50:120], ConnectionError()]),
+        # server does not support ranges
+        response(200, [data[:150], data[150:]]),
+    ]
+    download = node_network_plugin._Download(session, 'http://x/a.tar.gz',
+                                             chunk_size=30)
+    assert download.read(10) == data[:10]
+    assert download.read() == data[10:]
+    assert download.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert session.get.call_args_list[1][1]['headers'] == {
+        'Range': 'bytes=50-'}
+    assert session.get.call_args_list[2][1]['headers'] == {
+        'Range': 'bytes=120-'}
+
+
+def test_local_storage_restores_volumes_in_parallel(mocker):
+    restore = mocker.patch.object(LocalStorage.volume_manager,
+                                  'restore_if_needed')
+    volumes = [VolumeSpec(path='/p{0}'.format(i), size='1g', name=str(i),
+                          backup_url='http://x/{0}.tar.gz'.format(i))
+               for i in range(3)]
+    error = VolumeRestoreException()
+    restore.side_effect = [None, error, None]
+
+    with pytest.raises(VolumeRestoreException):
+        LocalStorage.restore_backups(volumes)
+    assert restore.call_count == 3
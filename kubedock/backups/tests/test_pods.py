@@ -0,0 +1,151 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+import mock
+
+# kapi modules have to be imported through the app (circular imports)
+from kubedock.testutils.testcases import DBTestCase
+from kubedock.backups import pods
+from kubedock.billing.models import Kube
+from kubedock.exceptions import APIError, NoFreeIPs
+from kubedock.kapi import podcollection
+from kubedock.pods.models import IPPool, Pod as DBPod
+
+
+def pod_dump(name, volumes=()):
+    return {
+        'pod_data': {
+            'name': name,
+            'status': 'stopped',
+            'volumes': [{'name': v, 'persistentDisk': {'pdName': v}}
+                        for v in volumes],
+        },
+        'volumes_map': {v: '/backups/{0}.tar.gz'.format(v) for v in volumes},
+    }
+
+
+@mock.patch.object(pods._PodRestoreCommand, 'prepare', mock.Mock())
+class TestRestoreMany(DBTestCase):
+    def setUp(self):
+        self.user, _ = self.fixtures.user_fixtures()
+        patcher = mock.patch.object(pods, 'PodCollection')
+        self.addCleanup(patcher.stop)
+        self.PodCollectionMock = patcher.start()
+        self.PodCollectionMock.return_value.reserve_from_dump.side_effect = \
+            lambda dump: dump['pod_data']['name']
+        self.PodCollectionMock.return_value.create_reserved.side_effect = \
+            lambda name: {'name': name}
+
+    @mock.patch.object(pods, 'send_event_to_user')
+    def test_restore_many(self, send_event_mock):
+        dumps = [pod_dump('pod{0}'.format(i)) for i in range(3)]
+        dumps[1]['pod_data']['volumes'] = []
+        create = self.PodCollectionMock.return_value.create_reserved
+        create.side_effect = [{'name': 'pod0'}, APIError('oops'),
+                              {'name': 'pod2'}]
+
+        result = pods.restore_many(dumps, self.user, concurrency=1,
+                                   notify_user_id=self.user.id)
+        self.assertEqual(result[0], {'name': 'pod0',
+                                     'pod': {'name': 'pod0'}})
+        self.assertEqual(result[1]['name'], 'pod1')
+        self.assertEqual(result[1]['error']['data'], 'oops')
+        self.assertEqual(result[2]['pod'], {'name': 'pod2'})
+        # all pods are reserved before any of them is created
+        self.assertEqual(
+            self.PodCollectionMock.return_value.reserve_from_dump.call_count,
+            3)
+        self.assertEqual(send_event_mock.call_count, 3)
+        self.assertEqual(send_event_mock.call_args[0][1]['done'], 3)
+
+    def test_conflicts(self):
+        dumps = [pod_dump('pod', ['vol']), pod_dump('pod', ['vol'])]
+        with self.assertRaises(pods.MultipleErrors):
+            pods.restore_many(dumps, self.user)
+        self.assertFalse(
+            self.PodCollectionMock.return_value.reserve_from_dump.called)
+
+
+def full_pod_dump(name, status):
+    return {
+        'pod_data': {
+            'name': name,
+            'status': status,
+            'kube_type': Kube.get_default_kube_type(),
+            'restartPolicy': 'Always',
+            'volumes': [],
+            'containers': [{
+                'name': name, 'image': 'nginx', 'kubes': 1, 'env': [],
+                'volumeMounts': [],
+                'ports': [{'containerPort': 80, 'hostPort': 80,
+                           'isPublic': True, 'protocol': 'tcp'}],
+            }],
+        },
+        'volumes_map': {},
+        'k8s_secrets': {},
+    }
+
+
+@mock.patch.object(pods._PodRestoreCommand, 'prepare', mock.Mock())
+@mock.patch.object(podcollection, '_check_license', mock.Mock())
+@mock.patch.object(podcollection.PodCollection, '_preprocess_containers',
+                   mock.Mock())
+class TestRestoreManyReservation(DBTestCase):
+    """Pods are reserved by real `PodCollection` in one transaction."""
+
+    def setUp(self):
+        self.user, _ = self.fixtures.user_fixtures()
+        ippool = IPPool(network='192.168.43.0/30')
+        ippool.save()
+        self.free_ips = len(ippool.free_hosts())
+
+    @mock.patch.object(podcollection.PodCollection, 'create_reserved')
+    @mock.patch.object(pods._PodRestoreCommand, '_start_pod_if_needed')
+    def test_reserve_pods(self, start_mock, create_mock):
+        create_mock.side_effect = lambda reservation: {
+            'id': reservation.pod.id, 'name': reservation.pod.name}
+        start_mock.side_effect = lambda pod: pod
+        # stopped pods get public IPs later, so they are not counted
+        dumps = [full_pod_dump('running{0}'.format(i), 'running')
+                 for i in range(self.free_ips)]
+        dumps.append(full_pod_dump('stopped', 'stopped'))
+
+        result = pods.restore_many(dumps, self.user)
+        self.assertEqual([r['name'] for r in result],
+                         [d['pod_data']['name'] for d in dumps])
+        saved = DBPod.query.filter_by(owner_id=self.user.id).all()
+        self.assertEqual(sorted(p.id for p in saved),
+                         sorted(r['pod']['id'] for r in result))
+
+    @mock.patch.object(podcollection.PodCollection, 'create_reserved')
+    def test_not_enough_public_ips(self, create_mock):
+        dumps = [full_pod_dump('running{0}'.format(i), 'running')
+                 for i in range(self.free_ips + 1)]
+        with self.assertRaises(NoFreeIPs):
+            pods.restore_many(dumps, self.user)
+        self.assertFalse(create_mock.called)
+        # nothing is saved, even pods which got their IP
+        self.assertIsNone(
+            DBPod.query.filter_by(owner_id=self.user.id).first())
+
+
+if __name__ == '__main__':
+    unittest.main()
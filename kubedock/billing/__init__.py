@@ -19,11 +19,12 @@
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
 from .models import Kube, Package, ExtraTax, PackageKube
+from .catalog import get_catalog
 from kubedock.system_settings.models import SystemSettings
 
 
 def kubes_to_limits(count, kube_type):
-    kube = Kube.query.get(kube_type)
+    kube = get_catalog().get_kube(kube_type)
 
     resources = {
         'cpu': '{0}'.format(count * kube.cpu),
@@ -36,7 +37,7 @@ def kubes_to_limits(count, kube_type):
 
 
 def repr_limits(count, kube_type):
-    kube = Kube.query.get(kube_type)
+    kube = get_catalog().get_kube(kube_type)
 
     cpu = '{0} {1}'.format(count * kube.cpu, kube.cpu_units)
     memory = '{0} {1}'.format(count * kube.memory, kube.memory_units)
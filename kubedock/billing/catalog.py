@@ -0,0 +1,132 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Process-wide read-only snapshot of kube types and packages.
+
+Kube types and packages are changed only by admin, but they are read on
+every pod validation, limits calculation and kubelet event. The snapshot
+serves those lookups from memory. Every process keeps its own copy and
+compares it with the version counter stored in Redis; any commit that
+touches kubes, packages, package kubes or kube type of nodes increments
+the counter, so other processes reload the snapshot on the next lookup.
+
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import inspect
+
+from ..core import db, VersionedSnapshot
+from ..nodes.models import Node
+from .models import Kube, Package, PackageKube, Limits, NOT_PUBLIC_KUBE_TYPES
+
+#: Redis key of the catalog version counter
+CATALOG_VERSION_KEY = 'kd.billing.catalog.version'
+
+_KUBE_FIELDS = ('id', 'name', 'cpu', 'cpu_units', 'memory', 'memory_units',
+                'disk_space', 'disk_space_units', 'included_traffic',
+                'is_default')
+_PACKAGE_FIELDS = ('id', 'name', 'first_deposit', 'currency', 'period',
+                   'prefix', 'suffix', 'price_ip', 'price_pstorage',
+                   'price_over_traffic', 'is_default', 'count_type')
+
+
+class KubeEntry(namedtuple('KubeEntry', _KUBE_FIELDS + ('available',))):
+    """Immutable copy of `billing.models.Kube`."""
+    __slots__ = ()
+
+    def to_limits(self, kubes=1):
+        return Limits(kubes * self.cpu, kubes * self.memory,
+                      kubes * self.disk_space)
+
+    def is_public(self):
+        return self.id not in NOT_PUBLIC_KUBE_TYPES
+
+
+class PackageEntry(namedtuple('PackageEntry', _PACKAGE_FIELDS + ('prices',))):
+    """Immutable copy of `billing.models.Package`.
+    `prices` maps id of every kube type in the package to its price.
+    """
+    __slots__ = ()
+
+    def has_kube(self, kube_id):
+        return kube_id in self.prices
+
+
+class Catalog(object):
+    """Snapshot of kube types and packages. Must not be modified."""
+
+    def __init__(self, kubes, packages):
+        self.kubes = {kube.id: kube for kube in kubes}
+        self.packages = {package.id: package for package in packages}
+
+    def get_kube(self, kube_id):
+        return self.kubes.get(kube_id)
+
+    def get_package(self, package_id):
+        return self.packages.get(package_id)
+
+    @classmethod
+    def load(cls):
+        with_nodes = {kube_id for (kube_id,) in
+                      db.session.query(Node.kube_id).distinct()}
+        with_nodes.add(Kube.get_internal_service_kube_type())
+        kubes = [KubeEntry(*(row + (row[0] in with_nodes,))) for row in
+                 db.session.query(*[getattr(Kube, f) for f in _KUBE_FIELDS])]
+        prices = {}
+        for package_id, kube_id, price in db.session.query(
+                PackageKube.package_id, PackageKube.kube_id,
+                PackageKube.kube_price):
+            prices.setdefault(package_id, {})[kube_id] = price
+        packages = [
+            PackageEntry(*(row + (prices.get(row[0], {}),))) for row in
+            db.session.query(*[getattr(Package, f) for f in _PACKAGE_FIELDS])]
+        return cls(kubes, packages)
+
+
+def _changes_catalog(obj):
+    # only kube type of nodes is a part of the catalog
+    if not isinstance(obj, Node):
+        return True
+    state = inspect(obj)
+    return state.attrs.kube_id.history.has_changes()
+
+
+_snapshot = VersionedSnapshot(
+    CATALOG_VERSION_KEY, Catalog.load, (Kube, Package, PackageKube, Node),
+    is_changed=_changes_catalog)
+
+
+def get_catalog():
+    """Returns actual snapshot of kube types and packages."""
+    return _snapshot.get()
+
+
+def clear():
+    """Drops snapshot of the current process."""
+    _snapshot.clear()
+
+
+def invalidate(session=None):
+    """Invalidates the snapshot in all processes. If there is a transaction
+    in progress, the snapshot will be invalidated once again after commit,
+    so other processes will not keep data loaded before commit.
+    """
+    _snapshot.invalidate(session)
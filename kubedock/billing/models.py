@@ -182,6 +182,8 @@ class Kube(BaseModelMixin, db.Model):
         return kube_type != INTERNAL_SERVICE_KUBE_TYPE
 
     def send_event(self, name):
+        from .catalog import invalidate
+        invalidate()
         event_name, data = 'kube:{0}'.format(name), self.to_dict()
         for (user_id,) in db.session.query(User.id).filter(
                 User.package_id.in_([p.package_id for p in self.packages])).all():
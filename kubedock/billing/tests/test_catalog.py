@@ -0,0 +1,110 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+
+from kubedock.billing import catalog
+from kubedock.billing.models import Kube, PackageKube
+from kubedock.core import db
+from kubedock.testutils.testcases import DBTestCase
+from kubedock.validation import check_new_pod_data
+
+CATALOG_TABLES = ('kubes', 'packages', 'package_kube', 'nodes')
+
+
+@mock.patch.object(catalog._snapshot, '_get_version',
+                   mock.Mock(return_value='1'))
+class TestCatalog(DBTestCase):
+    def setUp(self):
+        self.user, _ = self.fixtures.user_fixtures()
+        self.kube = Kube.get_default_kube()
+        self.db.session.add(self.fixtures.node(kube_id=self.kube))
+        self.db.session.commit()
+
+    def test_no_queries_during_pod_validation(self):
+        catalog.get_catalog()  # warm up
+        statements = []
+
+        def log_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute', log_statement)
+        try:
+            check_new_pod_data({
+                'name': 'just name',
+                'containers': [{'name': 'just name', 'image': 'nginx'}],
+                'kube_type': self.kube.id,
+                'restartPolicy': 'Always',
+            }, self.user)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', log_statement)
+
+        catalog_queries = [s for s in statements
+                           if any(' {0} '.format(t) in s
+                                  for t in CATALOG_TABLES)]
+        self.assertEqual(catalog_queries, [])
+
+    def test_snapshot(self):
+        snapshot = catalog.get_catalog()
+        self.assertIs(catalog.get_catalog(), snapshot)
+
+        kube = snapshot.get_kube(self.kube.id)
+        self.assertEqual((kube.name, kube.cpu, kube.memory),
+                         (self.kube.name, self.kube.cpu, self.kube.memory))
+        self.assertTrue(kube.available)
+        package = snapshot.get_package(self.user.package_id)
+        self.assertTrue(package.has_kube(self.kube.id))
+
+    def test_invalidated_on_change(self):
+        snapshot = catalog.get_catalog()
+        new_kube = self.fixtures.kube_type()
+        snapshot = self.assertChanged(snapshot)
+        self.assertFalse(snapshot.get_kube(new_kube.id).available)
+
+        PackageKube(package_id=self.user.package_id, kube_id=new_kube.id,
+                    kube_price=1).save()
+        snapshot = self.assertChanged(snapshot)
+        self.assertTrue(snapshot.get_package(self.user.package_id)
+                        .has_kube(new_kube.id))
+
+        self.db.session.add(self.fixtures.node(kube_id=new_kube))
+        self.db.session.commit()
+        snapshot = self.assertChanged(snapshot)
+        self.assertTrue(snapshot.get_kube(new_kube.id).available)
+
+        Kube.query.filter_by(id=new_kube.id).update({Kube.cpu: 1})
+        snapshot = self.assertChanged(snapshot)
+        self.assertEqual(snapshot.get_kube(new_kube.id).cpu, 1)
+
+    def test_not_invalidated_by_other_models(self):
+        snapshot = catalog.get_catalog()
+        self.fixtures.user_fixtures()
+        self.assertIs(catalog.get_catalog(), snapshot)
+
+    def assertChanged(self, snapshot):
+        new_snapshot = catalog.get_catalog()
+        self.assertIsNot(new_snapshot, snapshot)
+        return new_snapshot
+
+
+if __name__ == '__main__':
+    unittest.main()
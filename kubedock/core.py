@@ -26,7 +26,9 @@ import paramiko
 import redis
 from paramiko.ssh_exception import AuthenticationException, SSHException
 from flask_sqlalchemy_fix import SQLAlchemy
-from flask import current_app
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from werkzeug.contrib.cache import RedisCache
 
 from .login import LoginManager
@@ -157,6 +159,116 @@ class ExclusiveLockContextManager(object):
         self._lock.release()
 
 
+class VersionedSnapshot(object):
+    """Process-wide read-only snapshot of rarely changed tables.
+
+    Every process keeps its own copy and compares it with the version counter
+    stored in Redis; any commit that touches watched tables increments the
+    counter, so other processes (uwsgi workers, celery workers) reload the
+    snapshot on the next lookup. Changes made by the process itself are
+    visible at once.
+
+    """
+    #: How often (in seconds) a process compares its snapshot with the
+    # version stored in Redis.
+    check_interval = 1
+
+    def __init__(self, version_key, loader, models, is_changed=None):
+        """
+        :param version_key: Redis key of the version counter
+        :param loader: callable without arguments which loads the snapshot
+        :param models: models of watched tables
+        :param is_changed: optional callable which tells if modified (not new
+            or deleted) instance of watched models changes the snapshot
+        """
+        self.version_key = version_key
+        self.loader = loader
+        self.models = tuple(models)
+        self.tables = tuple(model.__table__ for model in self.models)
+        self.is_changed = is_changed
+        #: Flag in `Session.info` which means that the snapshot must be
+        # invalidated when the transaction ends.
+        self._dirty_flag = version_key + '.dirty'
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_bulk_update', self._after_bulk_operation)
+        event.listen(Session, 'after_bulk_delete', self._after_bulk_operation)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def get(self):
+        """Returns actual snapshot."""
+        snapshot, now = self._snapshot, time.time()
+        fresh = now - self._checked_at < self.check_interval
+        if snapshot is not None and fresh:
+            return snapshot
+        version = self._get_version()
+        if snapshot is None or version is None or self._version != version:
+            snapshot = self.loader()
+        if version is not None:
+            # without version we cannot tell when the snapshot becomes
+            # outdated
+            self._snapshot, self._version = snapshot, version
+            self._checked_at = now
+        return snapshot
+
+    def clear(self):
+        """Drops snapshot of the current process."""
+        self._snapshot = None
+
+    def invalidate(self, session=None):
+        """Invalidates the snapshot in all processes. If there is a
+        transaction in progress, the snapshot will be invalidated once again
+        after commit, so other processes will not keep data loaded before
+        commit.
+        """
+        self.clear()
+        self._bump_version()
+        (session or db.session()).info[self._dirty_flag] = True
+
+    def _get_version(self):
+        try:
+            return ConnectionPool.get_connection().get(self.version_key)
+        except redis.RedisError as e:
+            current_app.logger.warning('Failed to get version of {0}: {1}'
+                                       .format(self.version_key, e))
+
+    def _bump_version(self):
+        if not has_app_context():
+            return
+        try:
+            ConnectionPool.get_connection().incr(self.version_key)
+        except redis.RedisError as e:
+            current_app.logger.warning('Failed to update version of {0}: {1}'
+                                       .format(self.version_key, e))
+
+    def _after_flush(self, session, flush_context):
+        for obj in session.new | session.dirty | session.deleted:
+            if not isinstance(obj, self.models):
+                continue
+            modified = obj in session.dirty and self.is_changed is not None
+            if not modified or self.is_changed(obj):
+                self.clear()
+                session.info[self._dirty_flag] = True
+                return
+
+    def _after_bulk_operation(self, context):
+        if context.primary_table in self.tables:
+            self.clear()
+            context.session.info[self._dirty_flag] = True
+
+    def _after_commit(self, session):
+        if session.info.pop(self._dirty_flag, False):
+            self.clear()
+            self._bump_version()
+
+    def _after_rollback(self, session):
+        if session.info.pop(self._dirty_flag, False):
+            self.clear()
+
+
 class ServerSentEvents(object):
 
     def __init__(self):
@@ -35,10 +35,15 @@ from ..settings import ETCD_ALLOWED_PORT_KEY_PATH, ETCD_HOST, ETCD_PORT
 ETCD_ERROR_MESSAGE = "Can't update allowed port policy in etcd"
 
 
-def _get_allowed_ports_rules():
+def _get_allowed_ports_rules(ports=None):
+    """Makes policy rules from (port, protocol) pairs. All ports stored in
+    database are used if `ports` is omitted.
+    """
+    if ports is None:
+        ports = [(port.port, port.protocol) for port in AllowedPort.query]
     allowed_ports = {}
-    for port in AllowedPort.query:
-        allowed_ports.setdefault(port.protocol, []).append(port.port)
+    for port, protocol in ports:
+        allowed_ports.setdefault(protocol, []).append(port)
 
     allowed_ports_rules = []
     for proto, ports in allowed_ports.items():
@@ -52,24 +57,38 @@ def get_ports():
     return [allowed_port.dict() for allowed_port in AllowedPort.query]
 
 
-def _set_allowed_ports_etcd():
-    allowed_ports_rules = _get_allowed_ports_rules()
-
-    allowed_ports_policy = json.dumps(
-        get_node_allowed_ports_policy(allowed_ports_rules)
-    )
-
+def _update_allowed_ports_etcd(
+        rules=None, error=AllowedPortsException.OpenPortError):
+    """Writes policy with the given rules (all ports from database by
+    default) to etcd or removes the policy if there are no rules.
+    Raises `error` if etcd is unavailable.
+    """
+    if rules is None:
+        rules = _get_allowed_ports_rules()
     client = etcd.Client(host=ETCD_HOST, port=ETCD_PORT)
-    try:
-        result = client.read(ETCD_ALLOWED_PORT_KEY_PATH)
-        result.value = allowed_ports_policy
-        client.update(result)
-    except etcd.EtcdKeyNotFound:
-        client.write(ETCD_ALLOWED_PORT_KEY_PATH, allowed_ports_policy)
-    except etcd.EtcdException:
-        raise AllowedPortsException.OpenPortError(
-            details={'message': ETCD_ERROR_MESSAGE}
-        )
+
+    if rules:
+        allowed_ports_policy = json.dumps(
+            get_node_allowed_ports_policy(rules))
+        try:
+            try:
+                result = client.read(ETCD_ALLOWED_PORT_KEY_PATH)
+                result.value = allowed_ports_policy
+                client.update(result)
+            except etcd.EtcdKeyNotFound:
+                client.write(ETCD_ALLOWED_PORT_KEY_PATH,
+                             allowed_ports_policy)
+        except etcd.EtcdException:
+            raise error(details={'message': ETCD_ERROR_MESSAGE})
+    else:
+        try:
+            client.delete(ETCD_ALLOWED_PORT_KEY_PATH)
+        except etcd.EtcdKeyNotFound:
+            pass
+        except etcd.EtcdException:
+            raise error(details={
+                'message': "Can't remove allowed ports policy from etcd"
+            })
 
 
 def set_port(port, protocol):
@@ -91,7 +110,7 @@ def set_port(port, protocol):
             details={'message': 'Error adding Allowed Port to database'}
         )
 
-    _set_allowed_ports_etcd()
+    _update_allowed_ports_etcd()
 
 
 def del_port(port, protocol):
@@ -113,29 +132,58 @@ def del_port(port, protocol):
             details={'message': 'Error deleting Allowed Port from database'}
         )
 
-    allowed_ports_rules = _get_allowed_ports_rules()
-
-    client = etcd.Client(host=ETCD_HOST, port=ETCD_PORT)
+    _update_allowed_ports_etcd(error=AllowedPortsException.ClosePortError)
+
+
+def _normalize_ports(ports):
+    return {(port, protocol.lower()) for port, protocol in ports}
+
+
+def update_ports(set_ports=(), del_ports=()):
+    """Applies a set of port changes at once. `set_ports` and `del_ports` are
+    iterables of (port, protocol) pairs. Ports that are already in the
+    requested state are skipped. Database is changed in one transaction and
+    the policy is recomputed and written to etcd only once, or not at all if
+    nothing has changed.
+    :return: dict with lists of actually opened and closed ports
+    """
+    to_set, to_del = _normalize_ports(set_ports), _normalize_ports(del_ports)
+    conflicts = to_set & to_del
+    if conflicts:
+        raise AllowedPortsException.OpenPortError(details={
+            'message': 'Same port is both in set and delete lists: {0}'.format(
+                ', '.join('{0}/{1}'.format(*p) for p in sorted(conflicts)))
+        })
+
+    existing = {(port.port, port.protocol): port
+                for port in AllowedPort.query}
+    to_set.difference_update(existing)
+    to_del.intersection_update(existing)
+    result = {
+        'opened': [{'port': port, 'protocol': protocol}
+                   for port, protocol in sorted(to_set)],
+        'closed': [{'port': port, 'protocol': protocol}
+                   for port, protocol in sorted(to_del)],
+    }
+    if not to_set and not to_del:
+        return result
+
+    for port, protocol in to_set:
+        db.session.add(AllowedPort(port=port, protocol=protocol))
+    for key in to_del:
+        db.session.delete(existing[key])
+
+    error = (AllowedPortsException.OpenPortError if to_set else
+             AllowedPortsException.ClosePortError)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise error(
+            details={'message': 'Error updating Allowed Ports in database'}
+        )
 
-    if allowed_ports_rules:
-        allowed_ports_policy = get_node_allowed_ports_policy(
-            allowed_ports_rules)
-        try:
-            result = client.read(ETCD_ALLOWED_PORT_KEY_PATH)
-            result.value = json.dumps(allowed_ports_policy)
-            client.update(result)
-        except etcd.EtcdException:
-            raise AllowedPortsException.ClosePortError(
-                details={'message': ETCD_ERROR_MESSAGE}
-            )
-    else:
-        try:
-            client.delete(ETCD_ALLOWED_PORT_KEY_PATH)
-        except etcd.EtcdKeyNotFound:
-            pass
-        except etcd.EtcdException:
-            raise AllowedPortsException.ClosePortError(
-                details={
-                    'message': "Can't remove allowed ports policy from etcd"
-                }
-            )
+    ports = set(existing).difference(to_del).union(to_set)
+    _update_allowed_ports_etcd(_get_allowed_ports_rules(sorted(ports)),
+                               error)
+    return result
@@ -19,13 +19,14 @@
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
 """Classes and utilities that handle predefined application"""
+import hashlib
 import json
 import pytz
 import re
 import yaml
 import random
 from collections import Mapping, Sequence
-from copy import deepcopy
+from copy import copy, deepcopy
 from datetime import datetime
 from numbers import Number
 from string import digits, lowercase
@@ -43,7 +44,7 @@ from kubedock.kd_celery import celery
 from kubedock.nodes.models import Node
 from kubedock.pods.models import Pod, IPPool, PersistentDisk
 from kubedock.settings import KUBE_API_VERSION
-from kubedock.utils import send_event_to_user, atomic
+from kubedock.utils import send_event_to_user, atomic, LRUCache
 from kubedock.validation import V, predefined_app_schema
 from kubedock.validation.exceptions import ValidationError
 from kubedock.validation.validators import check_new_pod_data
@@ -61,6 +62,32 @@ FIELD_PARSER = re.compile(ur"""
     )?\$
 """, re.X)
 
+#: Max number of compiled templates kept in memory
+COMPILED_TEMPLATES_CACHE_SIZE = 200
+
+# template content hash -> CompiledTemplate
+_compiled_templates = LRUCache(COMPILED_TEMPLATES_CACHE_SIZE)
+
+
+class CompiledTemplate(object):
+    """
+    Parts of predefined app template that depend only on template text,
+    so they may be shared between PredefinedApp instances.
+    Entities here are prototypes; every PredefinedApp instance works with
+    its own copies of them.
+    """
+    def __init__(self, preprocessed, entities):
+        self.preprocessed = preprocessed
+        self.entities = entities
+        self.loaded = None  # YAML document with entities' prototypes
+        self.raw = None  # YAML document loaded without preprocessing
+
+
+def _template_hash(template):
+    if isinstance(template, unicode):
+        template = template.encode('utf-8')
+    return hashlib.sha1(template).hexdigest()
+
 
 def check_migratability(pod, new_kube):
     if pod.kube_id == new_kube:
@@ -886,7 +913,30 @@ class PredefinedApp(object):
         if hasattr(self, '_loaded_template'):
             return self._loaded_template
         preprocessed = self._get_preprocessed_template()
+        compiled = getattr(self, '_compiled', None)
+        if compiled is None:
+            self._loaded_template = self._load_template(
+                preprocessed, self._entities_by_uid)
+            return self._loaded_template
 
+        if compiled.loaded is None:
+            compiled.loaded = self._load_template(preprocessed, dict(
+                (entity.uid, entity)
+                for entity in compiled.entities.itervalues()))
+        # replace prototypes with own entities while copying
+        memo = dict((id(compiled.entities[name]), entity)
+                    for name, entity in self._entities.iteritems())
+        self._loaded_template = deepcopy(compiled.loaded, memo)
+        return self._loaded_template
+
+    @staticmethod
+    def _load_template(preprocessed, entities_by_uid):
+        """
+        Loads preprocessed YAML document replacing entities UIDs with objects
+        :param preprocessed: string -> preprocessed YAML document
+        :param entities_by_uid: dict -> entities by UIDs
+        :return: dict -> loaded YAML document
+        """
         class CustomLoader(yaml.SafeLoader):
             pass
 
@@ -896,16 +946,14 @@ class PredefinedApp(object):
 
             @classmethod
             def from_yaml(cls, loader, node):
-                return self._entities_by_uid[loader.construct_scalar(node)]
+                return entities_by_uid[loader.construct_scalar(node)]
 
-        patt = re.compile(r'^(?:{0})$'.format('|'.join(self._entities_by_uid)))
+        patt = re.compile(r'^(?:{0})$'.format('|'.join(entities_by_uid)))
         CustomLoader.add_implicit_resolver('!kd', patt, None)
         try:
-            self._loaded_template = yaml.load(preprocessed,
-                                              Loader=CustomLoader)
+            return yaml.load(preprocessed, Loader=CustomLoader)
         except (yaml.scanner.ScannerError, yaml.parser.ParserError):
             raise PredefinedAppExc.UnparseableTemplate
-        return self._loaded_template
 
     def _get_package(self, template=None):
         """
@@ -918,10 +966,7 @@ class PredefinedApp(object):
             if hasattr(self, '_loaded_template'):
                 template = self._loaded_template
             else:
-                try:
-                    template = yaml.safe_load(self.template)
-                except (yaml.scanner.ScannerError, yaml.parser.ParserError):
-                    raise PredefinedAppExc.UnparseableTemplate
+                template = self._get_raw_template()
         package_id = template.get('kuberdock', {}).get('packageID')
         package = self._get_package_by_id(package_id)
         if template is None:
@@ -949,7 +994,7 @@ class PredefinedApp(object):
         :param
         """
         if template is None:
-            template = yaml.safe_load(self.template)
+            template = self._get_raw_template()
         try:
             plans = template['kuberdock']['appPackages']
         except KeyError:
@@ -973,14 +1018,46 @@ class PredefinedApp(object):
             if plan['name'] == name:
                 if index_only:
                     return idx
-                return plan
+                return deepcopy(plan)
         raise PredefinedAppExc.NoSuchAppPackage
 
-    def _get_preprocessed_template(self):
+    def _get_raw_template(self):
         """
-        Method that populates entities replacing template ones with random UIDs
-        :return: string -> processed yaml document
+        Returns template document loaded as is, without preprocessing.
+        Don't modify it, the same document is shared between instances.
+        :return: dict -> loaded YAML document
         """
+        compiled = self._get_compiled_template()
+        if compiled.raw is None:
+            try:
+                compiled.raw = yaml.safe_load(self.template)
+            except (yaml.scanner.ScannerError, yaml.parser.ParserError):
+                raise PredefinedAppExc.UnparseableTemplate
+        return compiled.raw
+
+    def _get_compiled_template(self):
+        """
+        Returns compiled template from cache or compiles it
+        :return: CompiledTemplate
+        """
+        if getattr(self, '_compiled', None) is not None:
+            return self._compiled
+        key = _template_hash(self.template)
+        compiled = _compiled_templates.get(key)
+        if compiled is None:
+            compiled = self._compile_template(self.template)
+            _compiled_templates.set(key, compiled)
+        self._compiled = compiled
+        return compiled
+
+    @classmethod
+    def _compile_template(cls, template):
+        """
+        Populates entities replacing template ones with random UIDs
+        :param template: string -> yaml document
+        :return: CompiledTemplate
+        """
+        entities = {}
 
         def processor(m):
             full_match = m.group()
@@ -988,22 +1065,33 @@ class PredefinedApp(object):
                 return '$'
             grps = m.groupdict()
             name, default, label = map(grps.get, ['name', 'default', 'label'])
-            if name in self._entities:
-                entity = self._entities[name]
+            if name in entities:
+                entity = entities[name]
                 if full_match != '${0}$'.format(name) and not entity.defined:
                     entity.set_up(default, label)
             else:
                 start = m.start()
                 line = m.string[:start].count('\n') + 1
                 col = len(m.string[:start].split('\n')[-1])
-                entity = self.TemplateField(name, default, label, line, col)
-                self._entities[name] = entity
-                self._entities_by_uid[entity.uid] = entity
+                entity = cls.TemplateField(name, default, label, line, col)
+                entities[name] = entity
             return entity.uid
 
+        preprocessed = FIELD_PARSER.sub(processor, template)
+        return CompiledTemplate(preprocessed, entities)
+
+    def _get_preprocessed_template(self):
+        """
+        Method that populates entities replacing template ones with random UIDs
+        :return: string -> processed yaml document
+        """
         if hasattr(self, '_preprocessed_template'):
             return self._preprocessed_template
-        preprocessed = FIELD_PARSER.sub(processor, self.template)
+        compiled = self._get_compiled_template()
+        for name, prototype in compiled.entities.iteritems():
+            entity = prototype.copy()
+            self._entities[name] = entity
+            self._entities_by_uid[entity.uid] = entity
         if self.throw:
             # check for $VAR$ without full definition ($VAR|default:...$)
             for entity in self._entities.itervalues():
@@ -1015,7 +1103,7 @@ class PredefinedApp(object):
                         """.format(entity.name, entity.line, entity.col,
                                    entity.name))
 
-        self._preprocessed_template = preprocessed
+        self._preprocessed_template = compiled.preprocessed
         return self._preprocessed_template
 
     def _get_template_spec(self, tpl=None):
@@ -1052,6 +1140,16 @@ class PredefinedApp(object):
         if not isinstance(loaded, Mapping):
             raise PredefinedAppExc.InvalidTemplate()
 
+        entities_by_uid = dict((entity.uid, entity)
+                               for entity in self._entities.itervalues())
+        any_uid = re.compile('|'.join(entities_by_uid)) \
+            if entities_by_uid else None
+
+        def substitute(match):
+            entity = entities_by_uid[match.group()]
+            used_entities[entity.name] = entity
+            return unicode(values.get(entity.name, entity.default))
+
         def fill(target):
             if isinstance(target, self.TemplateField):
                 used_entities[target.name] = target
@@ -1061,15 +1159,9 @@ class PredefinedApp(object):
                     return values[target.name]
                 return target.default
             if isinstance(target, basestring):
-                for entity in self._entities.itervalues():
-                    if entity.uid in target:
-                        used_entities[entity.name] = entity
-                        if entity.name in values:
-                            subst = values[entity.name]
-                        else:
-                            subst = entity.default
-                        target = target.replace(entity.uid, unicode(subst))
-                return target
+                if any_uid is None:
+                    return target
+                return any_uid.sub(substitute, target)
             if isinstance(target, Mapping):
                 return {fill(k): fill(v) for k, v in target.iteritems()}
             if isinstance(target, Sequence):
@@ -1122,8 +1214,10 @@ class PredefinedApp(object):
         :param plan_id: int -> plan index
         :return: dict -> template with only one plan
         """
-        copied = deepcopy(self._get_loaded_template())
-        plans = copied.get('kuberdock', {}).get('appPackages')
+        # _fill_template creates new document, so we don't need a deep copy
+        copied = dict(self._get_loaded_template())
+        copied['kuberdock'] = dict(copied.get('kuberdock', {}))
+        plans = copied['kuberdock'].get('appPackages')
         try:
             copied['kuberdock']['appPackages'] = [plans[plan_id]]
         except IndexError:
@@ -1177,6 +1271,17 @@ class PredefinedApp(object):
             if default is not None:
                 self.set_up(default.lstrip('\\'), label)
 
+        def copy(self):
+            """
+            Creates a copy of the entity with new generated default value
+            (if entity is "autogen")
+            :return: TemplateField
+            """
+            entity = copy(self)
+            if getattr(self, 'hidden', False):
+                entity.default = generate()
+            return entity
+
         def set_up(self, default, label):
             """
             Method which embodies PA entity
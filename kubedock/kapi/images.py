@@ -19,20 +19,25 @@
 # You should have received a copy of the GNU General Public License
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import hmac
 import json
-from itertools import chain
+import time
 from collections import Mapping, defaultdict, namedtuple
 from contextlib import contextmanager
+from copy import deepcopy
 from datetime import datetime
 from urllib import urlencode
 from urlparse import urlparse, parse_qsl, urlsplit
 
 import re
 import requests
-from ..core import db
+from ..core import db, ExclusiveLock
 from ..exceptions import APIError
+from ..kd_celery import celery
 from ..pods.models import DockerfileCache, PrivateRegistryFailedLogin
-from ..settings import DEFAULT_REGISTRY, DEFAULT_IMAGES_URL
+from ..settings import DEFAULT_REGISTRY, DEFAULT_IMAGES_URL, SECRET_KEY
+from ..utils import parallel_map, LRUCache
 
 
 # FIXME: private registries with self-signed certs
@@ -54,6 +59,107 @@ REQUEST_TIMEOUT = 15.0
 #: Timeout for ping requests to registries in seconds
 PING_REQUEST_TIMEOUT = 5.0
 
+#: Max number of images checked simultaneously in Image.check_containers
+MAX_PARALLEL_IMAGE_CHECKS = 8
+
+#: Max number of kept-alive connections to one registry
+REGISTRY_POOL_SIZE = 10
+
+#: Bearer token lifetime in seconds if registry didn't specify it
+#  (see https://docs.docker.com/registry/spec/auth/token/)
+DEFAULT_TOKEN_EXPIRES_IN = 60
+
+#: Cached bearer tokens are dropped this number of seconds before expiry
+TOKEN_EXPIRY_MARGIN = 5
+
+#: Max number of container configs in the in-process cache
+IMAGE_CONFIG_CACHE_SIZE = 1000
+
+#: Container config is kept in the in-process cache this number of seconds,
+#  after that it will be taken from DB
+IMAGE_CONFIG_CACHE_TTL = 5 * 60
+
+#: Missing images are remembered this number of seconds
+MISSING_IMAGE_CACHE_TTL = 30
+
+#: Max time in seconds for background refresh of container config
+REFRESH_CONFIG_LOCK_TTL = 60
+
+# All sessions share these adapters, so connections to registries are reused
+_registry_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=REGISTRY_POOL_SIZE, pool_maxsize=REGISTRY_POOL_SIZE)
+
+# (registry host, scope, username, password) -> (token, expiration time)
+_bearer_tokens = {}
+
+
+def registry_session():
+    """
+    Create requests.Session for docker registries. Sessions are cheap, but
+    they use shared pool of kept-alive connections.
+    """
+    s = requests.Session()
+    s.verify = False  # FIXME: private registries with self-signed certs
+    s.mount('https://', _registry_adapter)
+    s.mount('http://', _registry_adapter)
+    return s
+
+
+def get_cached_token(key):
+    """Get bearer token from cache if it's not expired yet."""
+    token, expires = _bearer_tokens.get(key, (None, 0))
+    if expires > time.time():
+        return token
+    _bearer_tokens.pop(key, None)
+
+
+def cache_token(key, token, expires_in=None):
+    expires_in = expires_in or DEFAULT_TOKEN_EXPIRES_IN
+    _bearer_tokens[key] = (
+        token, time.time() + expires_in - TOKEN_EXPIRY_MARGIN)
+
+
+def clear_token_cache():
+    _bearer_tokens.clear()
+
+
+#: Marker of negative result in the image config cache
+IMAGE_IS_MISSING = 'missing'
+
+# (image, auth hash) -> container config (or IMAGE_IS_MISSING)
+_config_cache = LRUCache(IMAGE_CONFIG_CACHE_SIZE, ttl=IMAGE_CONFIG_CACHE_TTL)
+
+
+def clear_config_cache():
+    _config_cache.clear()
+
+
+def _auth_hash(credentials):
+    """
+    Get HMAC of credentials list keyed with SECRET_KEY, so we can use it as
+    a part of cache key without storing passwords (plain hash of a password
+    could be brute-forced). For anonymous requests it's an empty string.
+    """
+    if not any(credentials):
+        return ''
+    return hmac.new(SECRET_KEY, json.dumps(credentials),
+                    hashlib.sha256).hexdigest()
+
+
+def _with_secret(data, credentials):
+    """
+    Copy cached container config and restore password of the secret
+    using provided credentials.
+    """
+    data = deepcopy(data)
+    secret = data.get('secret')
+    if secret is not None:
+        for auth in credentials:
+            if auth is not None and auth[0] == secret['username']:
+                secret['password'] = auth[1]
+                break
+    return data
+
 
 class ImageNotAvailable(APIError):
     message_template = 'Image "{image}" is not available'
@@ -146,7 +252,7 @@ class DockerAuth(requests.auth.AuthBase):
     """
     _bearer_pat = re.compile(r'bearer ', flags=re.IGNORECASE)
 
-    def __init__(self, username=None, password=None):
+    def __init__(self, username=None, password=None, scope=None):
         """
         Usage:
         DockerAuth('my-username', 'my-password')
@@ -154,14 +260,22 @@ class DockerAuth(requests.auth.AuthBase):
         DockerAuth(['my-username', 'my-password'])
         without credentials:
         DockerAuth(), DockerAuth(None), DockerAuth(None, None)
+
+        :param scope: expected token scope, like "repository:quay/redis:pull".
+            If there is a cached token for this scope, it will be sent
+            with the first request, so 401-challenge will be skipped.
         """
         if hasattr(username, '__iter__') and password is None:
             # got one iterable
             username, password = username
         self.username, self.password = username, password
+        self.scope = scope
         self.num_401_calls = 0
         self.original_url = None
 
+    def _token_key(self, url, scope):
+        return (urlparse(url).netloc, scope, self.username, self.password)
+
     def get_token(self, chal):
         """
         Try to complete the challenge.
@@ -174,10 +288,12 @@ class DockerAuth(requests.auth.AuthBase):
         url = url._replace(query=query).geturl()
         auth = None if self.username is None \
             else (self.username, self.password)
-        response = requests.get(url, auth=auth, timeout=REQUEST_TIMEOUT)
+        response = registry_session().get(url, auth=auth,
+                                          timeout=REQUEST_TIMEOUT)
         data = _json_or_none(response)
         if isinstance(data, dict):
-            return data.get('token')
+            return data.get('token'), data.get('expires_in')
+        return None, None
 
     def handle_401(self, response, **kwargs):
         s_auth = response.headers.get('www-authenticate')
@@ -197,6 +313,7 @@ class DockerAuth(requests.auth.AuthBase):
             response.raw.release_conn()
             prep = response.request.copy()
 
+            token_key = token = expires_in = None
             if method == 'basic' and self.username is not None:
                 # private registry
                 prep = requests.auth.HTTPBasicAuth(
@@ -204,7 +321,12 @@ class DockerAuth(requests.auth.AuthBase):
             elif method == 'bearer':  # Docker Registry v2 authentication
                 chal = requests.utils.parse_dict_header(
                     self._bearer_pat.sub('', s_auth, count=1))
-                token = self.get_token(chal)
+                token_key = self._token_key(
+                    prep.url, self.scope or chal.get('scope'))
+                # cached token (if any) was rejected
+                _bearer_tokens.pop(token_key, None)
+                prep.headers.pop('Authorization', None)
+                token, expires_in = self.get_token(chal)
                 if token is not None:
                     prep.headers['Authorization'] = 'Bearer {0}'.format(token)
 
@@ -213,10 +335,16 @@ class DockerAuth(requests.auth.AuthBase):
             new_response.request = prep
             if new_response.status_code == requests.codes.unauthorized:
                 save_failed_login(self.username, response.request.url)
+            elif token is not None:
+                cache_token(token_key, token, expires_in)
             return new_response
         return response
 
     def __call__(self, request):
+        if self.scope is not None:
+            token = get_cached_token(self._token_key(request.url, self.scope))
+            if token is not None:
+                request.headers['Authorization'] = 'Bearer {0}'.format(token)
         request.register_hook('response', self.handle_401)
         return request
 
@@ -395,13 +523,12 @@ class Image(namedtuple('Image', ['full_registry', 'registry', 'repo', 'tag'])):
         :raise APIVersionError: for check requests - if registry doesn't
             support api v2
         """
-        s = requests.Session()
-        s.verify = False  # FIXME: private registries with self-signed certs
-
+        s = registry_session()
         url = get_url(self.full_registry, 'v2', self.repo, 'manifests',
                       self.tag)
+        scope = 'repository:{0}:pull'.format(self.repo)
         try:
-            response = s.get(url, auth=DockerAuth(auth),
+            response = s.get(url, auth=DockerAuth(auth, scope=scope),
                              timeout=REQUEST_TIMEOUT)
             if response.status_code != 200:
                 version = response.headers.get(API_VERSION_HEADER)
@@ -431,8 +558,7 @@ class Image(namedtuple('Image', ['full_registry', 'registry', 'repo', 'tag'])):
         :returns: full image info (True if just_check=True) or None
         """
         registry, _, repo, tag = self
-        s = requests.Session()
-        s.verify = False  # FIXME: private registries with self-signed certs
+        s = registry_session()
         try:
             docker_auth_v1(s, registry, repo, auth)
             url = get_url(registry, 'v1/repositories', repo, 'tags', tag)
@@ -514,42 +640,74 @@ class Image(namedtuple('Image', ['full_registry', 'registry', 'repo', 'tag'])):
         """
         if isinstance(auth, Mapping):
             auth = (auth.get('username'), auth.get('password'))
+        elif auth is not None:
+            auth = tuple(auth)
         additional_auth_set = set()
         if secrets is not None:
             additional_auth_set.update(
                 (username, password)
                 for username, password, registry in secrets
                 if registry == self.full_registry)
-
-        cache_enabled = auth is None and secrets is None
-        if cache_enabled:
-            cached_config = DockerfileCache.query.get(str(self))
-            if not (refresh_cache
-                    or cached_config is None
-                    or cached_config.outdated):
-                return cached_config.data
+        credentials = [auth] + sorted(additional_auth_set)
+
+        auth_hash = _auth_hash(credentials)
+        cache_key = (str(self), auth_hash)
+        if not refresh_cache:
+            cached = _config_cache.get(cache_key)
+            if cached is None:
+                cached_config = DockerfileCache.query.get(cache_key)
+                if cached_config is not None and not cached_config.outdated:
+                    cached = cached_config.data
+                    _config_cache.set(cache_key, cached)
+                elif cached_config is not None and not auth_hash:
+                    # serve outdated config, but refresh it in background.
+                    # Credentials are never sent to the task, so outdated
+                    # configs of authenticated requests are refreshed below.
+                    cached = cached_config.data
+                    self._schedule_refresh(cache_key)
+            if cached is IMAGE_IS_MISSING:
+                raise APIError('Couldn\'t get the image')
+            if cached is not None:
+                return _with_secret(cached, credentials)
 
         # try to get image data using provided auth data
         # (or without auth) first, then using provided secrets
-        for auth in chain([auth], additional_auth_set):
+        for auth in credentials:
             image_info = self._request_image_info(auth)
             if image_info is not None and 'config' in image_info:
                 data = self._prepare_response(image_info, auth)
                 break
         else:
             check_registry_status(self.full_registry)
+            _config_cache.set(cache_key, IMAGE_IS_MISSING,
+                              ttl=MISSING_IMAGE_CACHE_TTL)
             raise APIError('Couldn\'t get the image')
 
-        if cache_enabled:
-            if cached_config is None:
-                db.session.add(DockerfileCache(image=str(self), data=data,
-                                               time_stamp=datetime.utcnow()))
-            else:
-                cached_config.data = data
-                cached_config.time_stamp = datetime.utcnow()
-            db.session.commit()
+        # do not store passwords in cache
+        cached = deepcopy(data)
+        if 'secret' in cached:
+            cached['secret'].pop('password')
+        _config_cache.set(cache_key, cached)
+        cached_config = DockerfileCache.query.get(cache_key)
+        if cached_config is None:
+            db.session.add(DockerfileCache(
+                image=str(self), auth_hash=auth_hash, data=cached,
+                time_stamp=datetime.utcnow()))
+        else:
+            cached_config.data = cached
+            cached_config.time_stamp = datetime.utcnow()
+        db.session.commit()
         return data
 
+    def _schedule_refresh(self, cache_key):
+        """Start background refresh of cached anonymous config, if it's not
+        started yet.
+        """
+        lock = ExclusiveLock('image-config-refresh.{0}.{1}'.format(*cache_key),
+                             ttl=REFRESH_CONFIG_LOCK_TTL)
+        if lock.lock():
+            refresh_container_config.delay(str(self))
+
     def _check_availability(self, registries, fast=True):
         """
         Try to get image from registry.
@@ -619,12 +777,33 @@ class Image(namedtuple('Image', ['full_registry', 'registry', 'repo', 'tag'])):
             registry = complement_registry(registry)
             registries[registry]['auth'].append((username, password))
 
+        # Each image is checked only once, even if it's used in several
+        # containers. Full config is requested only if some container needs
+        # extra check: image must have CMD or ENTRYPOINT.
+        need_config = {}
         for container in containers:
             image = cls(container['image'])
+            need_config[image] = need_config.get(image, False) or not (
+                container.get('args') or container.get('command'))
+        # create all registries before the checks start
+        for image in need_config:
+            registries[image.full_registry]
+
+        images = list(need_config)
+        image_data = dict(zip(images, parallel_map(
+            lambda image: image._check_availability(
+                registries, fast=not need_config[image]),
+            images, MAX_PARALLEL_IMAGE_CHECKS)))
+
+        for container in containers:
             if not (container.get('args') or container.get('command')):
-                # need extra check: image must have CMD or ENTRYPOINT
-                image_data = image._check_availability(registries, fast=False)
-                if not (image_data.get('Cmd') or image_data.get('Entrypoint')):
+                image = cls(container['image'])
+                data = image_data[image]
+                if not (data.get('Cmd') or data.get('Entrypoint')):
                     raise CommandIsMissing(image, container['name'])
-            else:
-                image._check_availability(registries)
+
+
+@celery.task(ignore_result=True)
+def refresh_container_config(image):
+    """Update cached anonymous container config of the image."""
+    Image(image).get_container_config(refresh_cache=True)
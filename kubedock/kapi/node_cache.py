@@ -0,0 +1,147 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of kubernetes nodes shared by all processes.
+
+`listeners.listen_nodes` updates the cache on every node event. Kubelet
+posts node status every few seconds, so while the listener works the cache
+is refreshed constantly; if nothing was written to it for
+`NODES_CACHE_MAX_AGE` seconds (listener is down, redis was restarted) the
+cache is stale and callers have to get nodes from kubernetes.
+
+Only fields used by `node_utils` are kept: name, capacity and conditions.
+"""
+
+import json
+import time
+
+import redis
+from flask import current_app
+
+from ..core import ConnectionPool
+
+#: Redis hash of cached nodes (hostname -> node)
+NODES_CACHE_KEY = 'kd.nodes.k8s'
+
+#: Redis key with time of the last cache update
+NODES_CACHE_SYNCED_KEY = 'kd.nodes.k8s.synced_at'
+
+#: Cache which was not updated for this number of seconds is stale
+NODES_CACHE_MAX_AGE = 30
+
+
+def _trim(k8s_node):
+    status = k8s_node.get('status') or {}
+    return {
+        'metadata': {'name': k8s_node['metadata']['name']},
+        'status': {'capacity': status.get('capacity', {}),
+                   'conditions': status.get('conditions', [])},
+    }
+
+
+def _log_error(action, e):
+    current_app.logger.warning(
+        'Failed to {0} nodes cache: {1}'.format(action, e))
+
+
+def update(k8s_node, event_type):
+    """Apply node event to the cache."""
+    hostname = k8s_node['metadata']['name']
+    try:
+        pipe = ConnectionPool.get_connection().pipeline()
+        if event_type == 'DELETED':
+            pipe.hdel(NODES_CACHE_KEY, hostname)
+        else:
+            pipe.hset(NODES_CACHE_KEY, hostname, json.dumps(_trim(k8s_node)))
+        pipe.set(NODES_CACHE_SYNCED_KEY, time.time())
+        pipe.execute()
+    except redis.RedisError as e:
+        _log_error('update', e)
+
+
+def fill(k8s_nodes):
+    """Replace the cache with full list of nodes from kubernetes."""
+    try:
+        pipe = ConnectionPool.get_connection().pipeline()
+        pipe.delete(NODES_CACHE_KEY)
+        if k8s_nodes:
+            pipe.hmset(NODES_CACHE_KEY, {
+                node['metadata']['name']: json.dumps(_trim(node))
+                for node in k8s_nodes})
+        pipe.set(NODES_CACHE_SYNCED_KEY, time.time())
+        pipe.execute()
+    except redis.RedisError as e:
+        _log_error('fill', e)
+
+
+def clear():
+    try:
+        ConnectionPool.get_connection().delete(NODES_CACHE_KEY,
+                                               NODES_CACHE_SYNCED_KEY)
+    except redis.RedisError as e:
+        _log_error('clear', e)
+
+
+def age():
+    """Seconds since the last update of the cache or None if the cache is
+    empty or unavailable.
+    """
+    try:
+        synced_at = ConnectionPool.get_connection().get(
+            NODES_CACHE_SYNCED_KEY)
+    except redis.RedisError as e:
+        _log_error('read', e)
+        return None
+    if synced_at is None:
+        return None
+    return max(0, time.time() - float(synced_at))
+
+
+def is_stale():
+    age_ = age()
+    return age_ is None or age_ > NODES_CACHE_MAX_AGE
+
+
+def get_all():
+    """Returns dict of cached nodes by hostname or None if the cache is
+    stale.
+    """
+    if is_stale():
+        return None
+    try:
+        nodes = ConnectionPool.get_connection().hgetall(NODES_CACHE_KEY)
+    except redis.RedisError as e:
+        _log_error('read', e)
+        return None
+    return {hostname: json.loads(node) for hostname, node in nodes.items()}
+
+
+def get(hostname):
+    """Returns tuple (found, node). If the cache is stale, `found` is False.
+    Otherwise node is None if the cache has no such node.
+    """
+    if is_stale():
+        return False, None
+    try:
+        node = ConnectionPool.get_connection().hget(NODES_CACHE_KEY, hostname)
+    except redis.RedisError as e:
+        _log_error('read', e)
+        return False, None
+    return True, (json.loads(node) if node is not None else None)
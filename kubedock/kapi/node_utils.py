@@ -40,6 +40,7 @@ from ..settings import (
     ETCD_CALICO_HOST_CONFIG_KEY_PATH_TEMPLATE, ETCD_NETWORK_POLICY_NODES,
     KD_NODE_HOST_ENDPOINT_ROLE)
 from .network_policies import get_node_host_endpoint_policy
+from . import node_cache
 
 
 def get_nodes_collection(kube_type=None):
@@ -64,7 +65,7 @@ def get_nodes_collection(kube_type=None):
     else:
         nodes = Node.query.filter_by(kube_id=kube_type)
 
-    kub_hosts = {x['metadata']['name']: x for x in get_all_nodes()}
+    kub_hosts = get_k8s_nodes()
     # AC-3349 Fix. The side effect described above was fixed in some previous
     # patches and this part is not needed any more.
     # nodes = _fix_missed_nodes(nodes, kub_hosts)
@@ -291,9 +292,11 @@ def get_one_node(node_id):
         raise APIError("Error. Node {0} doesn't exists".format(node_id),
                        status_code=404)
 
-    k8s_node = _get_k8s_node_by_host(node.hostname)
-    if k8s_node['status'] == 'Failure':
-        k8s_node = None
+    found, k8s_node = node_cache.get(node.hostname)
+    if not found:
+        k8s_node = _get_k8s_node_by_host(node.hostname)
+        if k8s_node['status'] == 'Failure':
+            k8s_node = None
 
     node_status, node_reason = get_status(node, k8s_node)
     install_log = get_install_log(node_status, node.hostname)
@@ -344,6 +347,21 @@ def get_all_nodes():
     return r.json().get('items') or []
 
 
+def get_k8s_nodes():
+    """Returns dict of kubernetes nodes by hostname. Nodes are taken from
+    the cache kept by nodes listener. If the cache is stale, nodes are
+    requested from kubernetes and the cache is filled again.
+    """
+    nodes = node_cache.get_all()
+    if nodes is None:
+        current_app.logger.debug('Nodes cache is stale (age: %s)',
+                                 node_cache.age())
+        k8s_nodes = get_all_nodes()
+        node_cache.fill(k8s_nodes)
+        nodes = {x['metadata']['name']: x for x in k8s_nodes}
+    return nodes
+
+
 def divide_on_multipliers(resources):
     cpu_multiplier = float(SystemSettings.get_by_name('cpu_multiplier'))
     memory_multiplier = float(SystemSettings.get_by_name('memory_multiplier'))
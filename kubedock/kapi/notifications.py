@@ -18,13 +18,86 @@
 # You should have received a copy of the GNU General Public License
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
+"""Notifications (advises) shown to users of some role.
+
+Events of every role are cached in Redis, the cache of a role is dropped
+when a notification is attached to or detached from the role.
+"""
+
+import json
 from datetime import datetime
 
-from kubedock.core import db
+import redis
+from flask import current_app
+
+from kubedock.core import db, ConnectionPool
 from kubedock.notifications.models import Notification, RoleForNotification
 from kubedock.rbac.models import Role
 from kubedock.utils import send_event_to_role
 
+#: Redis key of cached events of a role (list of events), formatted with
+# role id
+ROLE_EVENTS_CACHE_KEY = 'kd.notifications.roles.{0}'
+
+#: Lifetime of the cache (seconds), limits time of inconsistency if events
+# read before a change were cached after the change.
+ROLE_EVENTS_CACHE_TTL = 300
+
+
+def _log_error(action, e):
+    current_app.logger.warning(
+        'Failed to {0} notifications cache: {1}'.format(action, e))
+
+
+def _get_cached(role_id):
+    try:
+        events = ConnectionPool.get_connection().get(
+            ROLE_EVENTS_CACHE_KEY.format(role_id))
+    except redis.RedisError as e:
+        _log_error('read', e)
+        return None
+    return None if events is None else json.loads(events)
+
+
+def _set_cached(role_id, events):
+    try:
+        ConnectionPool.get_connection().setex(
+            ROLE_EVENTS_CACHE_KEY.format(role_id), ROLE_EVENTS_CACHE_TTL,
+            json.dumps(events))
+    except redis.RedisError as e:
+        _log_error('update', e)
+
+
+def invalidate(role_id):
+    """Drop cached events of the role."""
+    try:
+        ConnectionPool.get_connection().delete(
+            ROLE_EVENTS_CACHE_KEY.format(role_id))
+    except redis.RedisError as e:
+        _log_error('invalidate', e)
+
+
+def clear():
+    """Drop cached events of all roles."""
+    try:
+        redis_con = ConnectionPool.get_connection()
+        keys = list(redis_con.scan_iter(ROLE_EVENTS_CACHE_KEY.format('*')))
+        if keys:
+            redis_con.delete(*keys)
+    except redis.RedisError as e:
+        _log_error('clear', e)
+
+
+def _get_admin_role():
+    return Role.query.filter(Role.rolename == 'Admin').one()
+
+
+def _get_role_links(message, role):
+    """Links of the notification with the given message to the role."""
+    return RoleForNotification.query.join(
+        Notification, Notification.id == RoleForNotification.nid).filter(
+        Notification.message == message, RoleForNotification.rid == role.id)
+
 
 def attach_admin(message, target=None):
     """
@@ -34,13 +107,14 @@ def attach_admin(message, target=None):
     message_entry = Notification.query.filter_by(message=message).first()
     if message_entry is None:
         return
-    admin_role = Role.query.filter(Role.rolename == 'Admin').one()
-    if [r for r in message_entry.roles if r.role == admin_role]:
+    admin_role = _get_admin_role()
+    if _get_role_links(message, admin_role).first() is not None:
         return
-    evt_entry = RoleForNotification(time_stamp=datetime.now(), target=target)
-    evt_entry.role = admin_role
-    message_entry.roles.append(evt_entry)
+    evt_entry = RoleForNotification(time_stamp=datetime.now(), target=target,
+                                    nid=message_entry.id, rid=admin_role.id)
+    db.session.add(evt_entry)
     db.session.commit()
+    invalidate(admin_role.id)
     send_event_to_role('advise:show', {
         'id': evt_entry.id,
         'description': message_entry.description,
@@ -53,34 +127,36 @@ def detach_admin(message):
     Delete notifications for admin from database and send SSE event to
     web-interface
     """
-    message_entry = Notification.query.filter_by(message=message).first()
-    if message_entry is None:
+    admin_role = _get_admin_role()
+    messages = _get_role_links(message, admin_role).all()
+    if not messages:
         return
-    admin_role = Role.query.filter(Role.rolename == 'Admin').one()
-    messages = [r for r in message_entry.roles if r.role == admin_role]
-    targets = [{'id': msg.id, 'target': msg.target} for msg in messages]
-    try:
-        send_event_to_role('advise:hide', targets[0], admin_role.id)
-    except IndexError:
-        pass
+    send_event_to_role('advise:hide', {'id': messages[0].id,
+                                       'target': messages[0].target},
+                       admin_role.id)
     for message in messages:
         db.session.delete(message)
     db.session.commit()
+    invalidate(admin_role.id)
 
 
 def read_role_events(role=None):
     """
     Read events from database for a role
     """
-    events = []
     if role is None:
         return
-    for n in Notification.query.all():
-        for r in n.roles:
-            if r.role == role:
-                events.append({
-                    'id': n.id,
-                    'type': n.type,
-                    'target': r.target,
-                    'description': n.description})
+    events = _get_cached(role.id)
+    if events is not None:
+        return events
+    query = db.session.query(
+        Notification.id, Notification.type, RoleForNotification.target,
+        Notification.description,
+    ).join(RoleForNotification, RoleForNotification.nid == Notification.id
+           ).filter(RoleForNotification.rid == role.id
+                    ).order_by(Notification.id, RoleForNotification.id)
+    events = [{'id': nid, 'type': type_, 'target': target,
+               'description': description}
+              for nid, type_, target, description in query]
+    _set_cached(role.id, events)
     return events
@@ -21,12 +21,24 @@
 import socket
 import string
 
-from ..core import ExclusiveLockContextManager
+from sqlalchemy.exc import IntegrityError
+
+from ..core import db, ExclusiveLockContextManager
 from ..domains.models import BaseDomain, PodDomain
 from ..exceptions import (DomainNotFound, InternalAPIError, PodDomainExists,
                           PublicAccessAssigningError)
 from ..settings import PUBLIC_ACCESS_ASSIGNING_TIMEOUT
-from ..utils import domainize, randstr
+from ..utils import atomic, domainize, randstr
+
+#: How many times to retry insertion of autogenerated pod domain if its name
+# was taken by a concurrent transaction
+POD_DOMAIN_INSERT_RETRIES = 5
+
+#: Number of random names checked at once if the preferred one is taken
+UNIQUE_NAME_CANDIDATES = 20
+
+#: Length of random suffix for autogenerated pod domain names
+RANDOM_SUFFIX_LENGTH = 6
 
 
 def get_or_create_pod_domain(pod, domain_name):
@@ -37,6 +49,11 @@ def get_or_create_pod_domain(pod, domain_name):
     If that name already exists, then will be appended some random suffix to
     it.
 
+    New Pod Domain is inserted into DB right away (in a savepoint), so the
+    unique constraint on the name guarantees that concurrently assigned
+    domains don't clash. The lock is taken per Base Domain only to reduce
+    the number of such conflicts.
+
     :param pod: Pod object
     :type pod: kubedock.pods.models.Pod
     :param domain_name: Domain name, can be Base Domain or Full Domain
@@ -54,8 +71,12 @@ def get_or_create_pod_domain(pod, domain_name):
     :rtype: tuple
 
     """
+    base_domain = BaseDomain.query.filter_by(name=domain_name).first()
+    base_domain_name = (base_domain.name if base_domain else
+                        domain_name.split('.', 1)[-1])
+
     with ExclusiveLockContextManager(
-            'kapi.pod_domains.set_pod_domain',
+            'kapi.pod_domains.set_pod_domain.{0}'.format(base_domain_name),
             blocking=True,
             ttl=PUBLIC_ACCESS_ASSIGNING_TIMEOUT) as lock:
         if not lock:
@@ -63,52 +84,57 @@ def get_or_create_pod_domain(pod, domain_name):
                 'message': 'Timeout getting Pod Domain'
             })
 
-        base_domain = BaseDomain.query.filter_by(name=domain_name).first()
-
         if base_domain:
-            pod_domain, sub_domain_part = _autogen_subdomain(pod, base_domain)
-        else:
-            pod_domain, sub_domain_part, base_domain = \
-                _exact_subdomain(pod, domain_name)
+            return _autogen_subdomain(pod, base_domain)
 
-        created = not bool(pod_domain)  # True if pod_domain is None else False
+        pod_domain, sub_domain_part, base_domain = \
+            _exact_subdomain(pod, domain_name)
+        if pod_domain is not None:
+            return pod_domain, False
 
+        pod_domain = _insert_pod_domain(pod, base_domain, sub_domain_part)
         if pod_domain is None:
-            pod_domain = PodDomain(name=sub_domain_part,
-                                   base_domain=base_domain,
-                                   pod_id=pod.id)
-
-        return pod_domain, created
+            raise PodDomainExists('Domain name {0} already assigned to '
+                                  'existing Pod'.format(domain_name))
+        return pod_domain, True
 
 
 def _autogen_subdomain(pod, base_domain):
     """
-    Generate Subdomain from Pod name or Pod Domain if Pod already has it
+    Generate Subdomain from Pod name or return Pod Domain if Pod already has
+    it
 
     :param pod: Pod instance
     :param base_domain: BaseDomain instance in which zone Subdomain should be
      placed
-    :return: (pod_domain, sub_domain_part):
-     pod_domain -- if Pod Domain already exists for specified pod, else None
-     sub_domain_part -- autogenerated Subdomain part
+    :return: (pod_domain, created):
+     pod_domain -- existing or newly created Pod Domain
+     created -- True if Pod Domain was created
 
     """
-    pod_domain = PodDomain.query.filter_by(domain_id=base_domain.id,
-                                           pod_id=pod.id).first()
-    if pod_domain:
-        return pod_domain, None
-
     pod_name = domainize(pod.name)
     if not pod_name:
         pod_name = randstr(symbols=string.lowercase + string.digits,
                            length=8)
     user = domainize(pod.owner.username)
-    sub_domain_part = '{0}-{1}'.format(user, pod_name)
-    sub_domain_part = _get_unique_domain_name(sub_domain_part, base_domain.id)
-    if sub_domain_part is None:
-        raise InternalAPIError('Failed to get unique pod domain name')
+    basename = '{0}-{1}'.format(user, pod_name)
+
+    # the name may be taken by a concurrent transaction between selection
+    # and insertion, in this case just try another one
+    for _ in xrange(POD_DOMAIN_INSERT_RETRIES):
+        pod_domain = PodDomain.query.filter_by(domain_id=base_domain.id,
+                                               pod_id=pod.id).first()
+        if pod_domain:
+            return pod_domain, False
+
+        sub_domain_part = _get_unique_domain_name(basename, base_domain.id)
+        if sub_domain_part is None:
+            break
+        pod_domain = _insert_pod_domain(pod, base_domain, sub_domain_part)
+        if pod_domain is not None:
+            return pod_domain, True
 
-    return None, sub_domain_part
+    raise InternalAPIError('Failed to get unique pod domain name')
 
 
 def _exact_subdomain(pod, domain_name):
@@ -146,34 +172,39 @@ def _exact_subdomain(pod, domain_name):
     return None, sub_domain_part, base_domain
 
 
+def _insert_pod_domain(pod, base_domain, sub_domain_part):
+    """Insert new Pod Domain in a savepoint.
+    Returns None if the name (or a domain for the pod) was concurrently
+    taken by another transaction.
+    """
+    pod_domain = PodDomain(name=sub_domain_part, base_domain=base_domain,
+                           pod_id=pod.id)
+    try:
+        with atomic():
+            db.session.add(pod_domain)
+    except IntegrityError:
+        return None
+    return pod_domain
+
+
 def _get_unique_domain_name(basename, domain_id):
     """Returns unique domain name for given basename.
     If basename does not exists in DB with specified domain_id, then it will
     be returned as is.
-    Otherwise will be returned basename with random suffix
+    Otherwise will be returned basename with random suffix.
+    All candidates are checked with a single query.
     """
-    pod_domain = PodDomain.query.filter_by(name=basename,
-                                           domain_id=domain_id).first()
-    if pod_domain is None:
-        return basename
-
-    res = None
-    # try to get unique random domain name. If it fails for tries limit,
-    # then something is going wrong, return None and it will be better to fail
-    # in calling code
-    tries_limit = 100
-    random_suffix_length = 6
-    for _ in xrange(tries_limit):
-        suffix = randstr(
+    candidates = [basename] + [
+        '{0}{1}'.format(basename, randstr(
             symbols=string.lowercase + string.digits,
-            length=random_suffix_length)
-        new_name = '{0}{1}'.format(basename, suffix)
-        pod_domain = PodDomain.query.filter_by(
-            name=new_name, domain_id=domain_id).first()
-        if pod_domain is None:
-            res = new_name
-            break
-    return res
+            length=RANDOM_SUFFIX_LENGTH))
+        for _ in xrange(UNIQUE_NAME_CANDIDATES)]
+    taken = {name for (name,) in PodDomain.query.with_entities(
+        PodDomain.name).filter(PodDomain.domain_id == domain_id,
+                               PodDomain.name.in_(candidates))}
+    # if all candidates are taken, then something is going wrong, return None
+    # and it will be better to fail in calling code
+    return next((name for name in candidates if name not in taken), None)
 
 
 def validate_domain_reachability(domain):
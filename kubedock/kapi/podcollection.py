@@ -19,7 +19,7 @@
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
 import json
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from crypt import crypt
 from datetime import datetime
 from os import path
@@ -85,6 +85,9 @@ from ..utils import POD_STATUSES, NODE_STATUSES, KubeUtils, nested_dict_utils
 DIRECT_SSH_USERNAME_LEN = 30
 DIRECT_SSH_ERROR = "Error retrieving ssh access, please contact administrator"
 
+#: Result of `PodCollection.reserve_from_dump`
+ReservedPod = namedtuple('ReservedPod', ('pod', 'data', 'secrets'))
+
 
 def _check_license():
     if not licensing.is_valid():
@@ -254,6 +257,13 @@ class PodCollection(object):
                 pod_data['public_access_type'] = PublicAccessType.PUBLIC_IP
 
     def _add_pod(self, data, secrets, skip_check, reuse_pv):
+        pod, db_pod = self._reserve_pod(data, skip_check, reuse_pv)
+        return self._create_reserved_pod(pod, db_pod, data, secrets)
+
+    def _reserve_pod(self, data, skip_check, reuse_pv):
+        """Save pod with its persistent disks and public IP (or domain)
+        to db. Returns kapi-Pod and db-Pod.
+        """
         self._preprocess_volumes(data)
 
         data['namespace'] = data['id'] = str(uuid4())
@@ -283,7 +293,12 @@ class PodCollection(object):
                 if getattr(db_pod, 'domain', None):
                     pod.domain = db_pod.domain
             pod.forge_dockers()
+        return pod, db_pod
 
+    def _create_reserved_pod(self, pod, db_pod, data, secrets):
+        """Create namespace and secrets of the pod saved by `_reserve_pod`
+        in kubernetes.
+        """
         namespace = pod.namespace
 
         self._make_namespace(namespace)
@@ -317,12 +332,30 @@ class PodCollection(object):
         return self._add_pod(params, secrets, skip_check, reuse_pv)
 
     def add_from_dump(self, dump, skip_check=False):
+        return self.create_reserved(self.reserve_from_dump(dump, skip_check))
+
+    def reserve_from_dump(self, dump, skip_check=False):
+        """First part of `add_from_dump`: save the pod, its persistent
+        disks and domain in the current transaction, so several pods may be
+        reserved at once. Public IP is only marked as needed, it's assigned
+        when the pod is started (see `needs_public_ip`).
+
+        :return: `ReservedPod` to pass to `create_reserved` after commit.
+        """
         if not skip_check:
             _check_license()
 
         pod_data, secrets = self._preprocess_pod_dump(dump, skip_check)
+        pod, db_pod = self._reserve_pod(pod_data, skip_check, reuse_pv=True)
+        return ReservedPod(pod, pod_data, secrets)
 
-        return self._add_pod(pod_data, secrets, skip_check, reuse_pv=True)
+    def create_reserved(self, reserved):
+        """Second part of `add_from_dump`: create the pod reserved by
+        `reserve_from_dump` in kubernetes.
+        """
+        pod, pod_data, secrets = reserved
+        db_pod = DBPod.query.get(pod.id)
+        return self._create_reserved_pod(pod, db_pod, pod_data, secrets)
 
     def _save_k8s_secrets(self, secrets, namespace):
         """Save secrets to k8s.
@@ -485,6 +518,14 @@ class PodCollection(object):
             if port.get('isPublic', False)
         ]
 
+    @classmethod
+    def needs_public_ip(cls, config):
+        """Whether the pod with this config gets public IP when started."""
+        access_type = config.get('public_access_type',
+                                 PublicAccessType.PUBLIC_IP)
+        return (access_type == PublicAccessType.PUBLIC_IP and
+                cls.has_public_ports(config))
+
     @staticmethod
     @utils.atomic()
     def _prepare_for_public_address(pod, config):
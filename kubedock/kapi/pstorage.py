@@ -37,7 +37,8 @@ from ..core import db, ExclusiveLock, ConnectionPool
 from ..exceptions import (
     APIError, PVResizeIsNotSupportedError, PVResizeFailed, PDNotFound)
 from ..nodes.models import Node, NodeFlagNames
-from ..pods.models import PersistentDisk, PersistentDiskStatuses, Pod as DBPod
+from ..pods.models import (PersistentDisk, PersistentDiskStatuses, PodVolume,
+                           Pod as DBPod)
 from ..users.models import User
 from ..usage.models import PersistentDiskState
 from ..utils import send_event_to_role, atomic, nested_dict_utils, \
@@ -319,29 +320,30 @@ class PersistentStorage(object):
         return self._cached_drives
 
     def _get_drives_from_db(self, user_id=None):
-        query = PersistentDisk.get_all_query()
+        query = PersistentDisk.get_all_query().join(
+            User, User.id == PersistentDisk.owner_id
+        ).outerjoin(
+            DBPod, DBPod.id == PersistentDisk.pod_id
+        ).add_columns(User.username, DBPod.name)
         if user_id is not None:
             query = query.filter(PersistentDisk.owner_id == user_id)
-            users = {user_id: User.get(user_id)}
-        else:
-            users = {item.id: item for item in db.session.query(User)}
         query = query.order_by(PersistentDisk.name)
         res = [
             {
                 'name': item.name,
                 'drive_name': item.drive_name,
-                'owner': users[item.owner_id].username,
+                'owner': owner,
                 'owner_id': item.owner_id,
                 'size': item.size,
                 'id': item.id,
                 'pod_id': item.pod_id,
-                'pod_name': None if item.pod_id is None else item.pod.name,
+                'pod_name': pod_name,
                 'in_use': item.pod_id is not None,
                 'available': True,
                 'node_id': None,
                 'forbidDeletion': item.pod_id is not None,
             }
-            for item in query
+            for item, owner, pod_name in query
         ]
         res = self._add_pod_info_to_drive_list(res, user_id)
         return res
@@ -358,33 +360,20 @@ class PersistentStorage(object):
             'linkedPods' field
 
         """
-        drives_by_name = {
-            (item['owner_id'], item['name']): item for item in drive_list
-        }
-        query = DBPod.query
+        query = db.session.query(
+            DBPod.owner_id, PodVolume.pd_name, DBPod.id, DBPod.name
+        ).select_from(PodVolume).join(PodVolume.pod).filter(
+            db.or_(DBPod.status.is_(None), DBPod.status != 'deleted'))
         if user_id:
             query = query.filter(DBPod.owner_id == user_id)
-        for pod in query:
-            if pod.is_deleted:
-                continue
-            try:
-                config = pod.get_dbconfig()
-            except (TypeError, ValueError):
-                current_app.logger.exception('Invalid pod (%s) config: %s',
-                                             pod.id, pod.config)
-                continue
-            for item in config.get('volumes_public', []):
-                name = item.get('persistentDisk', {}).get('pdName', '')
-                key = (pod.owner_id, name)
-                if key not in drives_by_name:
-                    continue
-                pod_list = drives_by_name[key].get('linkedPods', [])
-                pod_list.append({'podId': pod.id, 'name': pod.name})
-                drives_by_name[key]['linkedPods'] = pod_list
+        linked_pods = defaultdict(list)
+        for owner_id, pd_name, pod_id, pod_name in query:
+            linked_pods[(owner_id, pd_name)].append(
+                {'podId': pod_id, 'name': pod_name})
 
         for drive in drive_list:
-            if 'linkedPods' not in drive:
-                drive['linkedPods'] = []
+            drive['linkedPods'] = linked_pods.get(
+                (drive['owner_id'], drive['name']), [])
         return drive_list
 
     def get_node_ip(self):
@@ -1121,9 +1110,12 @@ class CephStorage(PersistentStorage):
         """
         if not self._is_mapped(pd.drive_name):
             try:
-                self.run_on_first_node('rbd {0} rm {1}'.format(
-                    get_ceph_credentials(), pd.drive_name
-                ))
+                # images with snapshots (e.g. left by incremental backups)
+                # can't be removed
+                self.run_on_first_node(
+                    'rbd {0} snap purge {1} && rbd {0} rm {1}'.format(
+                        get_ceph_credentials(), pd.drive_name
+                    ))
                 return 0
             except NodeCommandError:
                 return 1
@@ -1526,11 +1518,14 @@ class LocalStorage(PersistentStorage):
 
     def _get_drives_from_db(self, user_id=None):
         res = super(LocalStorage, self)._get_drives_from_db(user_id)
+        if not res:
+            return res
         alive_nodes = _get_alive_nodes()
+        node_ids = dict(db.session.query(
+            PersistentDisk.id, PersistentDisk.node_id
+        ).filter(PersistentDisk.id.in_([item['id'] for item in res])))
         for item in res:
-            pd_node_id = db.session.query(PersistentDisk.node_id).filter(
-                PersistentDisk.id == item['id']
-            ).first().node_id
+            pd_node_id = node_ids.get(item['id'])
             item['available'] = pd_node_id in alive_nodes
             item['node_id'] = pd_node_id
         return res
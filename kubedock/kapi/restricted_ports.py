@@ -35,10 +35,15 @@ from ..settings import ETCD_RESTRICTED_PORT_KEY_PATH, ETCD_HOST, ETCD_PORT
 ETCD_ERROR_MESSAGE = "Can't update restricted port policy in etcd"
 
 
-def _get_restricted_ports_rules():
+def _get_restricted_ports_rules(ports=None):
+    """Makes policy rules from (port, protocol) pairs. All ports stored in
+    database are used if `ports` is omitted.
+    """
+    if ports is None:
+        ports = [(port.port, port.protocol) for port in RestrictedPort.query]
     restricted_ports = {}
-    for port in RestrictedPort.query:
-        restricted_ports.setdefault(port.protocol, []).append(port.port)
+    for port, protocol in ports:
+        restricted_ports.setdefault(protocol, []).append(port)
 
     restricted_ports_rules = []
     for proto, ports in restricted_ports.items():
@@ -52,24 +57,38 @@ def get_ports():
     return [restricted_port.dict() for restricted_port in RestrictedPort.query]
 
 
-def _set_restricted_ports_etcd():
-    restricted_ports_rules = _get_restricted_ports_rules()
-
-    restricted_ports_policy = json.dumps(
-        get_pod_restricted_ports_policy(restricted_ports_rules)
-    )
-
+def _update_restricted_ports_etcd(
+        rules=None, error=RestrictedPortsException.ClosePortError):
+    """Writes policy with the given rules (all ports from database by
+    default) to etcd or removes the policy if there are no rules.
+    Raises `error` if etcd is unavailable.
+    """
+    if rules is None:
+        rules = _get_restricted_ports_rules()
     client = etcd.Client(host=ETCD_HOST, port=ETCD_PORT)
-    try:
-        result = client.read(ETCD_RESTRICTED_PORT_KEY_PATH)
-        result.value = restricted_ports_policy
-        client.update(result)
-    except etcd.EtcdKeyNotFound:
-        client.write(ETCD_RESTRICTED_PORT_KEY_PATH, restricted_ports_policy)
-    except etcd.EtcdException:
-        raise RestrictedPortsException.ClosePortError(
-            details={'message': ETCD_ERROR_MESSAGE}
-        )
+
+    if rules:
+        restricted_ports_policy = json.dumps(
+            get_pod_restricted_ports_policy(rules))
+        try:
+            try:
+                result = client.read(ETCD_RESTRICTED_PORT_KEY_PATH)
+                result.value = restricted_ports_policy
+                client.update(result)
+            except etcd.EtcdKeyNotFound:
+                client.write(ETCD_RESTRICTED_PORT_KEY_PATH,
+                             restricted_ports_policy)
+        except etcd.EtcdException:
+            raise error(details={'message': ETCD_ERROR_MESSAGE})
+    else:
+        try:
+            client.delete(ETCD_RESTRICTED_PORT_KEY_PATH)
+        except etcd.EtcdKeyNotFound:
+            pass
+        except etcd.EtcdException:
+            raise error(details={
+                'message': "Can't remove restricted ports policy from etcd"
+            })
 
 
 def set_port(port, protocol):
@@ -91,7 +110,7 @@ def set_port(port, protocol):
             details={'message': 'Error adding Restricted Port to database'}
         )
 
-    _set_restricted_ports_etcd()
+    _update_restricted_ports_etcd()
 
 
 def del_port(port, protocol):
@@ -113,29 +132,58 @@ def del_port(port, protocol):
             details={'message': 'Error deleting Restricted Port from database'}
         )
 
-    restricted_ports_rules = _get_restricted_ports_rules()
-
-    client = etcd.Client(host=ETCD_HOST, port=ETCD_PORT)
+    _update_restricted_ports_etcd(error=RestrictedPortsException.OpenPortError)
+
+
+def _normalize_ports(ports):
+    return {(port, protocol.lower()) for port, protocol in ports}
+
+
+def update_ports(set_ports=(), del_ports=()):
+    """Applies a set of port changes at once. `set_ports` and `del_ports` are
+    iterables of (port, protocol) pairs. Ports that are already in the
+    requested state are skipped. Database is changed in one transaction and
+    the policy is recomputed and written to etcd only once, or not at all if
+    nothing has changed.
+    :return: dict with lists of actually closed and opened ports
+    """
+    to_set, to_del = _normalize_ports(set_ports), _normalize_ports(del_ports)
+    conflicts = to_set & to_del
+    if conflicts:
+        raise RestrictedPortsException.ClosePortError(details={
+            'message': 'Same port is both in set and delete lists: {0}'.format(
+                ', '.join('{0}/{1}'.format(*p) for p in sorted(conflicts)))
+        })
+
+    existing = {(port.port, port.protocol): port
+                for port in RestrictedPort.query}
+    to_set.difference_update(existing)
+    to_del.intersection_update(existing)
+    result = {
+        'closed': [{'port': port, 'protocol': protocol}
+                   for port, protocol in sorted(to_set)],
+        'opened': [{'port': port, 'protocol': protocol}
+                   for port, protocol in sorted(to_del)],
+    }
+    if not to_set and not to_del:
+        return result
+
+    for port, protocol in to_set:
+        db.session.add(RestrictedPort(port=port, protocol=protocol))
+    for key in to_del:
+        db.session.delete(existing[key])
+
+    error = (RestrictedPortsException.ClosePortError if to_set else
+             RestrictedPortsException.OpenPortError)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise error(
+            details={'message': 'Error updating Restricted Ports in database'}
+        )
 
-    if restricted_ports_rules:
-        restricted_ports_policy = get_pod_restricted_ports_policy(
-            restricted_ports_rules)
-        try:
-            result = client.read(ETCD_RESTRICTED_PORT_KEY_PATH)
-            result.value = json.dumps(restricted_ports_policy)
-            client.update(result)
-        except etcd.EtcdException:
-            raise RestrictedPortsException.OpenPortError(
-                details={'message': ETCD_ERROR_MESSAGE}
-            )
-    else:
-        try:
-            client.delete(ETCD_RESTRICTED_PORT_KEY_PATH)
-        except etcd.EtcdKeyNotFound:
-            pass
-        except etcd.EtcdException:
-            raise RestrictedPortsException.OpenPortError(
-                details={
-                    'message': "Can't remove restricted ports policy from etcd"
-                }
-            )
+    ports = set(existing).difference(to_del).union(to_set)
+    _update_restricted_ports_etcd(_get_restricted_ports_rules(sorted(ports)),
+                                  error)
+    return result
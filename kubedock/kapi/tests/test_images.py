@@ -35,7 +35,7 @@ from .. import images
 from ..images import (Image, complement_registry, get_url, APIError,
                       raise_registry_error, RegistryError,
                       ImageNotAvailable, CommandIsMissing)
-from ...settings import DEFAULT_REGISTRY
+from ...settings import DEFAULT_REGISTRY, DOCKER_IMG_CACHE_TIMEOUT
 from ...testutils.testcases import DBTestCase
 
 TESTUNAME = 'wncm'
@@ -74,6 +74,10 @@ NGINX_IMAGE_INFO = {
 
 
 class TestImagesCache(DBTestCase):
+    def setUp(self):
+        images.clear_config_cache()
+        self.addCleanup(images.clear_config_cache)
+
     @mock.patch.object(Image, '_request_image_info', autospec=True)
     def test_get_container_config_cache(self, request_config_mock):
         """Test for kapi.images.Image.get_container_config function."""
@@ -83,15 +87,73 @@ class TestImagesCache(DBTestCase):
         expected = Image('nginx')._prepare_response(NGINX_IMAGE_INFO)
         self.assertEqual(result, expected)
 
+        # in-process cache
+        request_config_mock.reset_mock()
+        self.assertEqual(Image('nginx').get_container_config(), expected)
+        self.assertFalse(request_config_mock.called)
+
+        # DB cache
+        images.clear_config_cache()
+        self.assertEqual(Image('nginx').get_container_config(), expected)
+        self.assertFalse(request_config_mock.called)
+
         # check and clear cache
         cache = images.DockerfileCache.query.all()
         self.assertEqual(len(cache), 1)
         images.DockerfileCache.query.delete()
+        images.clear_config_cache()
 
         request_config_mock.return_value = None
         with self.assertRaises(APIError):
             Image('nginx').get_container_config()
 
+    @mock.patch.object(images, 'refresh_container_config')
+    @mock.patch.object(Image, '_request_image_info', autospec=True)
+    def test_outdated_cache(self, request_config_mock, refresh_mock):
+        """Outdated anonymous config must be returned and refreshed in
+        background. Credentials are never sent to the background task.
+        """
+        request_config_mock.return_value = NGINX_IMAGE_INFO
+        expected = Image('nginx')._prepare_response(NGINX_IMAGE_INFO, None)
+        self.assertEqual(Image('nginx').get_container_config(), expected)
+
+        cached = images.DockerfileCache.query.one()
+        self.assertEqual(cached.auth_hash, '')
+        cached.time_stamp -= DOCKER_IMG_CACHE_TIMEOUT * 2
+        self.db.session.commit()
+        images.clear_config_cache()
+
+        request_config_mock.reset_mock()
+        with mock.patch.object(images, 'ExclusiveLock') as lock_mock:
+            result = Image('nginx').get_container_config()
+        self.assertEqual(result, expected)
+        self.assertFalse(request_config_mock.called)
+        self.assertTrue(lock_mock.return_value.lock.called)
+        refresh_mock.delay.assert_called_once_with('nginx')
+
+    @mock.patch.object(images, 'refresh_container_config')
+    @mock.patch.object(Image, '_request_image_info', autospec=True)
+    def test_outdated_cache_with_auth(self, request_config_mock,
+                                      refresh_mock):
+        """Outdated config of authenticated request is fetched again."""
+        request_config_mock.return_value = NGINX_IMAGE_INFO
+        auth = ('user', 'password')
+        expected = Image('nginx')._prepare_response(NGINX_IMAGE_INFO, auth)
+        self.assertEqual(Image('nginx').get_container_config(auth), expected)
+
+        cached = images.DockerfileCache.query.one()
+        self.assertNotEqual(cached.auth_hash, '')
+        self.assertNotIn('password', cached.data['secret'])
+        cached.time_stamp -= DOCKER_IMG_CACHE_TIMEOUT * 2
+        self.db.session.commit()
+        images.clear_config_cache()
+
+        request_config_mock.reset_mock()
+        self.assertEqual(Image('nginx').get_container_config(auth), expected)
+        self.assertTrue(request_config_mock.called)
+        self.assertFalse(refresh_mock.delay.called)
+        self.assertFalse(images.DockerfileCache.query.one().outdated)
+
 
 class TestImagesAuth(DBTestCase):
     @responses.activate
@@ -164,6 +226,7 @@ class TestImagesAuth(DBTestCase):
     @responses.activate
     def test_v2request_config(self):
         """Test for kapi.images.Image._v2_request_image_info function."""
+        images.clear_token_cache()
         image_url = 'nginx'  # [registry/]repo[:tag]
         registry, _, repo, tag = Image(image_url)
         auth = ('user', 'password')
@@ -270,6 +333,8 @@ class TestImages(unittest.TestCase):
         self.addCleanup(patcher.stop)
         DockerfileCacheMock = patcher.start()
         DockerfileCacheMock.query.get.return_value = None
+        images.clear_config_cache()
+        self.addCleanup(images.clear_config_cache)
 
     @mock.patch.object(Image, '_v1_request_image_info', autospec=True)
     @mock.patch.object(Image, '_v2_request_image_info', autospec=True)
@@ -433,6 +498,20 @@ class TestImages(unittest.TestCase):
         v2_mock.assert_called_once_with(
             Image('alpine'), None, just_check=False, raise_=True)
 
+    @mock.patch.object(Image, '_check_availability', autospec=True)
+    def test_check_containers_dedupe(self, check_mock):
+        """Every image must be checked only once"""
+        check_mock.return_value = NGINX_CONFIG
+        container = {'image': 'nginx', 'name': 'n', 'command': 'c'}
+        Image.check_containers([
+            dict(container, name='n1'),
+            dict(container, name='n2', image='nginx:latest', command=[]),
+            dict(container, name='n3', image='redis'),
+        ])
+        self.assertEqual(check_mock.call_count, 2)
+        check_mock.assert_any_call(Image('nginx'), mock.ANY, fast=False)
+        check_mock.assert_any_call(Image('redis'), mock.ANY, fast=True)
+
     @mock.patch.object(Image, '_request_image_info', autospec=True)
     def test_get_id(self, request_image_info_mock):
         """Check kapi.images.Image.get_id function"""
@@ -484,6 +563,78 @@ class TestImages(unittest.TestCase):
         check_registry_status.assert_called_once_with(image.full_registry)
 
 
+@mock.patch.object(images, 'db', mock.MagicMock())
+@mock.patch.object(images, 'DockerfileCache')
+class TestContainerConfigCache(unittest.TestCase):
+    def setUp(self):
+        images.clear_config_cache()
+        self.addCleanup(images.clear_config_cache)
+
+    @mock.patch.object(images, 'check_registry_status', mock.Mock())
+    @mock.patch.object(Image, '_request_image_info', autospec=True)
+    def test_missing_image(self, request_config_mock, DockerfileCacheMock):
+        DockerfileCacheMock.query.get.return_value = None
+        request_config_mock.return_value = None
+        for _ in range(2):
+            with self.assertRaises(APIError):
+                Image('nginx').get_container_config()
+        request_config_mock.assert_called_once_with(Image('nginx'), None)
+
+    @mock.patch.object(Image, '_request_image_info', autospec=True)
+    def test_cache_key(self, request_config_mock, DockerfileCacheMock):
+        DockerfileCacheMock.query.get.return_value = None
+        request_config_mock.return_value = NGINX_IMAGE_INFO
+        image = Image('nginx')
+        image.get_container_config()
+        image.get_container_config(('user', 'password'))
+        image.get_container_config({'username': 'user',
+                                    'password': 'password'})
+        image.get_container_config(('user', 'password2'))
+        self.assertEqual(request_config_mock.call_count, 3)
+        DockerfileCacheMock.query.get.assert_any_call(('nginx', ''))
+
+
+class TestBearerTokenCache(unittest.TestCase):
+    def setUp(self):
+        images.clear_token_cache()
+        self.addCleanup(images.clear_token_cache)
+
+    @responses.activate
+    def test_token_is_reused(self):
+        registry, _, repo, tag = Image('nginx')
+        url = registry + '/v2/' + repo + '/manifests/' + tag
+        realm = 'https://auth.docker.io/token'
+        challenge = ('Bearer realm="{0}",service="registry.docker.io",'
+                     'scope="repository:{1}:pull"'.format(realm, repo))
+        manifest = json.dumps({'history': [
+            {'v1Compatibility': json.dumps(NGINX_IMAGE_INFO)}]})
+
+        def manifest_callback(request):
+            if request.headers.get('Authorization') != 'Bearer qwerty':
+                return (401, {'www-authenticate': challenge}, '')
+            return (200, {}, manifest)
+
+        responses.add_callback(responses.GET, url, callback=manifest_callback)
+        responses.add(responses.GET, realm,
+                      body=json.dumps({'token': 'qwerty', 'expires_in': 300}))
+
+        self.assertEqual(Image('nginx')._v2_request_image_info(None),
+                         NGINX_IMAGE_INFO)
+        self.assertEqual(len(responses.calls), 3)
+
+        # second request is sent with the token from cache
+        self.assertEqual(Image('nginx')._v2_request_image_info(None),
+                         NGINX_IMAGE_INFO)
+        self.assertEqual(len(responses.calls), 4)
+        self.assertEqual(responses.calls[3].request.url, url)
+
+        # expired token is not used
+        with mock.patch.object(images.time, 'time',
+                               return_value=images.time.time() + 300):
+            Image('nginx')._v2_request_image_info(None)
+        self.assertEqual(len(responses.calls), 7)
+
+
 class TestCheckRegistryStatus(unittest.TestCase):
     v2_is_supported = {'docker-distribution-api-version': 'registry/2.0'}
 
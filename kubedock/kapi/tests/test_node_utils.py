@@ -209,6 +209,49 @@ class TestNodeUtils(DBTestCase):
             }
         )
 
+    @mock.patch.object(node_utils, 'SystemSettings')
+    @mock.patch.object(node_utils, 'get_all_nodes')
+    @mock.patch.object(node_utils, 'node_cache')
+    def test_get_nodes_collection_from_cache(self, node_cache_mock,
+                                             get_all_nodes_mock,
+                                             system_settings_mock):
+        """Nodes listed by nodes listener are taken without k8s requests."""
+        node1, node2 = self.add_two_nodes()
+        node_cache_mock.get_all.return_value = {
+            node1.hostname: {
+                'metadata': {'name': node1.hostname},
+                'status': {
+                    'capacity': {'cpu': str(self.cpu * self.cpu_multiplier)},
+                    'conditions': [{'type': 'Ready', 'status': 'True'}]}
+            },
+        }
+        system_settings_mock.get_by_name = self.get_by_name
+        res = node_utils.get_nodes_collection()
+        self.assertFalse(get_all_nodes_mock.called)
+        self.assertEqual(res[0]['status'], NODE_STATUSES.running)
+        self.assertEqual(res[0]['resources'], {'cpu': str(float(self.cpu))})
+        self.assertEqual(res[1]['status'], NODE_STATUSES.troubles)
+
+        # stale cache is filled again from k8s
+        node_cache_mock.get_all.return_value = None
+        get_all_nodes_mock.return_value = []
+        node_utils.get_nodes_collection()
+        get_all_nodes_mock.assert_called_once_with()
+        node_cache_mock.fill.assert_called_once_with([])
+
+    @mock.patch.object(node_utils, 'SystemSettings')
+    @mock.patch.object(node_utils, '_get_k8s_node_by_host')
+    @mock.patch.object(node_utils, 'node_cache')
+    def test_get_one_node_from_cache(self, node_cache_mock, get_k8s_node_mock,
+                                     system_settings_mock):
+        node1, node2 = self.add_two_nodes()
+        system_settings_mock.get_by_name = self.get_by_name
+        node_cache_mock.get.return_value = (True, None)
+        node = node_utils.get_one_node(node1.id)
+        self.assertEqual(node['status'], NODE_STATUSES.troubles)
+        node_cache_mock.get.assert_called_once_with(node1.hostname)
+        self.assertFalse(get_k8s_node_mock.called)
+
     @responses.activate
     def test__get_k8s_node_by_host(self):
         """Test for kapi.node_utils._get_k8s_node_by_host function."""
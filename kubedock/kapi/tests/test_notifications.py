@@ -0,0 +1,71 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+import mock
+
+from .. import notifications
+from ...rbac.models import Role
+from ...testutils.testcases import DBTestCase
+
+
+@mock.patch.object(notifications, 'send_event_to_role')
+class TestNotifications(DBTestCase):
+    def setUp(self):
+        self.admin_role = Role.by_rolename('Admin')
+        self.user_role = Role.by_rolename('User')
+
+    def test_attach_detach(self, send_event_mock):
+        self.assertEqual(notifications.read_role_events(self.admin_role), [])
+
+        notifications.attach_admin('NO_LICENSE', 'target')
+        # second attach does nothing
+        notifications.attach_admin('NO_LICENSE', 'another target')
+        self.assertEqual(send_event_mock.call_count, 1)
+        events = notifications.read_role_events(self.admin_role)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['description'], 'License not found.')
+        self.assertEqual(events[0]['target'], 'target')
+        self.assertEqual(notifications.read_role_events(self.user_role), [])
+
+        notifications.detach_admin('NO_LICENSE')
+        send_event_mock.assert_called_with(
+            'advise:hide', mock.ANY, self.admin_role.id)
+        self.assertEqual(notifications.read_role_events(self.admin_role), [])
+
+    def test_cached(self, send_event_mock):
+        notifications.attach_admin('NO_LICENSE')
+        events = notifications.read_role_events(self.admin_role)
+        with mock.patch.object(notifications.db, 'session') as session_mock:
+            self.assertEqual(
+                notifications.read_role_events(self.admin_role), events)
+            self.assertFalse(session_mock.query.called)
+
+    def test_invalidate_one_role(self, send_event_mock):
+        notifications.read_role_events(self.admin_role)
+        notifications.read_role_events(self.user_role)
+        notifications.invalidate(self.admin_role.id)
+        with mock.patch.object(notifications.db, 'session') as session_mock:
+            notifications.read_role_events(self.user_role)
+            self.assertFalse(session_mock.query.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,10 +21,11 @@
 from collections import namedtuple
 import unittest
 import mock
+from sqlalchemy.exc import IntegrityError
 
 from kubedock.testutils.testcases import FlaskTestCase
 from kubedock.testutils import create_app
-from kubedock.exceptions import PodDomainExists
+from kubedock.exceptions import InternalAPIError, PodDomainExists
 
 from kubedock.kapi import pod_domains
 
@@ -52,11 +53,15 @@ class TestSetPodDomain(TestCase):
             self.sub_domain_name, self.base_domain_name
         )
 
+    @mock.patch.object(pod_domains, 'atomic')
+    @mock.patch.object(pod_domains, 'db')
+    @mock.patch.object(pod_domains, 'ExclusiveLockContextManager')
     @mock.patch.object(pod_domains, '_get_unique_domain_name')
     @mock.patch.object(pod_domains, 'PodDomain')
     @mock.patch.object(pod_domains, 'BaseDomain')
     def test_set_pod_name(self, base_domain_mock, pod_domain_mock,
-                          get_unique_domain_name_mock):
+                          get_unique_domain_name_mock, lock_mock, db_mock,
+                          atomic_mock):
         base_domain = Domain(1234, self.base_domain_name)
         base_domain_mock.query.filter_by.return_value.first.return_value = \
             base_domain
@@ -87,6 +92,10 @@ class TestSetPodDomain(TestCase):
             pod_id=self.pod.id
         )
         self.assertEqual((rv1, rv2), ((pod_domain, True), (pod_domain, True)))
+        lock_mock.assert_called_with(
+            'kapi.pod_domains.set_pod_domain.' + self.base_domain_name,
+            blocking=True, ttl=mock.ANY)
+        db_mock.session.add.assert_called_with(pod_domain)
 
         pod_domain_mock.reset_mock()
 
@@ -112,6 +121,16 @@ class TestSetPodDomain(TestCase):
             pod_id=self.pod.id
         )
 
+        # subdomain was taken concurrently
+        base_domain_mock.query.filter_by.return_value.first.side_effect = (
+            None, base_domain
+        )
+        db_mock.session.add.side_effect = IntegrityError(None, None, None)
+        with self.assertRaises(PodDomainExists):
+            pod_domains.get_or_create_pod_domain(self.pod,
+                                                 self.full_domain_name)
+        db_mock.session.add.side_effect = None
+
         # subdomain exists
         base_domain_mock.query.filter_by.return_value.first.side_effect = (
             None, base_domain
@@ -139,32 +158,69 @@ class TestSetPodDomain(TestCase):
             ((pod_domain, False), self.sub_domain_name)
         )
 
+    @mock.patch.object(pod_domains, 'atomic')
+    @mock.patch.object(pod_domains, 'db')
+    @mock.patch.object(pod_domains, 'ExclusiveLockContextManager')
+    @mock.patch.object(pod_domains, '_get_unique_domain_name')
+    @mock.patch.object(pod_domains, 'PodDomain')
+    @mock.patch.object(pod_domains, 'BaseDomain')
+    def test_retry_on_conflict(self, base_domain_mock, pod_domain_mock,
+                               get_unique_domain_name_mock, lock_mock,
+                               db_mock, atomic_mock):
+        """Autogenerated name taken by concurrent transaction is replaced
+        by another one."""
+        base_domain = Domain(1234, self.base_domain_name)
+        base_domain_mock.query.filter_by.return_value.first.return_value = \
+            base_domain
+        pod_domain_mock.query.filter_by.return_value.first.return_value = None
+        get_unique_domain_name_mock.side_effect = ['taken', 'free']
+        db_mock.session.add.side_effect = [
+            IntegrityError(None, None, None), None]
+
+        pod_domain, created = pod_domains.get_or_create_pod_domain(
+            self.pod, self.base_domain_name)
+
+        self.assertTrue(created)
+        pod_domain_mock.assert_called_with(
+            name='free', base_domain=base_domain, pod_id=self.pod.id)
+        self.assertEqual(pod_domain, pod_domain_mock.return_value)
+
+        # all attempts failed
+        get_unique_domain_name_mock.side_effect = None
+        db_mock.session.add.side_effect = IntegrityError(None, None, None)
+        with self.assertRaises(InternalAPIError):
+            pod_domains.get_or_create_pod_domain(
+                self.pod, self.base_domain_name)
+        self.assertEqual(db_mock.session.add.call_count,
+                         2 + pod_domains.POD_DOMAIN_INSERT_RETRIES)
+
     @mock.patch.object(pod_domains, 'randstr')
     @mock.patch.object(pod_domains, 'PodDomain')
     def test_get_unique_domain_name(self, pod_domain_mock, randstr_mock):
-        query_first_mock = mock.Mock()
-        pod_domain_mock.query.filter_by.return_value.first = query_first_mock
-        query_first_mock.return_value = None
+        query_mock = pod_domain_mock.query.with_entities.return_value.filter
+        query_mock.return_value = []
+        randstr_mock.side_effect = lambda **_: 'suffix{0}'.format(
+            randstr_mock.call_count)
         dname = 'qwerty1234'
         domain_id = 22
         res = pod_domains._get_unique_domain_name(dname, domain_id)
         self.assertEqual(res, dname)
-        pod_domain_mock.query.filter_by.assert_called_once_with(
-            name=dname, domain_id=domain_id)
-        pod_domain_mock.query.filter_by.reset_mock()
-
-        # if the first call returns som object, the to basename must be
-        # appended random suffix
-        query_first_mock.reset_mock()
-        query_first_mock.side_effect = ['something', 'somethingelse', None]
-        random_suffix = 'sfsfd'
-        randstr_mock.return_value = random_suffix
+        self.assertEqual(query_mock.call_count, 1)
+
+        # if basename is taken, the first free name with random suffix
+        # must be returned
+        query_mock.reset_mock()
+        randstr_mock.reset_mock()
+        query_mock.return_value = [(dname,), (dname + 'suffix1',)]
         res = pod_domains._get_unique_domain_name(dname, domain_id)
-        self.assertEqual(dname + random_suffix, res)
-        self.assertEqual(randstr_mock.call_count, 2)
-        self.assertEqual(pod_domain_mock.query.filter_by.call_count, 3)
-        pod_domain_mock.query.filter_by.assert_called_with(
-            name=dname + random_suffix, domain_id=domain_id)
+        self.assertEqual(res, dname + 'suffix2')
+        self.assertEqual(query_mock.call_count, 1)
+
+        # all candidates are taken
+        randstr_mock.side_effect = lambda **_: 'suffix'
+        query_mock.return_value = [(dname,), (dname + 'suffix',)]
+        self.assertIsNone(pod_domains._get_unique_domain_name(dname,
+                                                              domain_id))
 
 
 if __name__ == '__main__':
@@ -218,6 +218,57 @@ class TestHowTemplateIsPreprocessed(unittest.TestCase):
             pa._get_preprocessed_template()
 
 
+@mock.patch('kubedock.kapi.apps.PredefinedAppModel')
+class TestCompiledTemplatesCache(unittest.TestCase):
+
+    def setUp(self):
+        apps._compiled_templates.clear()
+        self.addCleanup(apps._compiled_templates.clear)
+
+    def test_template_is_compiled_once(self, dbo):
+        dbo.query.filter_by().first = mock.Mock(return_value=FakeObj())
+        PA = apps.PredefinedApp
+        with mock.patch.object(PA, '_compile_template',
+                               wraps=PA._compile_template) as compile_mock, \
+                mock.patch.object(PA, '_load_template',
+                                  wraps=PA._load_template) as load_mock:
+            first = apps.PredefinedApp.get(1)
+            first_loaded = first._get_loaded_template()
+            second = apps.PredefinedApp.get(1)
+            second_loaded = second._get_loaded_template()
+        self.assertEqual(compile_mock.call_count, 1)
+        self.assertEqual(load_mock.call_count, 1)
+        self.assertIs(first._get_preprocessed_template(),
+                      second._get_preprocessed_template())
+
+        # every instance has its own entities
+        self.assertEqual(set(first._entities), set(second._entities))
+        for name, entity in first._entities.iteritems():
+            self.assertIsNot(entity, second._entities[name])
+        self.assertIsNot(first_loaded, second_loaded)
+        self.assertNotEqual(first._entities['TESTAUTO1'].default,
+                            second._entities['TESTAUTO1'].default)
+
+        first_filled = first.get_filled_template_for_plan(0, {})
+        second_filled = second.get_filled_template_for_plan(0, {})
+        self.assertEqual(first_filled['appVariables']['APP_NAME'],
+                         second_filled['appVariables']['APP_NAME'])
+        self.assertNotEqual(first_filled['appVariables']['TESTAUTO1'],
+                            second_filled['appVariables']['TESTAUTO1'])
+
+    def test_changed_template_is_compiled_again(self, dbo):
+        tpl = """
+        a: $VAR|default:0|label$"""
+        dbo.query.filter_by().first = mock.Mock(return_value=FakeObj(tpl))
+        self.assertEqual(apps.PredefinedApp.get(1)._fill_template(),
+                         {'a': 0, 'appVariables': {'VAR': 0}})
+        tpl = """
+        a: $VAR|default:1|label$"""
+        dbo.query.filter_by().first = mock.Mock(return_value=FakeObj(tpl))
+        self.assertEqual(apps.PredefinedApp.get(1)._fill_template(),
+                         {'a': 1, 'appVariables': {'VAR': 1}})
+
+
 @mock.patch('kubedock.kapi.apps.PredefinedAppModel')
 class TestHowTemplateIsLoaded(unittest.TestCase):
 
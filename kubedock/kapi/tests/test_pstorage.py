@@ -443,6 +443,36 @@ class TestPersistentStorage(DBTestCase):
         self.assertEqual(True, pd1_data['forbidDeletion'])
         self.assertEqual(False, pd2_data['forbidDeletion'])
 
+    def test_linked_pods_follow_pod_config(self):
+        """Linked pods are updated on every change of pod config."""
+        user, _ = self.fixtures.user_fixtures()
+        db.session.add_all([
+            PersistentDisk(name='q', owner_id=user.id, size=1),
+            PersistentDisk(name='q1', owner_id=user.id, size=1),
+        ])
+        pod = self.fixtures.pod(owner=user)
+
+        def linked_pods():
+            drives = pstorage.PersistentStorage()._get_drives_from_db(
+                user_id=user.id)
+            return {item['name']: [p['podId'] for p in item['linkedPods']]
+                    for item in drives}
+
+        self.assertEqual(linked_pods(), {'q': [], 'q1': []})
+
+        config = pod.get_dbconfig()
+        config['volumes_public'] = [{'persistentDisk': {'pdName': 'q'}}]
+        pod.set_dbconfig(config)
+        self.assertEqual(linked_pods(), {'q': [pod.id], 'q1': []})
+
+        config['volumes_public'] = [{'persistentDisk': {'pdName': 'q1'}}]
+        pod.set_dbconfig(config)
+        self.assertEqual(linked_pods(), {'q': [], 'q1': [pod.id]})
+
+        pod.delete()
+        db.session.commit()
+        self.assertEqual(linked_pods(), {'q': [], 'q1': []})
+
 
 class TestLocalStorage(DBTestCase):
     """Tests for kapi.LocalStorage class."""
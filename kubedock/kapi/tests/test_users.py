@@ -20,8 +20,12 @@
 
 import unittest
 import mock
+from datetime import datetime, timedelta
+
 from ..users import UserCollection, User, APIError, POD_STATUSES
+from ...core import db
 from ...testutils.testcases import DBTestCase
+from ...users.models import UserActivity, UserSession
 
 
 @mock.patch.object(User, 'logout')
@@ -162,5 +166,136 @@ class TestSuspendHelpers(DBTestCase):
         ])
 
 
+class TestUserGet(DBTestCase):
+    @mock.patch('kubedock.kapi.users.get_users_last_activity')
+    @mock.patch('kubedock.users.models.get_user_last_activity')
+    def test_full_list(self, last_activity_mock, last_activities_mock):
+        """Full list of users is the same as full data of every user."""
+        user, _ = self.fixtures.user_fixtures()
+        admin, _ = self.fixtures.admin_fixtures()
+        self.fixtures.pod(owner=user)
+        self.fixtures.pod(owner=user, status='deleted')
+        UserActivity.log(UserActivity.LOGIN, user.id)
+        now = datetime.utcnow().replace(microsecond=0)
+        last_activity_mock.side_effect = {user.id: now}.get
+        last_activities_mock.return_value = {user.id: now}
+
+        def key(data):
+            return dict(data, package_info=dict(
+                data['package_info'],
+                kube_id=sorted(data['package_info']['kube_id']),
+                kube_info=sorted(data['package_info']['kube_info'])))
+
+        users = {u['id']: u for u in UserCollection().get(full=True)}
+        self.assertEqual(len(users), User.not_deleted.count())
+        for u in User.not_deleted:
+            self.assertEqual(key(users[u.id]),
+                             key(UserCollection().get(u, full=True)))
+        self.assertEqual(users[user.id]['pods_count'], 1)
+        self.assertEqual(users[user.id]['last_login'], user.last_login)
+        self.assertIsNotNone(user.last_login)
+        self.assertEqual(users[user.id]['last_activity'], now)
+        self.assertEqual(users[admin.id]['last_activity'], '')
+
+    @mock.patch('kubedock.kapi.users.get_users_last_activity')
+    @mock.patch('kubedock.users.models.get_user_last_activity')
+    def test_full_list_queries(self, last_activity_mock,
+                               last_activities_mock):
+        """Number of queries does not depend on the number of users."""
+        last_activity_mock.return_value = None
+        last_activities_mock.return_value = {}
+
+        def add_user():
+            user, _ = self.fixtures.user_fixtures()
+            self.fixtures.pod(owner=user)
+            UserActivity.log(UserActivity.LOGIN, user.id)
+
+        def count_statements():
+            UserCollection().get(full=True)  # warm up caches
+            statements = []
+
+            def log_statement(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            db.event.listen(db.engine, 'before_cursor_execute', log_statement)
+            try:
+                UserCollection().get(full=True)
+            finally:
+                db.event.remove(db.engine, 'before_cursor_execute',
+                                log_statement)
+            return len(statements)
+
+        add_user()
+        one_user = count_statements()
+        for _ in range(5):
+            add_user()
+        self.assertEqual(count_statements(), one_user)
+
+
+class TestUserActivity(DBTestCase):
+    def setUp(self):
+        self.user, _ = self.fixtures.user_fixtures()
+
+    def test_sessions(self):
+        """Logins and logouts are paired into sessions."""
+        UserActivity.log(UserActivity.LOGIN, self.user.id, '1.1.1.1')
+        # repeated login does not start new session
+        UserActivity.log(UserActivity.LOGIN, self.user.id, '2.2.2.2')
+        UserActivity.log(UserActivity.LOGOUT, self.user.id)
+        # logout without login is ignored
+        UserActivity.log(UserActivity.LOGOUT, self.user.id)
+        # not finished session is not in history
+        UserActivity.log(UserActivity.LOGIN, self.user.id, '3.3.3.3')
+
+        sessions = UserActivity.get_sessions(self.user.id)
+        self.assertEqual(len(sessions), 1)
+        login_ts, duration, logout_ts, ip, action = sessions[0]
+        self.assertEqual(ip, '1.1.1.1')
+        self.assertEqual(action, UserActivity.LOGOUT)
+        self.assertLessEqual(login_ts, logout_ts)
+        self.assertEqual(self.user.last_login,
+                         UserActivity.query.filter_by(
+                             user_id=self.user.id, remote_ip='3.3.3.3'
+                         ).one().ts)
+
+        today = datetime.utcnow().date()
+        self.assertEqual(UserActivity.get_sessions(
+            self.user.id, date_from=today, date_to=today), sessions)
+        self.assertEqual(UserActivity.get_sessions(
+            self.user.id, date_from=today.replace(year=today.year + 1)), [])
+
+    def test_stale_session(self):
+        """Login replaces opened session which logout was missed."""
+        UserActivity.log(UserActivity.LOGIN, self.user.id, '1.1.1.1')
+        UserSession.query.update({
+            UserSession.login_ts: datetime.utcnow() - timedelta(days=1)})
+        UserActivity.log(UserActivity.LOGIN, self.user.id, '2.2.2.2')
+        UserActivity.log(UserActivity.LOGOUT, self.user.id)
+
+        sessions = UserActivity.get_sessions(self.user.id)
+        self.assertEqual([s[3] for s in sessions], ['2.2.2.2'])
+        today = datetime.utcnow().date()
+        self.assertEqual(UserActivity.get_sessions(
+            self.user.id, date_from=today, date_to=today), sessions)
+        self.assertEqual(
+            UserSession.query.filter_by(user_id=self.user.id).count(), 1)
+
+    def test_purge(self):
+        UserActivity.log(UserActivity.LOGIN, self.user.id)
+        UserActivity.log(UserActivity.LOGOUT, self.user.id)
+        # not finished session
+        UserActivity.log(UserActivity.LOGIN_A, self.user.id)
+        UserActivity.purge(datetime.utcnow() - timedelta(days=1))
+        self.assertEqual(len(UserActivity.get_sessions(self.user.id)), 1)
+
+        UserActivity.purge(datetime.utcnow() + timedelta(days=1))
+        self.assertEqual(UserActivity.get_sessions(self.user.id), [])
+        self.assertEqual(
+            UserActivity.query.filter_by(user_id=self.user.id).count(), 0)
+        self.assertEqual(
+            UserSession.query.filter_by(user_id=self.user.id).count(), 0)
+        self.assertIsNotNone(self.user.last_login)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -24,11 +24,13 @@ import re
 from copy import deepcopy
 from flask import current_app
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from sqlalchemy.orm import joinedload
 
 from .licensing import is_valid as license_valid
 from .podcollection import PodCollection, POD_STATUSES
 from .apps import generate
 from .pstorage import delete_persistent_drives_task, PersistentStorage
+from ..billing.catalog import get_catalog
 from ..billing.models import Package
 from ..core import db
 from ..exceptions import APIError
@@ -36,8 +38,8 @@ from ..pods.models import Pod
 from ..rbac.models import Role
 from ..settings import KUBERDOCK_INTERNAL_USER
 from ..system_settings.models import SystemSettings
-from ..users.models import User, UserActivity
-from ..users.utils import enrich_tz_with_offset
+from ..users.models import User, UserActivity, period_filter
+from ..users.utils import enrich_tz_with_offset, get_users_last_activity
 from ..utils import atomic
 from ..validation import UserValidator
 from ..billing import has_billing
@@ -79,6 +81,23 @@ class UserIsNotSuspendable(APIError):
             details=dict(username=username, **kwargs))
 
 
+def _package_info(catalog, package):
+    """Same as `User.package_info`, but made of the billing catalog."""
+    if package is None:
+        return {}
+    kube_ids = sorted(package.prices)
+    return dict(
+        id=package.id,
+        name=package.name,
+        kube_id=kube_ids,
+        kube_info=[dict(catalog.get_kube(kube_id)._asdict())
+                   for kube_id in kube_ids],
+        first_deposit=package.first_deposit,
+        currency=package.currency,
+        period=package.period
+    )
+
+
 class UserCollection(object):
     def __init__(self, doer=None):
         self.doer = doer
@@ -93,14 +112,49 @@ class UserCollection(object):
         """
         users = User.query if with_deleted else User.not_deleted
         if user is None:
-            return [dict(u.to_dict(full=full),
-                         actions=self._get_applicability(u))
-                    for u in users.all()]
+            users = users.options(joinedload(User.role),
+                                  joinedload(User.package)).all()
+            if full:
+                return self._get_full_list(users)
+            return [dict(u.to_dict(), actions=self._get_applicability(u))
+                    for u in users]
 
         user = self._convert_user(user)
         return dict(user.to_dict(full=full),
                     actions=self._get_applicability(user))
 
+    def _get_full_list(self, users):
+        """Same as `User.to_dict(full=True)` for every user, but data of all
+        users is fetched at once, so the number of queries does not depend on
+        the number of users.
+        """
+        user_ids = [u.id for u in users]
+        pods = {}
+        if user_ids:
+            not_deleted = db.or_(Pod.status.is_(None),
+                                 Pod.status != 'deleted')
+            for pod in Pod.query.filter(Pod.owner_id.in_(user_ids),
+                                        not_deleted):
+                pods.setdefault(pod.owner_id, []).append(
+                    User.pod_to_dict(pod))
+        last_activities = get_users_last_activity(user_ids)
+        catalog = get_catalog()
+        packages = {}
+        result = []
+        for u in users:
+            if u.package_id not in packages:
+                packages[u.package_id] = _package_info(
+                    catalog, catalog.get_package(u.package_id))
+            data = u.to_dict()
+            data.update(u.full_fields(
+                pods=pods.get(u.id, []),
+                package_info=deepcopy(packages[u.package_id]),
+                last_activity=last_activities.get(u.id),
+                last_login=u.last_login))
+            data['actions'] = self._get_applicability(u)
+            result.append(data)
+        return result
+
     @atomic(APIError("Couldn't create user.", 500, 'UserCreateError'),
             nested=False)
     @enrich_tz_with_offset(['timezone'])
@@ -298,13 +352,9 @@ class UserCollection(object):
         :returns: queryset or list or JSON string
         """
         user = UserCollection._convert_user(user)
-        activities = UserActivity.query.filter(UserActivity.user_id == user.id)
-        if date_from:
-            activities = activities.filter(
-                UserActivity.ts >= '{0} 00:00:00'.format(date_from))
-        if date_to:
-            activities = activities.filter(
-                UserActivity.ts <= '{0} 23:59:59'.format(date_to))
+        activities = period_filter(
+            UserActivity.query.filter(UserActivity.user_id == user.id),
+            UserActivity.ts, UserActivity.ts, date_from, date_to)
 
         if to_dict:
             return [a.to_dict() for a in activities]
@@ -30,7 +30,7 @@ from websocket import (create_connection, WebSocketException,
 
 from flask import current_app
 from .core import ConnectionPool, ssh_connect, db
-from .billing.models import Kube
+from .billing.catalog import get_catalog
 from .nodes.models import Node
 from .pods.models import Pod, PersistentDisk
 from .users.models import User
@@ -45,7 +45,7 @@ from .kapi.podcollection import PodCollection, set_public_address
 from .kapi.lbpoll import LoadBalanceService
 from .kapi.pstorage import (
     get_storage_class_by_volume_info, LocalStorage, STORAGE_CLASS)
-from .kapi import helpers
+from .kapi import helpers, node_cache
 from . import tasks
 
 
@@ -152,12 +152,6 @@ def set_limit(host, pod_id, containers, app):
         current_app.logger.warning(
             "Can't connect to {}, {}".format(host, errors))
         return False
-    spaces = dict(
-        (i, (s, u)) for i, s, u in Kube.query.values(
-            Kube.id, Kube.disk_space, Kube.disk_space_units
-        )
-    )  # workaround
-
     pod = Pod.query.filter_by(id=pod_id).first()
 
     if pod is None:
@@ -165,15 +159,14 @@ def set_limit(host, pod_id, containers, app):
         return False
 
     config = json.loads(pod.config)
-    kube_type = pod.kube_id
-    # kube = Kube.query.get(kube_type) this query raises an exception
+    kube = get_catalog().get_kube(pod.kube_id)
+    space, unit = ((kube.disk_space, kube.disk_space_units) if kube
+                   else (0, 'GB'))
     limits = []
     for container in config['containers']:
         container_name = container['name']
         if container_name not in containers:
             continue
-        # disk_space = kube.disk_space * container['kubes']
-        space, unit = spaces.get(kube_type, (0, 'GB'))
         disk_space = space * container['kubes']
         disk_space_unit = unit[0].lower() if unit else ''
         if disk_space_unit not in ('', 'k', 'm', 'g', 't'):
@@ -219,6 +212,7 @@ def process_nodes_event(data, app):
     key_ = 'node_state_' + hostname
     pending_key = 'node_unknown_state:' + hostname
     with app.app_context():
+        node_cache.update(node, event_type)
         redis = ConnectionPool.get_connection()
         prev_state = redis.get(key_)
         curr_state = get_node_state(node)
@@ -675,6 +669,26 @@ def listen_fabric_etcd(url):
     return result
 
 
+def process_record(app, node, k8s_obj, event_time):
+    k8s_obj = filter_event(k8s_obj, app)
+    if k8s_obj is None:
+        return
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            process_pods_event(k8s_obj, app, event_time, live=True)
+            break
+        except Exception:
+            current_app.logger.warning(
+                "Error while process event {}".format(node),
+                exc_info=True)
+    else:
+        # max_attempts exceeded, we skip event
+        send_event_to_role(
+            'notify:error', {'message': LISTENER_PROBLEM_MSG}, 'Admin')
+        current_app.logger.error(
+            'skip event {}'.format(node), exc_info=True)
+
+
 def process_records(app, nodes):
     for node in nodes:
         # TODO: for now send all prelist event to process,
@@ -683,27 +697,18 @@ def process_records(app, nodes):
         # or filter old events by time.
         try:
             key = node['key']
-            for _ in range(MAX_ATTEMPTS):
-                _, ts = key.rsplit('/', 1)
-                obj = node['value']
-                k8s_obj = json.loads(obj, object_hook=k8s_json_object_hook)
-                k8s_obj = filter_event(k8s_obj, app)
-                event_time = datetime.fromtimestamp(float(ts))
-                if k8s_obj is not None:
-                    try:
-                        process_pods_event(k8s_obj, app, event_time, live=True)
-                        break
-                    except Exception:
-                        current_app.logger.warning(
-                            "Error while process event {}".format(node),
-                            exc_info=True)
-
+            _, ts = key.rsplit('/', 1)
+            k8s_obj = json.loads(node['value'],
+                                 object_hook=k8s_json_object_hook)
+            # k8s2etcd puts events in batches: list of [timestamp, event],
+            # a single event per key is left by its previous versions
+            if isinstance(k8s_obj, list):
+                events = k8s_obj
             else:
-                # max_attempts exceeded, we skip event
-                send_event_to_role(
-                    'notify:error', {'message': LISTENER_PROBLEM_MSG}, 'Admin')
-                current_app.logger.error(
-                    'skip event {}'.format(node), exc_info=True)
+                events = [(ts, k8s_obj)]
+            for event_ts, event in events:
+                process_record(app, node, event,
+                               datetime.fromtimestamp(float(event_ts)))
         except:
             current_app.logger.exception(
                 "Error while parse event {}".format(node))
@@ -0,0 +1,188 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Runs listeners of kubernetes and etcd events in exactly one process.
+
+Every supervisor process (see `listeners_mule.py`) tries to take the leader
+lease in Redis. The owner of the lease starts all listeners and renews the
+lease periodically; others wait until the lease expires. If the owner dies,
+its lease expires in `LEASE_TTL` seconds and one of the other supervisors
+takes over.
+"""
+
+import os
+import socket
+import time
+import uuid
+
+import gevent
+import redis
+from flask import current_app
+
+from .core import ConnectionPool
+
+#: Redis key of the leader lease
+LEASE_KEY = 'kd.listeners.leader'
+
+#: Lease lifetime (seconds). Failover happens within this time
+LEASE_TTL = 6
+
+#: How often (seconds) the leader renews its lease
+RENEW_INTERVAL = 2
+
+#: How often (seconds) other supervisors try to take the lease
+ACQUIRE_INTERVAL = 1
+
+#: Names of listeners (in `kubedock.listeners`) run by the leader
+LISTENERS = ('listen_pods', 'listen_services', 'listen_nodes',
+             'listen_events', 'listen_pod_states')
+
+
+class LeaderLease(object):
+    """Lease in Redis owned by one process at a time."""
+
+    _RENEW = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    _RELEASE = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, conn, key=LEASE_KEY, ttl=LEASE_TTL):
+        self.conn = conn
+        self.key = key
+        self.ttl = ttl
+        self.identity = '{0}:{1}:{2}'.format(socket.gethostname(),
+                                             os.getpid(), uuid.uuid4().hex)
+        #: Time until which the lease surely belongs to this process
+        self.expires_at = 0
+        self._renew = conn.register_script(self._RENEW)
+        self._release = conn.register_script(self._RELEASE)
+
+    def _prolong(self, started, owned):
+        self.expires_at = started + self.ttl if owned else 0
+        return owned
+
+    def acquire(self):
+        started = time.time()
+        owned = bool(self.conn.set(self.key, self.identity, nx=True,
+                                   px=int(self.ttl * 1000)))
+        return self._prolong(started, owned)
+
+    def renew(self):
+        started = time.time()
+        owned = bool(self._renew(keys=[self.key],
+                                 args=[self.identity, int(self.ttl * 1000)]))
+        return self._prolong(started, owned)
+
+    def release(self):
+        self.expires_at = 0
+        self._release(keys=[self.key], args=[self.identity])
+
+    def is_valid(self):
+        """Lease is owned for at least one more renew interval."""
+        return time.time() + RENEW_INTERVAL < self.expires_at
+
+
+class ListenerSupervisor(object):
+    """Starts listeners when the lease is taken, stops them when it is lost
+    and restarts listeners which died.
+    """
+
+    def __init__(self, app, listeners, lease):
+        self.app = app
+        self.listeners = listeners
+        self.lease = lease
+        self.greenlets = {}
+
+    @property
+    def is_leader(self):
+        return bool(self.greenlets)
+
+    def _start(self):
+        current_app.logger.info('Listeners leader: %s', self.lease.identity)
+        for name, listener in self.listeners.iteritems():
+            self.greenlets[name] = gevent.spawn(listener, self.app)
+
+    def _stop(self):
+        current_app.logger.warning('Listeners leadership is lost: %s',
+                                   self.lease.identity)
+        gevent.killall(self.greenlets.values())
+        self.greenlets.clear()
+
+    def _restart_dead(self):
+        for name, greenlet in self.greenlets.items():
+            if greenlet.dead:
+                current_app.logger.error('Listener %s has died (%r), '
+                                         'restarting', name,
+                                         greenlet.exception)
+                self.greenlets[name] = gevent.spawn(self.listeners[name],
+                                                    self.app)
+
+    def step(self):
+        """One round of leader election. Returns seconds to sleep."""
+        try:
+            if self.is_leader:
+                leader = self.lease.renew()
+            else:
+                leader = self.lease.acquire()
+        except redis.RedisError:
+            current_app.logger.warning('Failed to update listeners lease',
+                                       exc_info=True)
+            # nobody else can take the lease until it expires
+            leader = self.is_leader and self.lease.is_valid()
+
+        if leader and not self.is_leader:
+            self._start()
+        elif not leader and self.is_leader:
+            self._stop()
+        elif leader:
+            self._restart_dead()
+        return RENEW_INTERVAL if leader else ACQUIRE_INTERVAL
+
+    def run(self):
+        try:
+            while True:
+                gevent.sleep(self.step())
+        finally:
+            if self.is_leader:
+                self._stop()
+                # let another supervisor take over without waiting for expiry
+                try:
+                    self.lease.release()
+                except redis.RedisError:
+                    pass
+
+
+def run(app):
+    """Supervise all listeners forever."""
+    from . import listeners
+    with app.app_context():
+        lease = LeaderLease(ConnectionPool.get_connection())
+        supervisor = ListenerSupervisor(
+            app, {name: getattr(listeners, name) for name in LISTENERS},
+            lease)
+        supervisor.run()
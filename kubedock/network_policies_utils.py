@@ -92,11 +92,11 @@ def create_network_policies():
 
     # allowed ports policy
     if AllowedPort.query.first():
-        allowed_ports._set_allowed_ports_etcd()
+        allowed_ports._update_allowed_ports_etcd()
 
     # restricted ports policy
     if RestrictedPort.query.first():
-        restricted_ports._set_restricted_ports_etcd()
+        restricted_ports._update_restricted_ports_etcd()
 
     # service pods policies
     owner = User.get_internal()
@@ -30,6 +30,10 @@ class RoleForNotification(db.Model):
     time_stamp = db.Column(db.DateTime)
     role = db.relationship('Role')
 
+    __table_args__ = (
+        db.Index('ix_notification_roles_rid_nid', 'rid', 'nid'),
+    )
+
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
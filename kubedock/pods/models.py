@@ -31,6 +31,7 @@ import ipaddress
 from datetime import datetime
 from flask import current_app
 from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import object_session
 
 from ..core import db
 from ..exceptions import NoFreeIPs, PodExists
@@ -242,6 +243,10 @@ class DockerfileCache(db.Model):
     __tablename__ = 'dockerfile_cache'
 
     image = db.Column(db.String(255), primary_key=True, nullable=False)
+    # HMAC-SHA256 (keyed with SECRET_KEY) of credentials used to get config,
+    # empty string for anonymous
+    auth_hash = db.Column(db.String(64), primary_key=True, nullable=False,
+                          default='', server_default='')
     data = db.Column(postgresql.JSON, nullable=False)
     time_stamp = db.Column(db.DateTime, nullable=False)
 
@@ -493,6 +498,17 @@ class IPPool(BaseModelMixin, db.Model):
                 return True
         return False
 
+    @classmethod
+    def has_free_hosts(cls, count):
+        """Check that there are at least `count` free hosts in all networks.
+        """
+        for n in cls.all():
+            for page in n.iterpages():
+                count -= len(n.free_hosts(as_int=True, page=page))
+                if count <= 0:
+                    return True
+        return count <= 0
+
     @classmethod
     def get_free_host(cls, as_int=None, node=None, ip=None):
         """Return free host if available.
@@ -761,6 +777,55 @@ class PersistentDisk(BaseModelMixin, db.Model):
         return cls.query.filter(cls.node_id == node_id)
 
 
+class PodVolume(db.Model):
+    """Link between a pod and names of persistent disks mentioned in its
+    config ("volumes_public" section). Disks are matched by name within
+    pod's owner, because pod config may refer to a disk which is not created
+    yet. The table is maintained automatically on every change of
+    `Pod.config`.
+    """
+    __tablename__ = 'pod_volumes'
+    __table_args__ = (db.UniqueConstraint('pod_id', 'pd_name'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    pod_id = db.Column(postgresql.UUID,
+                       db.ForeignKey('pods.id', ondelete='CASCADE'),
+                       nullable=False)
+    pd_name = db.Column(db.String(64), nullable=False, index=True)
+    pod = db.relationship(Pod, backref=db.backref(
+        'volume_links', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return "<PodVolume(pod_id='{0}', pd_name='{1}')>".format(
+            self.pod_id, self.pd_name)
+
+    @staticmethod
+    def names_from_config(config):
+        """Returns set of persistent disk names used in pod config."""
+        return {item['persistentDisk']['pdName']
+                for item in config.get('volumes_public') or []
+                if (item.get('persistentDisk') or {}).get('pdName')}
+
+
+@db.event.listens_for(Pod.config, 'set')
+def _sync_pod_volumes(pod, value, oldvalue, initiator):
+    if value == oldvalue:
+        return
+    try:
+        names = PodVolume.names_from_config(json.loads(value or '{}'))
+    except (TypeError, ValueError, AttributeError):
+        names = set()
+    session = object_session(pod)
+    if session is not None:
+        with session.no_autoflush:
+            links = {link.pd_name: link for link in pod.volume_links}
+    else:
+        links = {link.pd_name: link for link in pod.volume_links}
+    if set(links) != names:
+        pod.volume_links = [links.get(name) or PodVolume(pd_name=name)
+                            for name in sorted(names)]
+
+
 class PrivateRegistryFailedLogin(BaseModelMixin, db.Model):
     """Stores time for last failed login attempts to private registries.
     It's a simple workaround to prevent blocking from a registry. It may occur
@@ -141,6 +141,11 @@ TEST = False
 # This hook is only for development and debug purposes
 # When it set to true Kuberdock will execute hook on each restart
 PRE_START_HOOK_ENABLED = False
+# Number of nodes updated by the hook simultaneously
+PRE_START_HOOK_CONCURRENCY = 20
+
+# Default number of pods created in kubernetes simultaneously by bulk restore
+POD_RESTORE_CONCURRENCY = 5
 
 # more: http://docs.sqlalchemy.org/en/latest/dialects/#included-dialects
 DB_ENGINE = 'postgresql+psycopg2'
@@ -249,6 +254,10 @@ CELERYBEAT_SCHEDULE = {
         'task': 'kubedock.kapi.podcollection.pod_set_unpaid_state_task',
         'schedule': timedelta(minutes=5)
     },
+    'purge-user-activity': {
+        'task': 'kubedock.tasks.purge_user_activity',
+        'schedule': crontab(minute=30, hour=3)
+    },
 }
 CELERY_IMPORTS = ('kubedock.kapi.podcollection', 'kubedock.kapi.ingress')
 # Do not store results too long. Default is 1 day.
@@ -256,6 +265,10 @@ CELERY_TASK_RESULT_EXPIRES = 60 * 60
 
 ONLINE_LAST_MINUTES = 5
 
+# Login/logout history (and sessions made of it) older than this number of
+# days is deleted once a day. 0 means keep history forever.
+USER_ACTIVITY_RETENTION_DAYS = 365
+
 NODE_INSTALL_TASK_ID = 'add-new-node-with-hostname-{0}-and-id-{1}'
 NODE_INSTALL_LOG_FILE = '/var/log/kuberdock/node-install-log-{0}.log'
 UPDATE_LOG_FILE = '/var/log/kuberdock/update.log'
@@ -400,6 +413,9 @@ if cp.read(KUBERDOCK_SETTINGS_FILE) and cp.has_section('main'):
             'main', 'AWS_DEFAULT_EBS_VOLUME_IOPS')
     if cp.has_option('main', 'CALICO_NETWORK'):
         CALICO_NETWORK = cp.get('main', 'CALICO_NETWORK')
+    if cp.has_option('main', 'USER_ACTIVITY_RETENTION_DAYS'):
+        USER_ACTIVITY_RETENTION_DAYS = cp.getint(
+            'main', 'USER_ACTIVITY_RETENTION_DAYS')
 
 # Import local settings
 try:
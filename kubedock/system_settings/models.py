@@ -19,9 +19,13 @@
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
 import json
-from ..core import db
+
+from ..core import db, VersionedSnapshot
 from ..exceptions import APIError
 
+#: Redis key of the settings version counter
+SETTINGS_VERSION_KEY = 'kd.system_settings.version'
+
 
 class SystemSettings(db.Model):
     """
@@ -60,10 +64,7 @@ class SystemSettings(db.Model):
 
     @classmethod
     def get_by_name(cls, name):
-        entry = cls.query.filter_by(name=name).first()
-        if entry is None:
-            return ''
-        return entry.value
+        return _snapshot.get().get(name, '')
 
     @classmethod
     def set(cls, id, value):
@@ -81,3 +82,17 @@ class SystemSettings(db.Model):
         entry.value = value
         if commit:
             db.session.commit()
+
+
+def _load_snapshot():
+    return dict(db.session.query(SystemSettings.name, SystemSettings.value))
+
+
+# Process-wide snapshot of settings (name -> value), see `VersionedSnapshot`.
+_snapshot = VersionedSnapshot(SETTINGS_VERSION_KEY, _load_snapshot,
+                              (SystemSettings,))
+
+
+def clear():
+    """Drops snapshot of the current process."""
+    _snapshot.clear()
@@ -0,0 +1,82 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+import mock
+
+from kubedock.core import db
+from kubedock.system_settings import models
+from kubedock.system_settings.models import SystemSettings
+from kubedock.testutils.testcases import DBTestCase
+
+
+@mock.patch.object(models._snapshot, '_get_version',
+                   mock.Mock(return_value='1'))
+class TestSettingsSnapshot(DBTestCase):
+    def test_no_queries(self):
+        SystemSettings.get_by_name('billing_type')  # warm up
+        statements = []
+
+        def log_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute', log_statement)
+        try:
+            SystemSettings.get_by_name('billing_type')
+            SystemSettings.get_by_name('max_kubes_per_container')
+            SystemSettings.get_by_name('no such setting')
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', log_statement)
+        self.assertEqual(statements, [])
+
+    @mock.patch.object(models._snapshot, '_bump_version')
+    def test_invalidated_on_change(self, bump_mock):
+        SystemSettings.set_by_name('max_kubes_per_container', '3')
+        self.assertEqual(
+            SystemSettings.get_by_name('max_kubes_per_container'), '3')
+        self.assertTrue(bump_mock.called)
+
+        bump_mock.reset_mock()
+        SystemSettings.set_by_name('max_kubes_per_container', '5',
+                                   commit=False)
+        # changes of the current transaction are visible at once
+        self.assertEqual(
+            SystemSettings.get_by_name('max_kubes_per_container'), '5')
+        self.assertFalse(bump_mock.called)
+        db.session.commit()
+        self.assertTrue(bump_mock.called)
+
+    def test_reloaded_if_version_changed(self):
+        SystemSettings.get_by_name('billing_type')
+        # change made by another process
+        db.session.execute("UPDATE system_settings SET value = 'changed' "
+                           "WHERE name = 'billing_type'")
+        db.session.commit()
+        self.assertNotEqual(SystemSettings.get_by_name('billing_type'),
+                            'changed')
+        with mock.patch.object(models._snapshot, '_get_version',
+                               return_value='2'), \
+                mock.patch.object(models._snapshot, '_checked_at', 0):
+            self.assertEqual(SystemSettings.get_by_name('billing_type'),
+                             'changed')
+
+
+if __name__ == '__main__':
+    unittest.main()
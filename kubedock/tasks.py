@@ -53,9 +53,10 @@ from .settings import (
     NODE_CEPH_AWARE_KUBERDOCK_LABEL, CEPH, CEPH_KEYRING_PATH,
     CEPH_POOL_NAME, CEPH_CLIENT_USER,
     KUBERDOCK_INTERNAL_USER, NODE_SSH_COMMAND_SHORT_EXEC_TIMEOUT,
-    CALICO, NODE_STORAGE_MANAGE_DIR, ZFS, NODE_TOBIND_EXTERNAL_IPS)
+    CALICO, NODE_STORAGE_MANAGE_DIR, ZFS, NODE_TOBIND_EXTERNAL_IPS,
+    USER_ACTIVITY_RETENTION_DAYS)
 from .system_settings.models import SystemSettings
-from .users.models import SessionData
+from .users.models import SessionData, UserActivity
 from .utils import (
     update_dict, get_api_url, send_event, send_event_to_role, send_logs,
     k8s_json_object_hook, get_timezone, NODE_STATUSES, POD_STATUSES
@@ -554,6 +555,18 @@ def clean_deleted_drives():
     remove_drives_marked_for_deletion()
 
 
+@celery.task()
+@exclusive_task(60 * 60)
+def purge_user_activity():
+    """Delete login history older than USER_ACTIVITY_RETENTION_DAYS."""
+    if not USER_ACTIVITY_RETENTION_DAYS:
+        return
+    before = datetime.utcnow() - timedelta(days=USER_ACTIVITY_RETENTION_DAYS)
+    count = UserActivity.purge(before)
+    current_app.logger.info(
+        'Deleted %s user activities older than %s', count, before)
+
+
 def clean_drives_for_deleted_users():
     ids = [
         item.id
@@ -168,15 +168,16 @@ class TestPodEventK8s(DBTestCase):
 
 class TestSetLimit(unittest.TestCase):
     @mock.patch('kubedock.listeners.Pod')
-    @mock.patch('kubedock.listeners.Kube')
+    @mock.patch('kubedock.listeners.get_catalog')
     @mock.patch('kubedock.listeners.ssh_connect')
-    def test_set_limit(self, ssh_connect_mock, kube_mock, pod_mock):
+    def test_set_limit(self, ssh_connect_mock, get_catalog_mock, pod_mock):
         host = 'node'
         pod_id = 'abcd'
         containers = OrderedDict([('second', 'ipsum'), ('first', 'lorem')])
         app = flask.Flask(__name__)
 
-        kube_mock.query.values.return_value = (1, 1, 'GB'),
+        get_catalog_mock.return_value.get_kube.return_value = mock.Mock(
+            disk_space=1, disk_space_units='GB')
         pod_cls = type('Pod', (), {
             'kube_id': 1,
             'config': json.dumps({
@@ -0,0 +1,140 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+
+import gevent
+import gevent.event
+import mock
+import redis
+
+from .. import listeners_supervisor
+from ..listeners_supervisor import LeaderLease, ListenerSupervisor
+
+
+def listener(app):
+    gevent.event.Event().wait()
+
+
+def dying_listener(app):
+    pass
+
+
+@mock.patch.object(listeners_supervisor, 'current_app', mock.Mock())
+class TestListenerSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.lease = mock.Mock(identity='host:1:x')
+        self.supervisor = ListenerSupervisor(
+            mock.sentinel.app, {'a': listener, 'b': listener}, self.lease)
+
+    def tearDown(self):
+        gevent.killall(self.supervisor.greenlets.values())
+
+    def test_waits_for_lease(self):
+        self.lease.acquire.return_value = False
+        self.assertEqual(self.supervisor.step(),
+                         listeners_supervisor.ACQUIRE_INTERVAL)
+        self.assertFalse(self.supervisor.is_leader)
+        self.assertFalse(self.lease.renew.called)
+
+    def test_starts_listeners_and_renews_lease(self):
+        self.lease.acquire.return_value = True
+        self.assertEqual(self.supervisor.step(),
+                         listeners_supervisor.RENEW_INTERVAL)
+        self.assertEqual(set(self.supervisor.greenlets), {'a', 'b'})
+        greenlets = dict(self.supervisor.greenlets)
+
+        self.lease.renew.return_value = True
+        self.supervisor.step()
+        self.lease.renew.assert_called_once_with()
+        self.assertEqual(self.supervisor.greenlets, greenlets)
+
+    def test_stops_listeners_when_lease_is_lost(self):
+        self.lease.acquire.return_value = True
+        self.supervisor.step()
+        greenlets = self.supervisor.greenlets.values()
+
+        self.lease.renew.return_value = False
+        self.supervisor.step()
+        self.assertFalse(self.supervisor.is_leader)
+        self.assertTrue(all(g.dead for g in greenlets))
+
+    def test_keeps_listeners_while_lease_is_valid(self):
+        self.lease.acquire.return_value = True
+        self.supervisor.step()
+
+        self.lease.renew.side_effect = redis.ConnectionError
+        self.lease.is_valid.return_value = True
+        self.supervisor.step()
+        self.assertTrue(self.supervisor.is_leader)
+
+        self.lease.is_valid.return_value = False
+        self.supervisor.step()
+        self.assertFalse(self.supervisor.is_leader)
+
+    def test_restarts_dead_listeners(self):
+        self.supervisor.listeners['b'] = dying_listener
+        self.lease.acquire.return_value = self.lease.renew.return_value = True
+        self.supervisor.step()
+        dead = self.supervisor.greenlets['b']
+        gevent.sleep(0)
+        self.assertTrue(dead.dead)
+
+        self.supervisor.step()
+        self.assertIsNot(self.supervisor.greenlets['b'], dead)
+
+    def test_run_releases_lease(self):
+        self.lease.acquire.return_value = True
+        with mock.patch.object(listeners_supervisor.gevent, 'sleep',
+                               side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                self.supervisor.run()
+        self.lease.release.assert_called_once_with()
+        self.assertFalse(self.supervisor.is_leader)
+
+
+class TestLeaderLease(unittest.TestCase):
+    def setUp(self):
+        self.conn = mock.Mock()
+        self.lease = LeaderLease(self.conn, 'key', ttl=6)
+
+    def test_acquire(self):
+        self.conn.set.return_value = True
+        self.assertTrue(self.lease.acquire())
+        self.conn.set.assert_called_once_with(
+            'key', self.lease.identity, nx=True, px=6000)
+        self.assertTrue(self.lease.is_valid())
+
+        self.conn.set.return_value = None
+        self.assertFalse(self.lease.acquire())
+        self.assertFalse(self.lease.is_valid())
+
+    def test_renew(self):
+        self.lease._renew.return_value = 1
+        self.assertTrue(self.lease.renew())
+        self.assertGreater(self.lease.expires_at, time.time())
+        self.lease._renew.return_value = 0
+        self.assertFalse(self.lease.renew())
+        self.assertEqual(self.lease.expires_at, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
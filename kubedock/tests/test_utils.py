@@ -44,6 +44,7 @@ from ..utils import (
     get_version,
     nested_dict_utils,
     domainize,
+    parallel_map,
 )
 
 
@@ -540,6 +541,22 @@ class TestUtilsFromSiunit(unittest.TestCase):
         self.assertEquals(from_siunit('2200m'), 2.2)
 
 
+class TestParallelMap(unittest.TestCase):
+
+    def test_results_order(self):
+        self.assertEqual(parallel_map(lambda x: x * 2, [3, 1, 2], 2),
+                         [6, 2, 4])
+
+    def test_error(self):
+        def f(x):
+            if x > 1:
+                raise APIError(str(x))
+            return x
+        with self.assertRaises(APIError) as err:
+            parallel_map(f, [1, 2, 3], 3)
+        self.assertEqual(err.exception.message, '2')
+
+
 class TestGetVersion(unittest.TestCase):
 
     @mock.patch('kubedock.utils.subprocess.check_output')
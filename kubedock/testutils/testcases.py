@@ -28,6 +28,10 @@ from flask_testing import TestCase as FlaskBaseTestCase
 from nose.plugins.attrib import attr
 
 from . import create_app, fixtures
+from ..billing import catalog
+from ..kapi import node_cache, notifications
+from ..system_settings import models as system_settings
+from ..users.utils import clear_online_collection
 from ..core import db
 from ..utils import atomic
 
@@ -88,6 +92,12 @@ class DBTestCase(FlaskTestCase):
 
         prepareDB()
         db.session.remove()
+        # snapshot may contain data of rolled back transactions
+        catalog.clear()
+        node_cache.clear()
+        notifications.clear()
+        system_settings.clear()
+        clear_online_collection()
 
         # Create root transaction.
         connection = db.engine.connect()
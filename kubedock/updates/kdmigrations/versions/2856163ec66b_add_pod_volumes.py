@@ -0,0 +1,72 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Add pod_volumes table
+
+Revision ID: 2856163ec66b
+Revises: 7304a6335962
+Create Date: 2017-02-08 11:42:17.301442
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2856163ec66b'
+down_revision = '7304a6335962'
+
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table(
+        'pod_volumes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('pod_id', postgresql.UUID(), nullable=False),
+        sa.Column('pd_name', sa.String(length=64), nullable=False),
+        sa.ForeignKeyConstraint(['pod_id'], ['pods.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('pod_id', 'pd_name'),
+    )
+    op.create_index(op.f('ix_pod_volumes_pd_name'), 'pod_volumes',
+                    ['pd_name'], unique=False)
+
+    pods = sa.table('pods', sa.column('id'), sa.column('config'))
+    pod_volumes = sa.table('pod_volumes', sa.column('pod_id'),
+                           sa.column('pd_name'))
+    conn = op.get_bind()
+    links = []
+    for pod_id, config in conn.execute(sa.select([pods.c.id, pods.c.config])):
+        try:
+            volumes = json.loads(config or '{}').get('volumes_public') or []
+            names = {item['persistentDisk']['pdName'] for item in volumes
+                     if (item.get('persistentDisk') or {}).get('pdName')}
+        except (TypeError, ValueError, AttributeError):
+            continue
+        links.extend({'pod_id': pod_id, 'pd_name': name} for name in names)
+    if links:
+        op.bulk_insert(pod_volumes, links)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_pod_volumes_pd_name'), table_name='pod_volumes')
+    op.drop_table('pod_volumes')
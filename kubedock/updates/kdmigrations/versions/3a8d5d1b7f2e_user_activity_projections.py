@@ -0,0 +1,105 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Add indexes of users_activity, users.last_login and users_sessions
+
+Revision ID: 3a8d5d1b7f2e
+Revises: 2856163ec66b
+Create Date: 2017-02-20 14:05:31.118470
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a8d5d1b7f2e'
+down_revision = '2856163ec66b'
+
+from alembic import op
+import sqlalchemy as sa
+
+LOGIN, LOGOUT, LOGIN_A, LOGOUT_A = 0, 1, 2, 3
+
+
+def _sessions(conn):
+    """Pairs logins and logouts the same way as former
+    UserActivity.get_sessions did.
+    """
+    activity = sa.table('users_activity', sa.column('id'), sa.column('ts'),
+                        sa.column('action'), sa.column('user_id'),
+                        sa.column('remote_ip'))
+    query = sa.select([activity.c.user_id, activity.c.action,
+                       activity.c.ts, activity.c.remote_ip]).where(
+        activity.c.user_id.isnot(None)).order_by(activity.c.user_id,
+                                                 activity.c.id)
+    opened = {}
+    for user_id, action, ts, remote_ip in conn.execute(query):
+        by_another = action in (LOGIN_A, LOGOUT_A)
+        key = (user_id, by_another)
+        if action in (LOGIN, LOGIN_A):
+            if key not in opened:
+                opened[key] = {'user_id': user_id, 'by_another': by_another,
+                               'login_ts': ts, 'logout_ts': None,
+                               'remote_ip': remote_ip}
+        elif key in opened:
+            session = opened.pop(key)
+            session['logout_ts'] = ts
+            yield session
+    for session in opened.itervalues():
+        yield session
+
+
+def upgrade():
+    op.create_index('ix_users_activity_user_id_ts', 'users_activity',
+                    ['user_id', 'ts'])
+    op.create_index('ix_users_activity_ts', 'users_activity', ['ts'])
+
+    op.add_column('users', sa.Column('last_login', sa.DateTime(),
+                                     nullable=True))
+    op.execute("""
+        UPDATE users SET last_login = (
+            SELECT max(ts) FROM users_activity
+            WHERE users_activity.user_id = users.id
+                AND users_activity.action = {0})
+    """.format(LOGIN))
+
+    users_sessions = op.create_table(
+        'users_sessions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('by_another', sa.Boolean(), nullable=False),
+        sa.Column('login_ts', sa.DateTime(), nullable=False),
+        sa.Column('logout_ts', sa.DateTime(), nullable=True),
+        sa.Column('remote_ip', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_users_sessions_user_id_login_ts', 'users_sessions',
+                    ['user_id', 'login_ts'])
+    sessions = list(_sessions(op.get_bind()))
+    if sessions:
+        op.bulk_insert(users_sessions, sessions)
+
+
+def downgrade():
+    op.drop_index('ix_users_sessions_user_id_login_ts',
+                  table_name='users_sessions')
+    op.drop_table('users_sessions')
+    op.drop_column('users', 'last_login')
+    op.drop_index('ix_users_activity_ts', table_name='users_activity')
+    op.drop_index('ix_users_activity_user_id_ts', table_name='users_activity')
@@ -0,0 +1,43 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Add index of notification_roles by role
+
+Revision ID: 4c6e0d2b9a11
+Revises: 3a8d5d1b7f2e
+Create Date: 2017-02-21 10:12:44.204315
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c6e0d2b9a11'
+down_revision = '3a8d5d1b7f2e'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('ix_notification_roles_rid_nid', 'notification_roles',
+                    ['rid', 'nid'])
+
+
+def downgrade():
+    op.drop_index('ix_notification_roles_rid_nid',
+                  table_name='notification_roles')
@@ -0,0 +1,55 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Add auth_hash to DockerfileCache
+
+auth_hash is a hex HMAC-SHA256 of registry credentials keyed with
+SECRET_KEY, empty string for anonymous requests.
+
+Revision ID: 7304a6335962
+Revises: 11bf9b6a89b2
+Create Date: 2017-02-06 14:21:37.415128
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7304a6335962'
+down_revision = '11bf9b6a89b2'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('dockerfile_cache', sa.Column(
+        'auth_hash', sa.String(length=64), nullable=False, server_default=''))
+    op.drop_constraint('dockerfile_cache_pkey', 'dockerfile_cache')
+    op.create_primary_key('dockerfile_cache_pkey', 'dockerfile_cache',
+                          ['image', 'auth_hash'])
+    # configs cached with hashes of other format will never match again
+    op.execute("DELETE FROM dockerfile_cache WHERE auth_hash != ''")
+
+
+def downgrade():
+    op.execute("DELETE FROM dockerfile_cache WHERE auth_hash != ''")
+    op.drop_constraint('dockerfile_cache_pkey', 'dockerfile_cache')
+    op.create_primary_key('dockerfile_cache_pkey', 'dockerfile_cache',
+                          ['image'])
+    op.drop_column('dockerfile_cache', 'auth_hash')
@@ -0,0 +1,61 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+UWSGI_KUBERDOCK_INI = '/etc/uwsgi/vassals/kuberdock.ini'
+MULES = [
+    '# Listeners of kubernetes and etcd events. Only one mule at a time runs '
+    'them\n',
+    '# (leader lease in Redis), the other one takes over if the leader dies.\n',
+    'mule = listeners_mule.py\n',
+    'mule = listeners_mule.py\n',
+]
+
+
+def _read_ini():
+    with open(UWSGI_KUBERDOCK_INI) as f:
+        return f.readlines()
+
+
+def _write_ini(lines):
+    # uwsgi emperor reloads the vassal once the file is changed
+    with open(UWSGI_KUBERDOCK_INI, 'w') as f:
+        f.writelines(lines)
+
+
+def upgrade(upd, with_testing, *args, **kwargs):
+    upd.print_log('Run listeners in uwsgi mules ...')
+    lines = _read_ini()
+    if any(line.startswith('mule') for line in lines):
+        upd.print_log('Mules are already configured, skipped')
+        return
+    for i, line in enumerate(lines):
+        if line.startswith('gevent'):
+            break
+    else:
+        i = len(lines)
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+    lines[i:i] = MULES
+    _write_ini(lines)
+
+
+def downgrade(upd, with_testing, exception, *args, **kwargs):
+    upd.print_log('Stop running listeners in uwsgi mules ...')
+    _write_ini([line for line in _read_ini() if line not in MULES])
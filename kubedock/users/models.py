@@ -24,6 +24,7 @@ import json
 
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import ResourceClosedError, IntegrityError
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # from flask import current_app
@@ -35,8 +36,10 @@ from .signals import (
     user_logged_out_by_another, user_get_all_settings, user_get_setting,
     user_set_setting)
 from .utils import (
-    get_user_last_activity, get_online_users, enrich_tz_with_offset)
-from ..settings import DEFAULT_TIMEZONE, KUBERDOCK_INTERNAL_USER
+    get_user_last_activity, get_online_users, enrich_tz_with_offset,
+    get_cached_online_collection, cache_online_collection)
+from ..settings import (DEFAULT_TIMEZONE, KUBERDOCK_INTERNAL_USER,
+                        SESSION_LIFETIME)
 
 
 @login_manager.user_loader
@@ -120,6 +123,8 @@ class User(BaseModelMixin, UserMixin, db.Model):
         # circular dependency).
         default=db.text('(select id from packages where is_default)'))
     join_date = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # time of the last login, kept up to date by `UserActivity.log`
+    last_login = db.Column(db.DateTime, nullable=True)
     pods = db.relationship('Pod', backref='owner', lazy='dynamic')
     activities = db.relationship('UserActivity', back_populates="user")
     settings = db.Column(db.Text)
@@ -166,12 +171,19 @@ class User(BaseModelMixin, UserMixin, db.Model):
 
     @classmethod
     def get_online_collection(cls, to_json=None):
+        serialized = get_cached_online_collection()
+        if serialized is not None:
+            return serialized if to_json else json.loads(serialized)
         user_ids = get_online_users()
         users = [
-            u.to_dict() for u in cls.not_deleted.filter(cls.id.in_(user_ids))
-        ]
+            u.to_dict() for u in cls.not_deleted.options(
+                joinedload(cls.role), joinedload(cls.package)
+            ).filter(cls.id.in_(user_ids))
+        ] if user_ids else []
+        serialized = json.dumps(users)
+        cache_online_collection(serialized)
         if to_json:
-            return json.dumps(users)
+            return serialized
         return users
 
     @classmethod
@@ -211,21 +223,23 @@ class User(BaseModelMixin, UserMixin, db.Model):
     def last_activity(self):
         return get_user_last_activity(self.id)
 
+    @staticmethod
+    def pod_to_dict(pod):
+        return dict(
+            id=pod.id,
+            name=pod.name,
+            owner_id=pod.owner_id,
+            kube_id=pod.kube_id,
+            config=pod.config,
+            status=pod.status,
+            kubes=pod.kubes,
+            containers_count=pod.containers_count,
+        )
+
     def pods_to_dict(self, exclude=None):
         if exclude is None:
             exclude = []
-        return [
-            dict(
-                id=p.id,
-                name=p.name,
-                owner_id=p.owner_id,
-                kube_id=p.kube_id,
-                config=p.config,
-                status=p.status,
-                kubes=p.kubes,
-                containers_count=p.containers_count,
-            ) for p in self.pods if not p.is_deleted
-        ]
+        return [self.pod_to_dict(p) for p in self.pods if not p.is_deleted]
 
     def get_settings(self, key=None):
         user_settings = json.loads(self.settings) if self.settings else {}
@@ -263,40 +277,37 @@ class User(BaseModelMixin, UserMixin, db.Model):
 
         if full:
             # add all extra fields
-            last_activity = self.last_activity
-            last_login = self.last_login
-            pods = self.pods_to_dict(exclude)
-            containers_count = sum([p['containers_count'] for p in pods])
-            data['pods'] = pods
-            data['pods_count'] = len(pods)
-            data['containers_count'] = containers_count
-            data['package_info'] = self.package_info()
-            data['join_date'] = self.join_date
-            data['last_activity'] = last_activity if last_activity else ''
-            data['last_login'] = last_login if last_login else None
+            data.update(self.full_fields(
+                pods=self.pods_to_dict(exclude),
+                package_info=self.package_info(),
+                last_activity=self.last_activity,
+                last_login=self.last_login))
         return data
 
+    def full_fields(self, pods, package_info, last_activity, last_login):
+        """Extra fields of full user data. Use it to serialize a lot of users
+        with data fetched for all of them at once.
+        """
+        return {
+            'pods': pods,
+            'pods_count': len(pods),
+            'containers_count': sum([p['containers_count'] for p in pods]),
+            'package_info': package_info,
+            'join_date': self.join_date,
+            'last_activity': last_activity if last_activity else '',
+            'last_login': last_login if last_login else None,
+        }
+
     def history_logged_in(self):
-        ua = UserActivity.create(action=UserActivity.LOGIN, user_id=self.id)
-        ua.save()
+        UserActivity.log(UserActivity.LOGIN, self.id)
 
     def history_logged_out(self):
-        ua = UserActivity.create(action=UserActivity.LOGOUT, user_id=self.id)
-        ua.save()
+        UserActivity.log(UserActivity.LOGOUT, self.id)
 
     def user_activity(self):
         data = [ua.to_dict() for ua in self.activities]
         return data
 
-    @property
-    def last_login(self):
-        last_login = UserActivity.filter_by(
-            action=UserActivity.LOGIN,
-            user_id=self.id).order_by(UserActivity.ts.desc()).first()
-        if last_login:
-            return last_login.ts
-        return None
-
     def package_info(self):
         pkg = self.package
         if pkg is None:
@@ -373,17 +384,59 @@ class UserActivity(BaseModelMixin, db.Model):
     user = db.relationship('User')
     remote_ip = db.Column(db.String)
 
+    __table_args__ = (
+        db.Index('ix_users_activity_user_id_ts', 'user_id', 'ts'),
+        db.Index('ix_users_activity_ts', 'ts'),
+    )
+
+    @classmethod
+    def log(cls, action, user_id, remote_ip=None, commit=True):
+        """Saves activity and updates its projections: last login of the
+        user and history of sessions (see `UserSession`).
+        """
+        now = datetime.datetime.utcnow()
+        by_another = action in (cls.LOGIN_A, cls.LOGOUT_A)
+        opened = UserSession.query.filter_by(
+            user_id=user_id, by_another=by_another, logout_ts=None)
+        if action in (cls.LOGIN, cls.LOGIN_A):
+            user = User.query.get(user_id) if action == cls.LOGIN else None
+            if user is not None:
+                user.last_login = now
+            # logout of a stale session was missed (e.g. it has expired), so
+            # its end is unknown and it is replaced by the new one
+            stale = now - datetime.timedelta(seconds=SESSION_LIFETIME)
+            opened.filter(UserSession.login_ts < stale).delete(
+                synchronize_session=False)
+            # repeated login does not start a new session
+            if opened.first() is None:
+                db.session.add(UserSession(
+                    user_id=user_id, by_another=by_another, login_ts=now,
+                    remote_ip=remote_ip))
+        else:
+            opened.update({'logout_ts': now}, synchronize_session=False)
+        ua = cls.create(action=action, user_id=user_id, ts=now,
+                        remote_ip=remote_ip)
+        return ua.save(deferred_commit=not commit)
+
+    @classmethod
+    def purge(cls, before):
+        """Deletes activities and sessions older than `before`."""
+        count = cls.query.filter(cls.ts < before).delete(
+            synchronize_session=False)
+        UserSession.query.filter(db.or_(
+            UserSession.logout_ts < before,
+            db.and_(UserSession.logout_ts.is_(None),
+                    UserSession.login_ts < before))
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
     @classmethod
     def get_users_activities(cls, user_ids, date_from=None, date_to=None,
                              to_dict=None, to_json=None):
-        activities = cls.query.filter(cls.user_id.in_(user_ids))
-        if date_from:
-            activities = activities.filter(
-                cls.ts >= '{0} 00:00:00'.format(date_from))
-        if date_to:
-            activities = activities.filter(
-                cls.ts <= '{0} 23:59:59'.format(date_to))
-        users = User.filter(User.id.in_([a.user_id for a in activities]))
+        activities = period_filter(cls.query.filter(cls.user_id.in_(user_ids)),
+                                   cls.ts, cls.ts, date_from, date_to).all()
+        users = User.filter(User.id.in_({a.user_id for a in activities}))
         users = {u.id: u.to_dict() for u in users}
         data = [a.to_dict(include={'user': users.get(a.user_id)})
                 for a in activities]
@@ -393,35 +446,17 @@ class UserActivity(BaseModelMixin, db.Model):
 
     @classmethod
     def get_sessions(cls, user_id, date_from=None, date_to=None):
-        activities = cls.query.filter_by(user_id=user_id)
-        if date_from:
-            activities = activities.filter(
-                cls.ts >= '{0} 00:00:00'.format(date_from))
-        if date_to:
-            activities = activities.filter(
-                cls.ts <= '{0} 23:59:59'.format(date_to))
-        a = None
-        b = None
-        history = []
-        for act in activities:
-            action = act.action
-            if action == cls.LOGIN:
-                if a is None:
-                    a = act
-            elif action == cls.LOGIN_A:
-                if b is None:
-                    b = act
-            elif action == cls.LOGOUT:
-                if a:
-                    history.append((a.ts, (act.ts - a.ts).seconds, act.ts,
-                                    a.remote_ip, action))
-                    a = None
-            elif action == cls.LOGOUT_A:
-                if b:
-                    history.append((b.ts, (act.ts - b.ts).seconds, act.ts,
-                                    b.remote_ip, action))
-                    b = None
-        return history
+        """Returns finished sessions of the user which have begun and ended
+        in the period as list of tuples
+        (login time, duration in seconds, logout time, ip, logout action).
+        """
+        sessions = UserSession.query.filter(
+            UserSession.user_id == user_id,
+            UserSession.logout_ts.isnot(None))
+        sessions = period_filter(sessions, UserSession.login_ts,
+                                 UserSession.logout_ts, date_from, date_to)
+        return [s.to_tuple() for s in
+                sessions.order_by(UserSession.logout_ts, UserSession.id)]
 
     def to_dict(self, include=None, exclude=None):
         data = dict(
@@ -436,6 +471,44 @@ class UserActivity(BaseModelMixin, db.Model):
         return data
 
 
+class UserSession(db.Model):
+    """Login and the matching logout of the user. Projection of
+    `UserActivity`, so history of sessions does not need to be computed.
+    """
+    __tablename__ = 'users_sessions'
+
+    id = db.Column(
+        db.Integer, primary_key=True, autoincrement=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # session of an admin logged in as another user
+    by_another = db.Column(db.Boolean, nullable=False, default=False)
+    login_ts = db.Column(db.DateTime, nullable=False)
+    logout_ts = db.Column(db.DateTime, nullable=True)
+    remote_ip = db.Column(db.String)
+
+    __table_args__ = (
+        db.Index('ix_users_sessions_user_id_login_ts', 'user_id', 'login_ts'),
+    )
+
+    def to_tuple(self):
+        action = (UserActivity.LOGOUT_A if self.by_another else
+                  UserActivity.LOGOUT)
+        return (self.login_ts, (self.logout_ts - self.login_ts).seconds,
+                self.logout_ts, self.remote_ip, action)
+
+
+def period_filter(query, start_column, end_column, date_from=None,
+                  date_to=None):
+    """Filters query by the period of days (inclusive) given as strings
+    'YYYY-MM-DD'.
+    """
+    if date_from:
+        query = query.filter(start_column >= '{0} 00:00:00'.format(date_from))
+    if date_to:
+        query = query.filter(end_column <= '{0} 23:59:59'.format(date_to))
+    return query
+
+
 class SessionData(db.Model):
     __tablename__ = 'session_data'
     id = db.Column(postgresql.UUID, primary_key=True, nullable=False)
@@ -464,16 +537,13 @@ class SessionData(db.Model):
 def user_logged_in_signal(args):
     user_id, remote_ip = args
     # current_app.logger.debug('user_logged_in_signal {0}'.format(user_id))
-    ua = UserActivity.create(
-        action=UserActivity.LOGIN, user_id=user_id, remote_ip=remote_ip)
-    ua.save()
+    UserActivity.log(UserActivity.LOGIN, user_id, remote_ip=remote_ip)
 
 
 @user_logged_out.connect
 def user_logged_out_signal(user_id, commit=True):
     # current_app.logger.debug('user_logged_out_signal {0}'.format(user_id))
-    ua = UserActivity.create(action=UserActivity.LOGOUT, user_id=user_id)
-    ua.save(deferred_commit=not commit)
+    UserActivity.log(UserActivity.LOGOUT, user_id, commit=commit)
 
 
 @user_logged_in_by_another.connect
@@ -481,8 +551,7 @@ def user_logged_in_by_another_signal(args):
     user_id, target_user_id = args
     # current_app.logger.debug('user_logged_in_by_another {0} -> {1}'.format(
     #     user_id, target_user_id))
-    ua = UserActivity.create(action=UserActivity.LOGIN_A, user_id=user_id)
-    ua.save()
+    UserActivity.log(UserActivity.LOGIN_A, user_id)
 
 
 @user_logged_out_by_another.connect
@@ -490,9 +559,7 @@ def user_logged_out_by_another_signal(args):
     user_id, target_user_id = args
     # current_app.logger.debug('user_logged_out_by_another {0} -> {1}'.format(
     #     user_id, target_user_id))
-    ua = UserActivity.create(action=UserActivity.LOGOUT_A,
-                             user_id=target_user_id)
-    ua.save()
+    UserActivity.log(UserActivity.LOGOUT_A, target_user_id)
 
 
 @user_get_all_settings.connect
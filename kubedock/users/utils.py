@@ -25,38 +25,95 @@ from functools import wraps
 
 from flask import current_app
 from pytz import common_timezones, timezone
+from redis import RedisError
 
 from ..core import ConnectionPool
 
 
+#: Redis sorted set of recently active users, scored by time of last activity
+ONLINE_USERS_KEY = 'kd.users.online'
+
+#: Redis key of the serialized collection of online users
+ONLINE_COLLECTION_CACHE_KEY = 'kd.users.online.collection'
+
+#: Lifetime of the cached collection of online users (seconds)
+ONLINE_COLLECTION_CACHE_TTL = 10
+
+
+def _online_period():
+    return current_app.config['ONLINE_LAST_MINUTES'] * 60
+
+
 def mark_online(user_id):
     now = int(time.time())
-    expires = now + (current_app.config['ONLINE_LAST_MINUTES'] * 60) + 10
-    all_users_key = 'online-users/%d' % (now // 60)
-    user_key = 'user-activity/%s' % user_id
+    period = _online_period()
     redis = ConnectionPool.get_connection()
     p = redis.pipeline()
-    p.sadd(all_users_key, user_id)
-    p.set(user_key, now)
-    p.expireat(all_users_key, expires)
-    p.expireat(user_key, expires)
+    p.zadd(ONLINE_USERS_KEY, now, user_id)
+    # users who were not active during the period are not needed anymore
+    p.zremrangebyscore(ONLINE_USERS_KEY, '-inf', '({0}'.format(now - period))
+    p.expire(ONLINE_USERS_KEY, period + 10)
     p.execute()
 
 
-def get_user_last_activity(user_id):
-    redis = ConnectionPool.get_connection()
-    last_active = redis.get('user-activity/%s' % user_id)
-    if last_active is None:
+def _score_to_datetime(last_active):
+    if last_active is None or last_active < time.time() - _online_period():
         return None
     return datetime.utcfromtimestamp(int(last_active))
 
 
+def get_user_last_activity(user_id):
+    redis = ConnectionPool.get_connection()
+    return _score_to_datetime(redis.zscore(ONLINE_USERS_KEY, user_id))
+
+
+def get_users_last_activity(user_ids):
+    """Same as `get_user_last_activity`, but for many users in one request.
+    Returns dict user id -> time of last activity (or None).
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    p = ConnectionPool.get_connection().pipeline(transaction=False)
+    for user_id in user_ids:
+        p.zscore(ONLINE_USERS_KEY, user_id)
+    return {user_id: _score_to_datetime(last_active)
+            for user_id, last_active in zip(user_ids, p.execute())}
+
+
 def get_online_users():
-    current = int(time.time()) // 60
-    minutes = xrange(current_app.config['ONLINE_LAST_MINUTES'])
+    since = int(time.time()) - _online_period()
     redis = ConnectionPool.get_connection()
-    return redis.sunion(['online-users/%d' % (current - x)
-                         for x in minutes])
+    return set(redis.zrangebyscore(ONLINE_USERS_KEY, since, '+inf'))
+
+
+def get_cached_online_collection():
+    """Returns serialized collection of online users if it's cached."""
+    try:
+        return ConnectionPool.get_connection().get(
+            ONLINE_COLLECTION_CACHE_KEY)
+    except RedisError as e:
+        current_app.logger.warning(
+            'Failed to read online users cache: {0}'.format(e))
+
+
+def cache_online_collection(serialized):
+    try:
+        ConnectionPool.get_connection().setex(
+            ONLINE_COLLECTION_CACHE_KEY, ONLINE_COLLECTION_CACHE_TTL,
+            serialized)
+    except RedisError as e:
+        current_app.logger.warning(
+            'Failed to update online users cache: {0}'.format(e))
+
+
+def clear_online_collection():
+    """Drops cached collection of online users."""
+    try:
+        ConnectionPool.get_connection().delete(ONLINE_COLLECTION_CACHE_KEY)
+    except RedisError as e:
+        current_app.logger.warning(
+            'Failed to clear online users cache: {0}'.format(e))
 
 
 def append_offset_to_timezone(tz):
@@ -29,8 +29,9 @@ import string
 import struct
 import subprocess
 import sys
+import threading
 import time
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from contextlib import contextmanager
 from functools import wraps
 from itertools import chain
@@ -41,6 +42,7 @@ import bitmath
 import ipaddress
 import requests
 import yaml
+from gevent.pool import Pool
 from flask import (current_app, request, jsonify, g, has_app_context, Response,
                    session, has_request_context)
 from sqlalchemy.exc import SQLAlchemyError, InvalidRequestError
@@ -850,6 +852,28 @@ def retry_with_catch(f, max_tries=1, retry_pause=0, exc_types=(Exception,),
         raise e
 
 
+def parallel_map(f, items, pool_size):
+    """Calls the given function for every item using a bounded pool of
+    greenlets. If there is an application context, every greenlet gets
+    its own copy of it, so DB session and config are available there.
+
+    :param f: a function of one argument.
+    :param items: iterable of arguments.
+    :param pool_size: max number of simultaneously running calls.
+    :return: list of results in the order of `items`. The first (in the
+        order of `items`) error will be raised.
+    """
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def call(item):
+        if app is None:
+            return f(item)
+        with app.app_context():
+            return f(item)
+
+    return Pool(pool_size).map(call, items)
+
+
 def ip2int(ip):
     return int(ipaddress.IPv4Address(ip))
 
@@ -954,6 +978,57 @@ class NestedDictUtils(object):
 nested_dict_utils = NestedDictUtils
 
 
+class LRUCache(object):
+    """
+    Simple in-process cache with limited size and optional expiration time
+    of items. Least recently used items are evicted first.
+    """
+    def __init__(self, max_size, ttl=None):
+        """
+        :param max_size: max number of items in the cache
+        :param ttl: default number of seconds after which item expires,
+            None means "never"
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._items.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            self._items[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, (default, None))[0]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._items)
+
+
 def domainize(input_str):
     """
     Normalize string to DNS-valid character sequence
@@ -26,6 +26,7 @@ import cerberus
 from ipaddress import ip_network
 from sqlalchemy import func
 
+from kubedock.billing.catalog import get_catalog
 from kubedock.billing.models import Kube, Package
 from kubedock.domains.models import BaseDomain
 from kubedock.kapi.images import Image
@@ -59,6 +60,7 @@ class V(cerberus.Validator):
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.get('user')
+        self.owner = kwargs.get('owner')
         super(V, self).__init__(*args, **kwargs)
 
     def _api_validation(self, data, schema, *args, **kwargs):
@@ -146,7 +148,7 @@ class V(cerberus.Validator):
 
     def _validate_kube_type_exists(self, exists, field, value):
         if exists:
-            kube = Kube.query.get(value)
+            kube = get_catalog().get_kube(value)
             if kube is None:
                 self._error(field, 'Pod can\'t be created, because cluster '
                                    'has no kube type with id "{0}", please '
@@ -161,8 +163,9 @@ class V(cerberus.Validator):
             if self.user == KUBERDOCK_INTERNAL_USER and \
                     value == Kube.get_internal_service_kube_type():
                 return
-            package = User.get(self.user).package
-            if value not in [k.kube_id for k in package.kubes]:
+            owner = self.owner or User.get(self.user)
+            package = get_catalog().get_package(owner.package_id)
+            if not package.has_kube(value):
                 self._error(field,
                             "Pod can't be created, because your package "
                             "\"{0}\" does not include kube type with id "
@@ -170,7 +173,7 @@ class V(cerberus.Validator):
 
     def _validate_kube_type_in_db(self, exists, field, value):
         if exists:
-            kube = Kube.query.get(value)
+            kube = get_catalog().get_kube(value)
             if not kube:
                 self._error(field, 'No such kube_type: "{0}"'.format(value))
             elif not kube.is_public() and self.user != KUBERDOCK_INTERNAL_USER:
@@ -237,7 +240,7 @@ class V(cerberus.Validator):
 
     def _validate_package_id_exists(self, exists, field, value):
         if exists:
-            if Package.query.get(int(value)) is None:
+            if get_catalog().get_package(int(value)) is None:
                 self._error(field, ('Package with id "{0}" does not exist'
                                     .format(value)))
 
@@ -330,7 +333,8 @@ def check_new_pod_data(data, user=None, **kwargs):
     #                            'schema': {'a': {'coerce': str}}}})
     # -> {'a': '456', 'b': {'a': 456}}
     # use normalisation only after upgrade to Cerberus 1.0 ...
-    validator = V(user=None if user is None else user.username, **kwargs)
+    validator = V(user=None if user is None else user.username, owner=user,
+                  **kwargs)
     if not validator.validate(data, new_pod_schema):
         raise ValidationError(validator.errors)
 
@@ -347,7 +351,8 @@ def check_new_pod_data(data, user=None, **kwargs):
 
 def check_pod_dump(data, user=None, **kwargs):
     kwargs.setdefault('allow_unknown', True)
-    validator = V(user=None if user is None else user.username, **kwargs)
+    validator = V(user=None if user is None else user.username, owner=user,
+                  **kwargs)
     if not validator.validate(data, pod_dump_schema):
         raise ValidationError(validator.errors)
 
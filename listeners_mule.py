@@ -0,0 +1,46 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+"""Entry point of uwsgi mules which run kubernetes and etcd listeners.
+
+Several mules are started for failover, but only the one holding the leader
+lease runs listeners (see `kubedock.listeners_supervisor`), so HTTP workers
+never process watch events.
+"""
+
+import gevent.monkey
+gevent.monkey.patch_all()
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+import signal
+import sys
+
+from kubedock import api, listeners_supervisor
+
+
+def _exit(signum, frame):
+    # raise SystemExit in the main greenlet, so the lease is released
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, _exit)
+    listeners_supervisor.run(api.create_app())
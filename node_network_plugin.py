@@ -23,6 +23,7 @@
 from __future__ import print_function
 
 import errno
+import hashlib
 import json
 import os
 import shutil
@@ -33,9 +34,11 @@ import tarfile
 import time
 import urlparse
 import zipfile
+import zlib
 from collections import OrderedDict
 from ConfigParser import ConfigParser
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from StringIO import StringIO
 from tempfile import NamedTemporaryFile
 from urllib import urlopen
@@ -62,10 +65,23 @@ PUBLIC_IP_MANGLE_RULE = \
 PUBLIC_IP_POSTROUTING_RULE = 'iptables -w -{0} KUBERDOCK-PUBLIC-IP-SNAT ' \
                              '-t nat -s {1} -j SNAT --to-source {2}'
 
+# Public IP rules of every pod are kept in dedicated chains (DNAT and MARK
+# rules in nat and mangle tables, SNAT rule in nat table), so they can be
+# created and removed with a single iptables-restore call.
+PUBLIC_IP_POD_CHAIN = 'KD-PUB-{0}'
+PUBLIC_IP_POD_SNAT_CHAIN = 'KD-SNAT-{0}'
+
 # MARKS:
 # 1 - traffic to reject/drop
 # 2 - traffic for public ip (will be added and used later)
 
+# Backups of volumes are downloaded and extracted by chunks of this size
+RESTORE_CHUNK_SIZE = 1024 * 1024
+# How many times an interrupted download of a backup is resumed
+RESTORE_RESUME_ATTEMPTS = 3
+# Max number of volumes of a pod restored simultaneously
+RESTORE_WORKERS = 4
+
 # Possibly to stderr if in daemon mode or to our log-file
 LOG_TO = sys.stderr
 
@@ -160,11 +176,28 @@ class ETCD(object):
     def put(self, url, value):
         requests.put(url, data={'value': value}, **self._args())
 
-    def wait(self):
-        requests.get(
-            self._url(),
-            **self._args(params=dict(wait=True, recursive=True))
-        )
+    def tree(self, *args):
+        """Reads the whole subtree with a single recursive request.
+        Returns tuple of root node and etcd index of the response.
+        """
+        r = requests.get(self._url(*args),
+                         **self._args(params=dict(recursive='true')))
+        index = r.headers.get('X-Etcd-Index')
+        try:
+            node = r.json()['node']
+        except Exception:
+            node = {}
+        return node, int(index) if index else None
+
+    def wait(self, index=None):
+        """Waits for any change in the tree. If index is given, then the
+        change is looked for starting from this index, so changes made after
+        previous read are not missed.
+        """
+        params = dict(wait=True, recursive=True)
+        if index is not None:
+            params['waitIndex'] = index
+        requests.get(self._url(), **self._args(params=params))
 
 
 def read_config_ini(filename):
@@ -203,33 +236,96 @@ def set_config(filename, data):
         f.writelines(['{0}={1}\n'.format(k, v) for k, v in d.items()])
 
 
-def _update_ipset(set_name, ip_list, set_type='hash:ip'):
+def _ipset_commands(set_name, ip_list, set_type='hash:ip'):
+    """Returns `ipset restore` commands which atomically replace content
+    of the set."""
     set_temp = '{0}_temp'.format(set_name)
-    subprocess.call(['ipset', '-exist', 'create', set_name, set_type])
-    subprocess.call(['ipset', '-exist', 'create', set_temp, set_type])
-    subprocess.call(['ipset', 'flush', set_temp])
-    for ip in ip_list:
-        subprocess.call(['ipset', 'add', set_temp, ip])
-    subprocess.call(['ipset', 'swap', set_temp, set_name])
-    subprocess.call(['ipset', 'destroy', set_temp])
+    commands = ['create {0} {1}'.format(set_name, set_type),
+                'create {0} {1}'.format(set_temp, set_type),
+                'flush {0}'.format(set_temp)]
+    commands.extend('add {0} {1}'.format(set_temp, ip) for ip in ip_list)
+    commands.extend(['swap {0} {1}'.format(set_temp, set_name),
+                     'destroy {0}'.format(set_temp)])
+    return commands
+
+
+def _ipset_restore(commands):
+    """Applies all commands with a single `ipset restore` call."""
+    p = subprocess.Popen(['ipset', '-exist', 'restore'],
+                         stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = p.communicate('\n'.join(commands + ['COMMIT', '']))
+    if p.returncode:
+        glog('Error while restoring ipsets: {0}'.format(err))
+        return False
+    return True
+
+
+def _update_ipset(set_name, ip_list, set_type='hash:ip'):
+    _ipset_restore(_ipset_commands(set_name, ip_list, set_type))
+
+
+def _etcd_children(node):
+    return dict((item['key'].rsplit('/')[-1], item)
+                for item in node.get('nodes', []))
+
+
+class IPSetSync(object):
+    """Keeps kuberdock_user_<id> and kuberdock_nodes ipsets in sync with
+    etcd. The whole plugin tree is read with one request and only the sets
+    whose content has changed since the previous sync are rewritten.
+    """
+    shared_ips = ('10.254.0.1', '10.254.0.10')
+
+    def __init__(self, etcd=None):
+        self.etcd = etcd or ETCD()
+        self.applied = {}
+
+    def read_sets(self):
+        root, index = self.etcd.tree()
+        dirs = _etcd_children(root)
+        sets = {}
+        nodes_ips = set(_etcd_children(dirs.get('registered_hosts', {})))
+        for user, user_node in _etcd_children(
+                dirs.get(ETCD.users_path, {})).items():
+            try:
+                user = int(user)
+            except ValueError as e:
+                glog('Error while try to convert user_id to int: {}'.format(e))
+                continue
+            user_ip_list = set(self.shared_ips)
+            for pod_ip, pod_node in _etcd_children(user_node).items():
+                try:
+                    value = json.loads(pod_node.get('value', ''))
+                except ValueError:
+                    value = {'node': None, 'service': None}
+                user_ip_list.add(pod_ip)
+                if value.get('service'):
+                    user_ip_list.add(value['service'])
+                if value.get('node'):
+                    nodes_ips.add(value['node'])
+            sets['kuberdock_user_{0}'.format(user)] = user_ip_list
+        sets['kuberdock_nodes'] = nodes_ips
+        return sets, index
+
+    def sync(self):
+        """Applies changed sets. Returns etcd index the sets correspond to.
+        """
+        start = time.time()
+        sets, index = self.read_sets()
+        changed = dict((name, ips) for name, ips in sets.items()
+                       if self.applied.get(name) != ips)
+        commands = []
+        for name in sorted(changed):
+            commands.extend(_ipset_commands(name, sorted(changed[name])))
+        if commands and _ipset_restore(commands):
+            self.applied.update(changed)
+        glog('ipsets sync: {0} of {1} sets updated in {2:.3f}s'.format(
+            len(changed), len(sets), time.time() - start))
+        return index
 
 
 def update_ipset():
-    shared_ips = ['10.254.0.1', '10.254.0.10']
-    nodes_ips = set()
-    etcd = ETCD()
-    for user in etcd.users():
-        set_name = 'kuberdock_user_{0}'.format(user)
-        user_ip_list = set(shared_ips)
-        for pod_ip, value in etcd.pods(user).items():
-            user_ip_list.add(pod_ip)
-            if value['service']:
-                user_ip_list.add(value['service'])
-            if value['node']:
-                nodes_ips.add(value['node'])
-        _update_ipset(set_name, user_ip_list)
-    nodes_ips.update(etcd.registered_hosts())
-    _update_ipset('kuberdock_nodes', nodes_ips)
+    IPSetSync().sync()
 
 
 def modify_ip(cmd, ip, iface):
@@ -292,6 +388,7 @@ def handle_public_ip(
         if not ports:
             return 4
 
+        public_ports = []
         for container in ports:
             for port_spec in container:
                 is_public = port_spec.get('isPublic', False)
@@ -305,12 +402,13 @@ def handle_public_ip(
 
                 proto = port_spec.get('protocol', 'tcp')
                 host_port = port_spec.get('hostPort', None) or container_port
+                public_ports.append((container_port, host_port, proto))
 
-                if action == 'add':
-                    add_ip(container_port, host_port, pod_ip, proto, public_ip)
-                elif action == 'del':
-                    delete_ip(container_port, host_port, pod_ip, proto,
-                              public_ip)
+        if public_ports:
+            if action == 'add':
+                add_public_ip_rules(pod_ip, public_ip, public_ports)
+            elif action == 'del':
+                delete_public_ip_rules(pod_ip, public_ip, public_ports)
         # Temporarily disable check. Maybe will be removed completely
         # if not (fixed_ip_pools or is_fixed_ip_pools_mode_enabled()):
         #    modify_ip(action, public_ip, iface)
@@ -325,7 +423,91 @@ def is_fixed_ip_pools_mode_enabled():
     return config['fixed_ip_pools'].lower() in enabled_options
 
 
+def _iptables_check(table, chain, rule):
+    return not subprocess.call(
+        ['iptables', '-w', '-t', table, '-C', chain] + rule)
+
+
+def _iptables_restore(tables):
+    """Applies rules with a single `iptables-restore --noflush` call.
+    :param tables: list of (table name, list of rules) tuples
+    """
+    script = []
+    for table, rules in tables:
+        script.append('*{0}'.format(table))
+        script.extend(rules)
+        script.append('COMMIT')
+    p = subprocess.Popen(['iptables-restore', '--noflush'],
+                         stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = p.communicate('\n'.join(script + ['']))
+    if p.returncode:
+        raise PluginException('Error while restoring iptables rules: '
+                              '{0}'.format(err))
+
+
+def _public_ip_jumps(pod_ip, public_ip):
+    """Rules which lead traffic of the pod to its dedicated chains."""
+    chain = PUBLIC_IP_POD_CHAIN.format(pod_ip)
+    snat_chain = PUBLIC_IP_POD_SNAT_CHAIN.format(pod_ip)
+    return [
+        ('nat', 'KUBERDOCK-PUBLIC-IP', ['-d', public_ip, '-j', chain]),
+        ('mangle', 'KUBERDOCK-PUBLIC-IP', ['-d', public_ip, '-j', chain]),
+        ('nat', 'KUBERDOCK-PUBLIC-IP-SNAT', ['-s', pod_ip, '-j', snat_chain]),
+    ]
+
+
+def add_public_ip_rules(pod_ip, public_ip, ports):
+    """(Re)creates chains with public IP rules of the pod.
+    :param ports: list of (container port, host port, protocol) tuples
+    """
+    chain = PUBLIC_IP_POD_CHAIN.format(pod_ip)
+    snat_chain = PUBLIC_IP_POD_SNAT_CHAIN.format(pod_ip)
+    # declaration of existing chain flushes it, so rules are never duplicated
+    nat = [':{0} - [0:0]'.format(chain), ':{0} - [0:0]'.format(snat_chain)]
+    mangle = [':{0} - [0:0]'.format(chain)]
+    for container_port, host_port, proto in ports:
+        nat.append(
+            '-A {0} -d {1} -p {2} --dport {3} -j DNAT --to-destination '
+            '{4}:{5}'.format(chain, public_ip, proto, host_port, pod_ip,
+                             container_port))
+        mangle.append(
+            '-A {0} -d {1} -p {2} --dport {3} -j MARK --set-mark 2'.format(
+                chain, public_ip, proto, host_port))
+    nat.append('-A {0} -s {1} -j SNAT --to-source {2}'.format(
+        snat_chain, pod_ip, public_ip))
+    rules = {'nat': nat, 'mangle': mangle}
+    for table, parent, rule in _public_ip_jumps(pod_ip, public_ip):
+        if not _iptables_check(table, parent, rule):
+            rules[table].append(' '.join(['-I', parent] + rule))
+    _iptables_restore([('nat', nat), ('mangle', mangle)])
+
+
+def delete_public_ip_rules(pod_ip, public_ip, ports):
+    """Removes chains with public IP rules of the pod.
+    :param ports: list of (container port, host port, protocol) tuples
+    """
+    if _iptables_check('nat', 'KUBERDOCK-PUBLIC-IP-SNAT',
+                       ['-s', pod_ip, '-j', 'SNAT', '--to-source', public_ip]):
+        # rules were added by previous version of the plugin; the pod could
+        # get new chains as well if it was re-added after upgrade
+        for container_port, host_port, proto in ports:
+            delete_ip(container_port, host_port, pod_ip, proto, public_ip)
+    chain = PUBLIC_IP_POD_CHAIN.format(pod_ip)
+    snat_chain = PUBLIC_IP_POD_SNAT_CHAIN.format(pod_ip)
+    # declare chains, so deletion doesn't fail if they are already absent
+    nat = [':{0} - [0:0]'.format(chain), ':{0} - [0:0]'.format(snat_chain)]
+    mangle = [':{0} - [0:0]'.format(chain)]
+    rules = {'nat': nat, 'mangle': mangle}
+    for table, parent, rule in _public_ip_jumps(pod_ip, public_ip):
+        if _iptables_check(table, parent, rule):
+            rules[table].append(' '.join(['-D', parent] + rule))
+    nat.extend(['-X {0}'.format(chain), '-X {0}'.format(snat_chain)])
+    mangle.append('-X {0}'.format(chain))
+    _iptables_restore([('nat', nat), ('mangle', mangle)])
+
+
 def delete_ip(container_port, host_port, pod_ip, proto, public_ip):
+    """Removes per-port rules created by previous versions of the plugin."""
     subprocess.call(
         PUBLIC_IP_RULE.format('D', public_ip, proto, host_port,
                               pod_ip, container_port).split(
@@ -337,30 +519,6 @@ def delete_ip(container_port, host_port, pod_ip, proto, public_ip):
         PUBLIC_IP_POSTROUTING_RULE.format('D', pod_ip, public_ip).split(' '))
 
 
-def add_ip(container_port, host_port, pod_ip, proto, public_ip):
-    if subprocess.call(
-            PUBLIC_IP_RULE.format('C', public_ip, proto,
-                                  host_port, pod_ip,
-                                  container_port).split(' ')):
-        subprocess.call(
-            PUBLIC_IP_RULE.format('I', public_ip, proto,
-                                  host_port, pod_ip,
-                                  container_port).split(' '))
-    if subprocess.call(
-            PUBLIC_IP_MANGLE_RULE.format('C', public_ip, proto,
-                                         host_port).split(
-                ' ')):
-        subprocess.call(
-            PUBLIC_IP_MANGLE_RULE.format('I', public_ip, proto,
-                                         host_port).split(' '))
-    if subprocess.call(
-            PUBLIC_IP_POSTROUTING_RULE.format('C', pod_ip,
-                                              public_ip).split(' ')):
-        subprocess.call(
-            PUBLIC_IP_POSTROUTING_RULE.format('I', pod_ip,
-                                              public_ip).split(' '))
-
-
 def init():
     config = read_config_ini('/run/flannel/subnet.env')
     config_network = config['flannel_network']
@@ -387,8 +545,9 @@ def watch(callback, args=None, path=None):
     etcd = ETCD(path)
     while True:
         try:
-            callback(*args)
-            etcd.wait()
+            # callback may return etcd index of the data it has processed
+            index = callback(*args)
+            etcd.wait(None if index is None else index + 1)
         except KeyboardInterrupt:
             break
         except requests.RequestException as e:
@@ -430,18 +589,107 @@ class VolumeRestoreException(Exception):
 
 
 class VolumeSpec(object):
-    def __init__(self, path, size, name, backup_url=None):
+    def __init__(self, path, size, name, backup_url=None,
+                 backup_checksum=None):
         """
         :param path: Local path.
         :param size: Size.
         :param name: Name.
         :param backup_url: Optional. URL which contains backup archives.
             Expected archive in format .tar.gz or .zip.
+        :param backup_checksum: Optional. SHA-256 of the archive. If it's
+            not specified, it's taken from `<backup_url>.sha256` (output of
+            sha256sum) if there is such file.
         """
         self.path = path
         self.size = size
         self.name = name
         self.backup_url = backup_url
+        self.backup_checksum = backup_checksum
+
+
+class _Download(object):
+    """Read-only file-like object which streams the url. If the connection
+    breaks, download is resumed from the current position (if the server
+    does not support ranges, already read data is skipped).
+    SHA-256 of the read data is computed on the fly.
+    """
+
+    _resumable_errors = (requests.exceptions.ConnectionError,
+                         requests.exceptions.Timeout,
+                         requests.exceptions.ChunkedEncodingError,
+                         socket.timeout)
+
+    def __init__(self, session, url, chunk_size=RESTORE_CHUNK_SIZE,
+                 attempts=RESTORE_RESUME_ATTEMPTS):
+        self.session = session
+        self.url = url
+        self.chunk_size = chunk_size
+        self.attempts = attempts
+        self.offset = 0
+        self.sha256 = hashlib.sha256()
+        self._chunks = None
+        self._skip = 0
+        self._chunk = ''
+        self._pos = 0
+
+    def _open(self):
+        headers = {}
+        if self.offset:
+            headers['Range'] = 'bytes={0}-'.format(self.offset)
+        r = self.session.get(self.url, stream=True, verify=False,
+                             headers=headers)
+        r.raise_for_status()
+        self._skip = (self.offset if r.status_code !=
+                      requests.codes.partial_content else 0)
+        self._chunks = r.iter_content(chunk_size=self.chunk_size)
+
+    def _read_chunk(self):
+        if self._chunks is None:
+            self._open()
+        for chunk in self._chunks:
+            if self._skip:
+                skipped = min(self._skip, len(chunk))
+                chunk, self._skip = chunk[skipped:], self._skip - skipped
+            if chunk:
+                return chunk
+        return ''
+
+    def _next_chunk(self):
+        attempt = 0
+        while True:
+            try:
+                chunk = self._read_chunk()
+            except self._resumable_errors:
+                attempt += 1
+                if attempt > self.attempts:
+                    raise
+                glog('Download of {0} was interrupted at {1} bytes, '
+                     'resuming'.format(self.url, self.offset))
+                self._chunks = None
+                continue
+            self.offset += len(chunk)
+            self.sha256.update(chunk)
+            return chunk
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._pos >= len(self._chunk):
+                self._chunk, self._pos = self._next_chunk(), 0
+                if not self._chunk:
+                    break
+            end = len(self._chunk)
+            if size > 0:
+                end = min(end, self._pos + size)
+                size -= end - self._pos
+            parts.append(self._chunk[self._pos:end])
+            self._pos = end
+        return ''.join(parts)
+
+    def read_to_end(self):
+        while self.read(self.chunk_size):
+            pass
 
 
 class FileAdapter(requests.adapters.BaseAdapter):
@@ -525,19 +773,14 @@ class VolumeManager(object):
         requests_session.mount('file://', FileAdapter())
         requests_session.mount('ftp://', FileAdapter())
 
+        checksum = (volume_spec.backup_checksum or
+                    self._get_checksum(requests_session,
+                                       volume_spec.backup_url))
+        download = _Download(requests_session, volume_spec.backup_url)
         try:
-            r = requests_session.get(volume_spec.backup_url, stream=True,
-                                     verify=False)
-            r.raise_for_status()
-
-            with NamedTemporaryFile('w+b') as f:
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-
-                f.seek(0)
-                extractor.extract(f, volume_spec.path)
-
+            extractor.extract(download, volume_spec.path)
+            # the rest of the archive (padding) is needed for the checksum
+            download.read_to_end()
         except (requests.exceptions.RequestException, socket.timeout):
             raise VolumeRestoreException(
                 'Connection failure while downloading backup from {}'
@@ -547,6 +790,25 @@ class VolumeManager(object):
                 'An error occurred while extracting archive got from {}'
                 .format(volume_spec.backup_url))
 
+        if checksum and download.sha256.hexdigest() != checksum.lower():
+            raise VolumeRestoreException(
+                'Checksum mismatch of archive got from {}'
+                .format(volume_spec.backup_url))
+
+    @staticmethod
+    def _get_checksum(session, backup_url):
+        """Get SHA-256 of the archive from `<backup_url>.sha256`, if the
+        file exists.
+        """
+        try:
+            r = session.get(backup_url + '.sha256', verify=False)
+            if r.status_code != requests.codes.ok:
+                return None
+            return r.content.split()[0]
+        except (requests.exceptions.RequestException, socket.timeout,
+                IndexError):
+            return None
+
     def create(self, volume_spec):
         """
         Creates a folder for the volume and sets correct SELinux type on it
@@ -605,18 +867,25 @@ class VolumeManager(object):
                 return extract(file_obj, path)
 
         def _extract_tar(self, file_obj, path):
+            # stream mode, so the archive is not stored anywhere
             try:
-                with tarfile.open(fileobj=file_obj, mode='r:gz') as archive:
+                with tarfile.open(fileobj=file_obj, mode='r|gz',
+                                  bufsize=RESTORE_CHUNK_SIZE) as archive:
                     archive.extractall(path)
-            except tarfile.TarError:
+            except (tarfile.TarError, zlib.error):
                 raise self.BadArchive
 
         def _extract_zip(self, file_obj, path):
-            try:
-                with zipfile.ZipFile(file_obj) as archive:
-                    archive.extractall(path)
-            except zipfile.BadZipfile:
-                raise self.BadArchive
+            # zip archive cannot be read sequentially (its index is at the
+            # end), so it's saved to a temporary file first
+            with NamedTemporaryFile('w+b') as f:
+                shutil.copyfileobj(file_obj, f, RESTORE_CHUNK_SIZE)
+                f.seek(0)
+                try:
+                    with zipfile.ZipFile(f) as archive:
+                        archive.extractall(path)
+                except zipfile.BadZipfile:
+                    raise self.BadArchive
 
         class UnknownType(Exception):
             pass
@@ -653,7 +922,9 @@ class LocalStorage(object):
         backup_url = annotation.get('backupUrl')
         path, size, name = ls['path'], ls.get('size', 1), ls['name']
         volume_spec = VolumeSpec(path=path, size='{}g'.format(size), name=name,
-                                 backup_url=backup_url)
+                                 backup_url=backup_url,
+                                 backup_checksum=annotation.get(
+                                     'backupChecksum'))
         return volume_spec
 
     @classmethod
@@ -663,8 +934,28 @@ class LocalStorage(object):
 
     @classmethod
     def restore_backups(cls, volume_specs):
-        for v in volume_specs:
-            cls.volume_manager.restore_if_needed(v)
+        """Restore volumes in parallel. If any of them fails, the first
+        error is raised after all restores are finished.
+        """
+        to_restore = [v for v in volume_specs if v.backup_url]
+        if len(to_restore) < 2:
+            for v in to_restore:
+                cls.volume_manager.restore_if_needed(v)
+            return
+
+        def restore(volume_spec):
+            try:
+                cls.volume_manager.restore_if_needed(volume_spec)
+            except VolumeRestoreException as e:
+                return e
+
+        pool = ThreadPool(min(len(to_restore), RESTORE_WORKERS))
+        try:
+            errors = [e for e in pool.map(restore, to_restore) if e]
+        finally:
+            pool.close()
+        if errors:
+            raise errors[0]
 
     @classmethod
     def remove_volumes(cls, volume_specs):
@@ -764,7 +1055,7 @@ def main(action, *args):
     elif action == 'update':
         update_ipset()
     elif action == 'watch':
-        watch(update_ipset)
+        watch(IPSetSync().sync)
     elif action == 'ex_status':
         handle_ex_status(*args)
     elif action == 'teardown_unexisting':
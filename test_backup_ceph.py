@@ -0,0 +1,196 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+import mock
+
+import backup_ceph
+
+RBD = ['rbd', '-n', 'client.admin', '--keyring=keyring', '-m', 'mon']
+
+
+class FakeRbd(object):
+    """ Emulates `rbd` commands used by incremental backup. """
+
+    def __init__(self, drives, failing=()):
+        self.snapshots = dict((drive, []) for drive in drives)
+        self.failing = failing
+        self.exports = []
+        self.removed = []
+        self._popen = subprocess.Popen
+
+    def check_output(self, cmd):
+        assert cmd[:len(RBD)] == RBD
+        args = cmd[len(RBD):]
+        if args[0] == 'ls':
+            return '\n'.join(sorted(self.snapshots))
+        if args[:2] == ['snap', 'ls']:
+            drive = args[-1].split('/')[1]
+            return json.dumps([{'id': i, 'name': name} for i, name
+                               in enumerate(self.snapshots[drive])])
+        raise AssertionError('Unexpected command {0}'.format(cmd))
+
+    def check_call(self, cmd):
+        assert cmd[:len(RBD)] == RBD
+        assert cmd[len(RBD)] == 'snap'
+        action, snap = cmd[len(RBD) + 1:]
+        drive, name = snap.split('/')[1].split('@')
+        if action == 'create':
+            self.snapshots[drive].append(name)
+        else:
+            self.snapshots[drive].remove(name)
+            self.removed.append(snap)
+        return 0
+
+    def call(self, cmd):
+        return self.check_call(cmd)
+
+    def popen(self, cmd, **kwargs):
+        if cmd[0] != 'rbd':
+            return self._popen(cmd, **kwargs)
+        args = cmd[len(RBD):]
+        snap = args[-2]
+        self.exports.append(args)
+        proc = mock.Mock(returncode=0)
+        if snap.split('/')[1].split('@')[0] in self.failing:
+            proc.returncode = 1
+        else:
+            kwargs['stdout'].write('diff of {0}'.format(snap))
+        proc.wait.return_value = proc.returncode
+        return proc
+
+
+class TestIncrementalBackup(object):
+    def setup_method(self, method):
+        self.dst = tempfile.mkdtemp()
+        self.patchers = [
+            mock.patch.object(backup_ceph, 'LOCKFILE',
+                              os.path.join(self.dst, 'lock')),
+            mock.patch.object(backup_ceph, 'datetime'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.now = backup_ceph.datetime.datetime
+
+    def teardown_method(self, method):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.dst)
+
+    def backup(self, rbd, time, skip_errors=False, workers=1):
+        self.now.today.return_value = time
+        with mock.patch.object(subprocess, 'check_output',
+                               side_effect=rbd.check_output), \
+                mock.patch.object(subprocess, 'check_call',
+                                  side_effect=rbd.check_call), \
+                mock.patch.object(subprocess, 'call', side_effect=rbd.call), \
+                mock.patch.object(subprocess, 'Popen', side_effect=rbd.popen):
+            backup_ceph.do_ceph_backup(
+                self.dst, 'pool', 'mon', 'keyring', 'admin',
+                skip_errors, callback=None, workers=workers, incremental=True)
+
+    def manifest(self, time):
+        path = os.path.join(self.dst, 'ceph_backup_{0}.json'.format(
+            time.isoformat()))
+        with open(path) as f:
+            return json.load(f)
+
+    def test_full_then_incremental(self):
+        rbd = FakeRbd(['a'])
+        first = datetime.datetime(2017, 2, 1, 10, 0, 0)
+        second = datetime.datetime(2017, 2, 2, 10, 0, 0)
+        self.backup(rbd, first)
+        self.backup(rbd, second)
+
+        # the first export is a whole image, the next one is a diff from the
+        # previous backup snapshot
+        assert rbd.exports == [
+            ['export-diff', 'pool/a@kd-backup-20170201T100000', '-'],
+            ['export-diff', '--from-snap', 'kd-backup-20170201T100000',
+             'pool/a@kd-backup-20170202T100000', '-'],
+        ]
+        # only the latest backup snapshot is kept
+        assert rbd.snapshots == {'a': ['kd-backup-20170202T100000']}
+        assert rbd.removed == ['pool/a@kd-backup-20170201T100000']
+
+        drives = self.manifest(first)['drives']
+        assert [(d['drive'], d['format'], d['path'], d['snapshot'], d['base'])
+                for d in drives] == [
+            ('a', 'rbd-diff', 'a-20170201T100000.diff.gz',
+             'kd-backup-20170201T100000', None)]
+        drives = self.manifest(second)['drives']
+        assert [(d['drive'], d['format'], d['path'], d['snapshot'], d['base'])
+                for d in drives] == [
+            ('a', 'rbd-diff', 'a-20170202T100000.diff.gz',
+             'kd-backup-20170202T100000', 'kd-backup-20170201T100000')]
+        with gzip.open(os.path.join(self.dst, drives[0]['path'])) as f:
+            assert f.read() == 'diff of pool/a@kd-backup-20170202T100000'
+
+    def test_failed_export(self):
+        rbd = FakeRbd(['a'], failing=['a'])
+        time = datetime.datetime(2017, 2, 1, 10, 0, 0)
+        try:
+            self.backup(rbd, time)
+        except backup_ceph.BackupError:
+            pass
+        else:
+            assert False, 'BackupError is expected'
+
+        # snapshot of the failed backup is removed, so the next backup is
+        # exported from the previous one
+        assert rbd.snapshots == {'a': []}
+        assert rbd.removed == ['pool/a@kd-backup-20170201T100000']
+        assert os.listdir(self.dst) == ['ceph_backup_{0}.json'.format(
+            time.isoformat())]
+        assert self.manifest(time)['drives'] == []
+
+    def test_parallel_errors(self):
+        rbd = FakeRbd(['a', 'b', 'c'], failing=['b'])
+        time = datetime.datetime(2017, 2, 1, 10, 0, 0)
+        try:
+            self.backup(rbd, time, workers=3)
+        except backup_ceph.BackupError as err:
+            assert 'pool/b@kd-backup-20170201T100000' in str(err)
+        else:
+            assert False, 'BackupError is expected'
+
+        drives = self.manifest(time)['drives']
+        assert sorted(d['drive'] for d in drives) == ['a', 'c']
+        assert sorted(os.listdir(self.dst)) == [
+            'a-20170201T100000.diff.gz', 'c-20170201T100000.diff.gz',
+            'ceph_backup_{0}.json'.format(time.isoformat())]
+        assert rbd.snapshots == {'a': ['kd-backup-20170201T100000'],
+                                 'b': [],
+                                 'c': ['kd-backup-20170201T100000']}
+
+    def test_parallel_errors_skipped(self):
+        rbd = FakeRbd(['a', 'b', 'c'], failing=['b'])
+        time = datetime.datetime(2017, 2, 1, 10, 0, 0)
+        self.backup(rbd, time, workers=3, skip_errors=True)
+        drives = self.manifest(time)['drives']
+        assert sorted(d['drive'] for d in drives) == ['a', 'c']
@@ -0,0 +1,115 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+import mock
+
+import backup_master
+
+
+class FileResource(backup_master.BackupResource):
+    name = 'file.txt'
+
+    @classmethod
+    def backup(cls, dst):
+        result = os.path.join(dst, cls.name)
+        with open(result, 'w') as f:
+            f.write('x' * 100)
+        return result
+
+    @classmethod
+    def restore(cls, zip_archive, **kwargs):
+        pass
+
+
+class TestBackup(object):
+    def setup_method(self, method):
+        self.tmp = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp)
+
+    def test_backup_records_stats(self):
+        stats = backup_master.backup_resource(FileResource, self.tmp)
+
+        assert stats['resource'] == 'FileResource'
+        assert stats['size'] == 100
+        assert stats['files'] == ['file.txt']
+
+    def test_backup_error_is_returned(self):
+        error = backup_master.subprocess.CalledProcessError(1, 'cmd')
+        with mock.patch.object(FileResource, 'backup', side_effect=error):
+            assert backup_master.backup_resource(
+                FileResource, self.tmp) is error
+
+    def test_dumps_are_not_compressed_again(self):
+        dst = os.path.join(self.tmp, 'dst')
+        os.makedirs(os.path.join(dst, backup_master.PG_DUMP_DIR))
+        for name in (backup_master.PG_DUMP_FILE, 'file.txt',
+                     os.path.join(backup_master.PG_DUMP_DIR, 'toc.dat')):
+            with open(os.path.join(dst, name), 'w') as f:
+                f.write('x' * 100)
+        result = os.path.join(self.tmp, 'result.zip')
+        with zipfile.ZipFile(result, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            backup_master.zipdir(dst, zipf)
+
+        with zipfile.ZipFile(result) as zipf:
+            types = dict((info.filename, info.compress_type)
+                         for info in zipf.infolist())
+        assert types == {
+            backup_master.PG_DUMP_FILE: zipfile.ZIP_STORED,
+            'postgresql/toc.dat': zipfile.ZIP_STORED,
+            'file.txt': zipfile.ZIP_DEFLATED,
+        }
+
+    @mock.patch.object(backup_master.PostgresResource, 'jobs', 4)
+    @mock.patch.object(backup_master.pwd, 'getpwnam')
+    @mock.patch.object(backup_master.os, 'chown')
+    @mock.patch.object(backup_master.subprocess, 'check_call')
+    def test_postgres_directory_dump(self, check_call_mock, chown_mock,
+                                     getpwnam_mock):
+        getpwnam_mock.return_value.pw_uid = 26
+        dumped_to = []
+
+        def pg_dump(cmd):
+            assert '-Fd' in cmd and cmd[cmd.index('-j') + 1] == '4'
+            out = cmd[cmd.index('-f') + 1]
+            dumped_to.append(out)
+            os.mkdir(out)
+            with open(os.path.join(out, 'toc.dat'), 'w') as f:
+                f.write('x' * 100)
+        check_call_mock.side_effect = pg_dump
+
+        result = backup_master.PostgresResource.backup(self.tmp)
+
+        assert result == os.path.join(self.tmp, backup_master.PG_DUMP_DIR)
+        assert os.listdir(self.tmp) == [backup_master.PG_DUMP_DIR]
+        assert os.listdir(result) == ['toc.dat']
+        # postgres can't enter dst (it's created by mkdtemp), so the dump
+        # must be written outside of it
+        tmp_dir = os.path.dirname(dumped_to[0])
+        assert not tmp_dir.startswith(self.tmp)
+        chown_mock.assert_called_once_with(tmp_dir, 26, -1)
+        assert not os.path.exists(tmp_dir)
@@ -0,0 +1,82 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+import mock
+
+import backup_node
+
+
+class TestBackupVolumes(object):
+    def setup_method(self, method):
+        self.tmp = tempfile.mkdtemp()
+        self.storage = os.path.join(self.tmp, 'storage')
+        for user, volume in (('1', 'a'), ('1', 'b'), ('2', 'c')):
+            path = os.path.join(self.storage, user, volume, 'dir')
+            os.makedirs(path)
+            with open(os.path.join(path, 'data'), 'w') as f:
+                f.write(volume * 100)
+        self.dst = os.path.join(self.tmp, 'backup')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp)
+
+    def test_parallel_backup_writes_manifest(self):
+        with mock.patch.object(backup_node, 'STORAGE_LOCATION',
+                               self.storage), \
+                mock.patch.object(backup_node, 'get_zfs_mountpoints',
+                                  side_effect=OSError):
+            entries = backup_node.backup_volumes(
+                self.dst, backup_node.list_volumes(), workers=3,
+                compress_threads=2)
+
+        assert len(entries) == 3
+        with open(os.path.join(self.dst, backup_node.MANIFEST)) as f:
+            manifest = json.load(f)
+        assert [(v['user'], v['volume'], v['format'], v['path'])
+                for v in manifest['volumes']] == [
+            ('1', 'a', 'tar.gz', '1/a.tar.gz'),
+            ('1', 'b', 'tar.gz', '1/b.tar.gz'),
+            ('2', 'c', 'tar.gz', '2/c.tar.gz'),
+        ]
+        with tarfile.open(os.path.join(self.dst, '2', 'c.tar.gz')) as tar:
+            # every file is stored once
+            assert sorted(tar.getnames()) == ['.', 'dir', 'dir/data']
+            assert tar.extractfile('dir/data').read() == 'c' * 100
+
+    def test_failed_compressor_leaves_no_file(self):
+        result_dir = os.path.join(self.tmp, 'result')
+        os.makedirs(result_dir)
+        with mock.patch.object(backup_node, 'iterate_src',
+                               return_value=[]):
+            try:
+                backup_node.make_tar_backup(
+                    'a', self.storage, result_dir, compressor=['false'])
+            except backup_node.BackupError:
+                pass
+            else:
+                assert False, 'BackupError is expected'
+        assert os.listdir(result_dir) == []
@@ -18,8 +18,13 @@
 # You should have received a copy of the GNU General Public License
 # along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
 
-from backup_node_merge import group_by_timestamp, MergeError
-from tests_integration.lib.integration_test_utils import assert_raises, assert_eq
+import os
+import shutil
+import tempfile
+
+from backup_node_merge import (do_merge, group_by_timestamp, get_image_chain,
+                               MergeError)
+from tests_integration.lib.utils import assert_raises, assert_eq
 
 
 def test_grouping():
@@ -55,3 +60,50 @@ def test_grouping_skipping_raises():
             "local_pv_backup_2016-09-22T05:02:00.0000"]
     g1, = list(group_by_timestamp(data, 3600, skip_errors=True))
     assert g1 == ['local_pv_backup_2016-09-22T05:02:00.0000']
+
+
+def test_image_chain():
+    volumes = [
+        {'user': '1', 'volume': 'a', 'format': 'zfs',
+         'snapshot': 'pool/a@kd-backup-1', 'base': None},
+        {'user': '1', 'volume': 'b', 'format': 'tar.gz'},
+        {'user': '1', 'volume': 'a', 'format': 'zfs',
+         'snapshot': 'pool/a@kd-backup-2', 'base': 'pool/a@kd-backup-1'},
+        {'user': '1', 'volume': 'a', 'format': 'zfs',
+         'snapshot': 'pool/a@kd-backup-3', 'base': 'pool/a@kd-backup-2'},
+    ]
+    chain = get_image_chain(volumes, '1', 'a')
+    assert_eq([v['snapshot'] for v in chain],
+              ['pool/a@kd-backup-1', 'pool/a@kd-backup-2',
+               'pool/a@kd-backup-3'])
+    assert_eq(get_image_chain(volumes, '1', 'b'), [volumes[1]])
+    with assert_raises(MergeError):
+        get_image_chain(volumes[1:], '1', 'a')
+
+
+def test_merge_moves_files():
+    backups = tempfile.mkdtemp()
+    try:
+        folders = ["local_pv_backup_2016-09-22T05:01:00.0000",
+                   "local_pv_backup_2016-09-22T05:02:00.0000",
+                   "local_pv_backup_2016-09-22T07:01:00.0000"]
+        for i, folder in enumerate(folders):
+            os.makedirs(os.path.join(backups, folder, '1'))
+            with open(os.path.join(backups, folder, '1',
+                                   '{0}.tar.gz'.format(i)), 'w') as f:
+                f.write('x' * 10)
+        inode = os.stat(os.path.join(backups, folders[1], '1',
+                                     '1.tar.gz')).st_ino
+
+        merged = do_merge(backups, precision=1, dry_run=False,
+                          include_latest=False, skip_errors=False, workers=2)
+
+        assert_eq(merged, 10)
+        assert_eq(sorted(os.listdir(backups)), [folders[0], folders[2]])
+        assert_eq(sorted(os.listdir(os.path.join(backups, folders[0], '1'))),
+                  ['0.tar.gz', '1.tar.gz'])
+        # file is renamed, not copied
+        assert_eq(os.stat(os.path.join(backups, folders[0], '1',
+                                       '1.tar.gz')).st_ino, inode)
+    finally:
+        shutil.rmtree(backups)
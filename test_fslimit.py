@@ -0,0 +1,107 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+import fslimit
+
+
+class TestFSLimit(object):
+    def setup_method(self, method):
+        self.tmp = tempfile.mkdtemp()
+        self.overlay = os.path.join(self.tmp, 'overlay')
+        self.dirs = {}
+        for name in ('c1', 'c2', 'c3'):
+            path = os.path.join(self.overlay, name)
+            os.makedirs(path)
+            self.dirs[name] = path
+        self.patchers = [
+            mock.patch.object(fslimit, 'PROJECTS',
+                              os.path.join(self.tmp, 'projects')),
+            mock.patch.object(fslimit, 'PROJID',
+                              os.path.join(self.tmp, 'projid')),
+            mock.patch.object(fslimit, 'STATE',
+                              os.path.join(self.tmp, 'fslimit.json')),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.fs = {'mount_point': '/'}
+
+    def teardown_method(self, method):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp)
+
+    def run(self, *limits):
+        argv = ['fslimit.py', 'containers'] + list(limits)
+        with mock.patch.object(fslimit.sys, 'argv', argv), \
+                mock.patch.object(fslimit.subprocess, 'call',
+                                  return_value=0) as call:
+            fslimit.fslimit(self.fs, self.overlay, self.dirs)
+        return call
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def test_single_xfs_quota_call(self):
+        call = self.run('c1=1g', 'c2=2g')
+        call.assert_called_once_with([
+            'xfs_quota', '-x',
+            '-c', 'project -s c1', '-c', 'limit -p bsoft=1g bhard=1g c1',
+            '-c', 'project -s c2', '-c', 'limit -p bsoft=2g bhard=2g c2',
+            '/'])
+        assert self.read(fslimit.PROJECTS) == [
+            '1:' + self.dirs['c1'], '2:' + self.dirs['c2']]
+        assert self.read(fslimit.PROJID) == ['c1:1', 'c2:2']
+
+    def test_unchanged_limits_are_skipped(self):
+        self.run('c1=1g', 'c2=2g')
+        assert not self.run('c1=1g', 'c2=2g').called
+
+        call = self.run('c1=1g', 'c2=3g', 'c3=1g')
+        call.assert_called_once_with([
+            'xfs_quota', '-x',
+            '-c', 'project -s c2', '-c', 'limit -p bsoft=3g bhard=3g c2',
+            '-c', 'project -s c3', '-c', 'limit -p bsoft=1g bhard=1g c3',
+            '/'])
+        assert self.read(fslimit.PROJID) == ['c1:1', 'c2:2', 'c3:3']
+
+    def test_removed_dirs_are_dropped(self):
+        self.run('c1=1g', 'c2=2g')
+        del self.dirs['c1']
+        assert not self.run().called
+        assert self.read(fslimit.PROJID) == ['c2:2']
+
+    def test_state_is_rebuilt_from_projects(self):
+        with open(fslimit.PROJECTS, 'w') as f:
+            f.write('5:{0}\n7:/other/path\n'.format(self.dirs['c1']))
+        with open(fslimit.PROJID, 'w') as f:
+            f.write('c1:5\nother:7\n')
+
+        call = self.run('c1=1g', 'c2=1g')
+
+        assert call.call_args[0][0][2:4] == ['-c', 'project -s c1']
+        assert self.read(fslimit.PROJID) == ['c1:5', 'other:7', 'c2:8']
@@ -0,0 +1,119 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+
+import mock
+
+import k8s2etcd
+from k8s2etcd import Relay
+
+
+def pod_event(rv, event_type='MODIFIED'):
+    return {
+        'type': event_type,
+        'object': {
+            'metadata': {
+                'name': 'pod-{0}'.format(rv),
+                'namespace': 'ns',
+                'resourceVersion': str(rv),
+                'labels': {'kuberdock-pod-uid': 'uid'},
+                'annotations': {'kuberdock-container-kubes': '{"c": 2}',
+                                'kuberdock-pod-config': 'x' * 1000},
+            },
+            'spec': {'nodeName': 'node1', 'containers': [{'env': []}]},
+            'status': {'phase': 'Running', 'startTime': '2017-01-01'},
+        },
+    }
+
+
+def add(relay, rv):
+    data = pod_event(rv)
+    relay.add(json.dumps(data), data)
+
+
+def test_trim_keeps_fields_used_by_listeners():
+    trimmed = k8s2etcd.trim(pod_event(1))
+    assert trimmed == {
+        'type': 'MODIFIED',
+        'object': {
+            'metadata': {
+                'name': 'pod-1',
+                'namespace': 'ns',
+                'resourceVersion': '1',
+                'labels': {'kuberdock-pod-uid': 'uid'},
+                'annotations': {'kuberdock-container-kubes': '{"c": 2}'},
+            },
+            'spec': {'nodeName': 'node1'},
+            'status': {'phase': 'Running', 'startTime': '2017-01-01'},
+        },
+    }
+
+
+@mock.patch.object(k8s2etcd, 'store')
+@mock.patch.object(k8s2etcd, 'session')
+@mock.patch.object(k8s2etcd, 'batch_size', 2)
+def test_flush_sends_batches(session, store):
+    session.put.return_value.ok = True
+    relay = Relay()
+    for rv in range(1, 4):
+        add(relay, rv)
+
+    assert relay.flush()
+    assert session.put.call_count == 2
+    batches = [json.loads(c[1]['data']['value'])
+               for c in session.put.call_args_list]
+    assert [[e['object']['metadata']['resourceVersion'] for _, e in batch]
+            for batch in batches] == [['1', '2'], ['3']]
+    assert relay.metrics.sent == 3
+    assert relay.metrics.batches == 2
+    # checkpoint is periodical, not per event
+    assert not store.called
+    relay.checkpoint(force=True)
+    store.assert_called_once_with('3')
+
+
+@mock.patch.object(k8s2etcd, 'store')
+@mock.patch.object(k8s2etcd, 'session')
+def test_failed_batch_stays_in_backlog(session, store):
+    session.put.return_value.ok = False
+    relay = Relay()
+    add(relay, 1)
+
+    assert not relay.flush()
+    assert len(relay.backlog) == 1
+    assert relay.metrics.failed_puts == 1
+
+    session.put.return_value.ok = True
+    assert relay.flush()
+    assert not relay.backlog
+    assert relay.sent_version == '1'
+
+
+@mock.patch.object(k8s2etcd, 'max_backlog', 2)
+def test_backlog_is_bounded():
+    relay = Relay()
+    for rv in range(1, 4):
+        add(relay, rv)
+    assert [e['object']['metadata']['resourceVersion']
+            for _, e in relay.backlog] == ['2', '3']
+    assert relay.metrics.dropped == 1
+    assert relay.received_version == '3'
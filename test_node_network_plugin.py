@@ -0,0 +1,158 @@
+
+# KuberDock - is a platform that allows users to run applications using Docker
+# container images and create SaaS / PaaS based on these applications.
+# Copyright (C) 2017 Cloud Linux INC
+#
+# This file is part of KuberDock.
+#
+# KuberDock is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# KuberDock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KuberDock; if not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import mock
+
+import node_network_plugin
+from node_network_plugin import IPSetSync
+
+
+def etcd_tree(users, hosts=()):
+    def node(key, children=None, value=None):
+        item = {'key': key, 'modifiedIndex': 1}
+        if children is not None:
+            item['dir'] = True
+            item['nodes'] = children
+        if value is not None:
+            item['value'] = value
+        return item
+
+    prefix = '/kuberdock/network/plugin'
+    return node(prefix, [
+        node(prefix + '/users', [
+            node('{0}/users/{1}'.format(prefix, user), [
+                node('{0}/users/{1}/{2}'.format(prefix, user, ip),
+                     value=json.dumps(value))
+                for ip, value in pods.items()])
+            for user, pods in users.items()]),
+        node(prefix + '/registered_hosts', [
+            node('{0}/registered_hosts/{1}'.format(prefix, host))
+            for host in hosts]),
+    ])
+
+
+@mock.patch.object(node_network_plugin, '_ipset_restore')
+def test_sync_changed_sets_only(ipset_restore):
+    ipset_restore.return_value = True
+    etcd = mock.Mock()
+    users = {
+        1: {'10.1.0.2': {'node': '192.168.0.2', 'service': '10.254.0.5'}},
+        2: {'10.1.0.3': {'node': None, 'service': None}},
+    }
+    etcd.tree.return_value = etcd_tree(users, ['192.168.0.3']), 10
+    sync = IPSetSync(etcd)
+
+    assert sync.sync() == 10
+    commands = ipset_restore.call_args[0][0]
+    assert 'add kuberdock_user_1_temp 10.1.0.2' in commands
+    assert 'add kuberdock_user_1_temp 10.254.0.5' in commands
+    assert 'add kuberdock_user_2_temp 10.1.0.3' in commands
+    assert 'add kuberdock_nodes_temp 192.168.0.2' in commands
+    assert 'add kuberdock_nodes_temp 192.168.0.3' in commands
+    assert ipset_restore.call_count == 1
+
+    # nothing changed -- nothing to restore
+    etcd.tree.return_value = etcd_tree(users, ['192.168.0.3']), 11
+    assert sync.sync() == 11
+    assert ipset_restore.call_count == 1
+
+    users[2]['10.1.0.4'] = {'node': None, 'service': None}
+    etcd.tree.return_value = etcd_tree(users, ['192.168.0.3']), 12
+    sync.sync()
+    commands = ipset_restore.call_args[0][0]
+    assert 'add kuberdock_user_2_temp 10.1.0.4' in commands
+    assert not [c for c in commands if 'kuberdock_user_1' in c]
+    assert not [c for c in commands if 'kuberdock_nodes' in c]
+
+
+def test_ipset_commands():
+    assert node_network_plugin._ipset_commands('s', ['1.1.1.1']) == [
+        'create s hash:ip',
+        'create s_temp hash:ip',
+        'flush s_temp',
+        'add s_temp 1.1.1.1',
+        'swap s_temp s',
+        'destroy s_temp',
+    ]
+
+
+@mock.patch.object(node_network_plugin, '_iptables_check')
+@mock.patch.object(node_network_plugin, '_iptables_restore')
+def test_add_public_ip_rules(iptables_restore, iptables_check):
+    iptables_check.side_effect = [False, True, False]
+    ports = [(80, 8080, 'tcp'), (53, 53, 'udp')]
+    node_network_plugin.add_public_ip_rules('10.1.0.2', '1.2.3.4', ports)
+
+    assert iptables_restore.call_count == 1
+    (nat_table, nat), (mangle_table, mangle) = iptables_restore.call_args[0][0]
+    assert (nat_table, mangle_table) == ('nat', 'mangle')
+    assert nat == [
+        ':KD-PUB-10.1.0.2 - [0:0]',
+        ':KD-SNAT-10.1.0.2 - [0:0]',
+        '-A KD-PUB-10.1.0.2 -d 1.2.3.4 -p tcp --dport 8080 '
+        '-j DNAT --to-destination 10.1.0.2:80',
+        '-A KD-PUB-10.1.0.2 -d 1.2.3.4 -p udp --dport 53 '
+        '-j DNAT --to-destination 10.1.0.2:53',
+        '-A KD-SNAT-10.1.0.2 -s 10.1.0.2 -j SNAT --to-source 1.2.3.4',
+        '-I KUBERDOCK-PUBLIC-IP -d 1.2.3.4 -j KD-PUB-10.1.0.2',
+        '-I KUBERDOCK-PUBLIC-IP-SNAT -s 10.1.0.2 -j KD-SNAT-10.1.0.2',
+    ]
+    # jump to mangle chain already exists
+    assert mangle == [
+        ':KD-PUB-10.1.0.2 - [0:0]',
+        '-A KD-PUB-10.1.0.2 -d 1.2.3.4 -p tcp --dport 8080 '
+        '-j MARK --set-mark 2',
+        '-A KD-PUB-10.1.0.2 -d 1.2.3.4 -p udp --dport 53 '
+        '-j MARK --set-mark 2',
+    ]
+
+
+@mock.patch.object(node_network_plugin, 'delete_ip')
+@mock.patch.object(node_network_plugin, '_iptables_check')
+@mock.patch.object(node_network_plugin, '_iptables_restore')
+def test_delete_public_ip_rules(iptables_restore, iptables_check, delete_ip):
+    ports = [(80, 8080, 'tcp'), (53, 53, 'udp')]
+    # no legacy rules, all jumps exist
+    iptables_check.side_effect = [False, True, True, True]
+    node_network_plugin.delete_public_ip_rules('10.1.0.2', '1.2.3.4', ports)
+    (_, nat), (_, mangle) = iptables_restore.call_args[0][0]
+    assert nat[2:] == [
+        '-D KUBERDOCK-PUBLIC-IP -d 1.2.3.4 -j KD-PUB-10.1.0.2',
+        '-D KUBERDOCK-PUBLIC-IP-SNAT -s 10.1.0.2 -j KD-SNAT-10.1.0.2',
+        '-X KD-PUB-10.1.0.2',
+        '-X KD-SNAT-10.1.0.2',
+    ]
+    assert mangle[1:] == [
+        '-D KUBERDOCK-PUBLIC-IP -d 1.2.3.4 -j KD-PUB-10.1.0.2',
+        '-X KD-PUB-10.1.0.2',
+    ]
+    assert not delete_ip.called
+
+    # legacy rules of previous version of the plugin together with chains
+    # created after upgrade
+    iptables_restore.reset_mock()
+    iptables_check.side_effect = [True, True, True, True]
+    node_network_plugin.delete_public_ip_rules('10.1.0.2', '1.2.3.4', ports)
+    assert delete_ip.call_count == 2
+    (_, nat), (_, mangle) = iptables_restore.call_args[0][0]
+    assert nat[-2:] == ['-X KD-PUB-10.1.0.2', '-X KD-SNAT-10.1.0.2']
+    assert '-D KUBERDOCK-PUBLIC-IP -d 1.2.3.4 -j KD-PUB-10.1.0.2' in mangle
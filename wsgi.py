@@ -56,7 +56,7 @@ except (TypeError, AttributeError):
 # ==============================================================================
 
 
-from kubedock import frontend, api, listeners
+from kubedock import frontend, api, listeners_supervisor
 from kubedock.settings import PRE_START_HOOK_ENABLED, SENTRY_ENABLE
 from kubedock.core import ExclusiveLock
 
@@ -95,30 +95,20 @@ try:
 except ImportError:
     pass
 else:
+    # Listeners are run by uwsgi mules, see listeners_mule.py
     if uwsgi.worker_id() == 1:
-        d = gevent.spawn(listeners.listen_pods, back_app)
-        gevent.spawn(listeners.listen_services, back_app)
-        f = gevent.spawn(listeners.listen_nodes, back_app)
-        e = gevent.spawn(listeners.listen_events, back_app)
         if PRE_START_HOOK_ENABLED:
             j = gevent.spawn(api.pre_start_hook, back_app)
         k = gevent.spawn(api.populate_registered_hosts, back_app)
-        #  l = gevent.spawn(listeners.listen_extended_statuses, back_app)
-        s = gevent.spawn(listeners.listen_pod_states, back_app)
 
 if __name__ == "__main__":
 
     import os
     if os.environ.get('WERKZEUG_RUN_MAIN'):
-        d = gevent.spawn(listeners.listen_pods, back_app)
-        gevent.spawn(listeners.listen_services, back_app)
-        f = gevent.spawn(listeners.listen_nodes, back_app)
-        e = gevent.spawn(listeners.listen_events, back_app)
+        d = gevent.spawn(listeners_supervisor.run, back_app)
         if PRE_START_HOOK_ENABLED:
             j = gevent.spawn(api.pre_start_hook, back_app)
         k = gevent.spawn(api.populate_registered_hosts, back_app)
-        #  l = gevent.spawn(listeners.listen_extended_statuses, back_app)
-        s = gevent.spawn(listeners.listen_pod_states, back_app)
 
     @run_with_reloader
     def run_server():